@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Extract Benchmark
+زمن استخراج رابط البث: تشغيل yt-dlp كعملية منفصلة (الطريقة السابقة) مقابل
+ExtractEngine داخل العملية، أول طلب (بارد) ثم الطلبات التالية (دافئة)
+
+المصدر قائمة HLS يقدّمها خادم محلي، لذلك لا يحتاج الاختبار إلى الشبكة.
+الاستخدام: python3 benchmarks/extract_bench.py [عدد التكرارات]
+"""
+
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stream_extract import ExtractEngine  # noqa: E402
+
+PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720
+720p.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1200000,RESOLUTION=854x480
+480p.m3u8
+"""
+MEDIA = """#EXTM3U
+#EXT-X-TARGETDURATION:2
+#EXT-X-MEDIA-SEQUENCE:1
+#EXTINF:2.0,
+seg1.ts
+"""
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def report(name, samples):
+    line = f'{name:<28} n={len(samples):<3} median={statistics.median(samples) * 1000:8.1f} ms'
+    if len(samples) > 1:
+        line += f'  min={min(samples) * 1000:8.1f} ms  max={max(samples) * 1000:8.1f} ms'
+    print(line)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as directory:
+        root = Path(directory)
+        (root / 'live.m3u8').write_text(PLAYLIST)
+        (root / '720p.m3u8').write_text(MEDIA)
+        (root / '480p.m3u8').write_text(MEDIA)
+        (root / 'cookies.txt').write_text(COOKIES)
+        server = serve(directory)
+        url = f'http://127.0.0.1:{server.server_port}/live.m3u8'
+
+        def run_process():
+            result = subprocess.run(
+                [sys.executable, '-m', 'yt_dlp', '--cookies', str(root / 'cookies.txt'),
+                 '--get-url', '-f', 'best', url],
+                capture_output=True, text=True, timeout=60
+            )
+            assert result.returncode == 0, result.stderr
+
+        engine = ExtractEngine()
+        extract = partial(engine.extract, url, COOKIES, fmt='best', timeout=60)
+
+        report('yt-dlp process', [timed(run_process) for _ in range(runs)])
+        report('in-process cold (import)', [timed(extract)])
+        report('in-process warm', [timed(extract) for _ in range(runs)])
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
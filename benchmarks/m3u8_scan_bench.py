@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+M3U8 Scan Benchmark
+مسح روابط M3U8 في صفحة كبيرة (مثل حزم web.telegram.org): الطريقة السابقة (ثلاثة
+تعابير + BeautifulSoup) مقابل M3U8Scanner بمرور واحد، على النص كاملاً وعلى دفعات
+
+الاستخدام: python3 benchmarks/m3u8_scan_bench.py [حجم الصفحة بالميغابايت]
+"""
+
+import random
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram_m3u8_extractor import SCAN_CHUNK_SIZE, M3U8Scanner, sort_candidates  # noqa: E402
+
+
+def legacy_extract(html_content):
+    """نسخة extract_m3u8_from_html قبل الماسح (للمقارنة فقط)"""
+    from bs4 import BeautifulSoup
+
+    m3u8_urls = []
+    patterns = [
+        r'https?://[^\s<>"\']+?\.m3u8[^\s<>"\']*',
+        r'"(https?://[^"]+\.m3u8[^"]*)"',
+        r"'(https?://[^']+\.m3u8[^']*)'",
+    ]
+    for pattern in patterns:
+        m3u8_urls.extend(re.findall(pattern, html_content))
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for script in soup.find_all('script'):
+        if script.string:
+            m3u8_urls.extend(re.findall(r'https?://[^\s<>"\']+?\.m3u8[^\s<>"\']*', script.string))
+    unique_urls = list(set(m3u8_urls))
+    return sort_candidates(unique_urls)
+
+
+def build_page(size_mb, seed=7):
+    """صفحة HTML فيها حزم JS كبيرة بين عناصر كثيرة وعدد قليل من روابط M3U8 (بعضها مكرر)"""
+    rng = random.Random(seed)
+    words = ['function', 'return', 'var', 'this', 'null', 'https://web.telegram.org/k/', 'api/x',
+             '=>', '{', '}', ';', 'document', 'window', 'Promise', 'async', 'await',
+             '</script><div class="chat"><span>msg</span></div><script>']
+    urls = [f'https://vcdn{i}.telegram.org/file/stream/{i * 7919}/master.m3u8?token={i:x}' for i in range(40)]
+    parts = ['<html><head><script>']
+    size = 0
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        if rng.random() < 0.001:
+            piece = f'"{rng.choice(urls)}"'
+        else:
+            piece = rng.choice(words)
+        parts.append(piece)
+        parts.append(' ' if rng.random() < 0.7 else '')
+        size += len(piece) + 1
+    parts.append('</script></head><body></body></html>')
+    return ''.join(parts)
+
+
+def scan_whole(html):
+    scanner = M3U8Scanner()
+    scanner.feed(html)
+    scanner.close()
+    return sort_candidates(scanner.urls)
+
+
+def scan_chunked(html):
+    scanner = M3U8Scanner()
+    for start in range(0, len(html), SCAN_CHUNK_SIZE):
+        scanner.feed(html[start:start + SCAN_CHUNK_SIZE])
+    scanner.close()
+    return sort_candidates(scanner.urls)
+
+
+def measure(name, func, html, runs=3):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func(html)
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<22} best={min(times) * 1000:8.1f} ms  peak={peak / 1024 / 1024:7.1f} MB  urls={len(result)}')
+    return result
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    html = build_page(size_mb)
+    print(f'page: {len(html) / 1024 / 1024:.1f} MB')
+    legacy = measure('legacy (3 regex + bs4)', legacy_extract, html)
+    whole = measure('scanner (whole text)', scan_whole, html)
+    chunked = measure('scanner (64 KB chunks)', scan_chunked, html)
+    assert set(legacy) == set(whole) == set(chunked), 'scanner found different URLs'
+    assert whole == chunked, 'chunked scan changed the order'
+
+
+if __name__ == '__main__':
+    main()
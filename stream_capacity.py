@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Stream Capacity
+جدولة قبول البثوث حسب سعة المعالج: كلفة كل إعداد جودة (LOW/MEDIUM/HIGH/ULTRA/CUSTOM)
+تُقاس بتشغيل معايرة على مصدر اصطناعي محلي، ثم يُقبل البث أو يُوضع في الطابور (أو يُرفض
+عندما يمتلئ الطابور)
+"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+PRESET_NAMES = ('low', 'medium', 'high', 'ultra', 'custom')
+PRESET_PATTERN = re.compile(r'^(LOW|MEDIUM|HIGH|ULTRA|CUSTOM)_(\w+)="([^"]*)"', re.MULTILINE)
+QUALITY_PATTERN = re.compile(r'^QUALITY_MODE="([^"]*)"', re.MULTILINE)
+BENCH_PATTERN = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+# كلفة تقريبية (أنوية) لعملية نسخ مباشر بدون ترميز
+COPY_COST = 0.05
+# تقدير قبل المعايرة: 1080p30 بإعداد ultrafast ≈ نواة واحدة
+REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
+
+
+class CapacityError(RuntimeError):
+    """لا توجد سعة كافية ولا مكان في الطابور"""
+
+
+def load_presets(config_file):
+    """إعدادات الجودة من config.sh: {'ultra': {'resolution': ..., 'fps': ..., 'bitrate': ...}}"""
+    presets = {}
+    content = Path(config_file).read_text(encoding='utf-8')
+    for name, field, value in PRESET_PATTERN.findall(content):
+        presets.setdefault(name.lower(), {})[field.lower()] = value
+    return presets
+
+
+def quality_mode(config_file):
+    """QUALITY_MODE الحالي في config.sh (ultra افتراضياً كما في get_quality_settings)"""
+    match = QUALITY_PATTERN.search(Path(config_file).read_text(encoding='utf-8'))
+    mode = match.group(1).lower() if match else 'ultra'
+    return mode if mode in PRESET_NAMES else 'ultra'
+
+
+def estimate_cost(preset):
+    """تقدير أولي من معدل البكسلات إلى أن تنتهي المعايرة"""
+    try:
+        width, height = (int(x) for x in preset['resolution'].split('x'))
+        fps = int(preset['fps'])
+    except (KeyError, ValueError):
+        return 1.0
+    return round(width * height * fps / REFERENCE_PIXEL_RATE, 3)
+
+
+def calibrate_preset(preset, seconds=5):
+    """ترميز مصدر اصطناعي (testsrc2 + sine) بإعدادات الإعداد وقياس زمن المعالج لكل ثانية وسائط"""
+    args = [
+        'ffmpeg', '-hide_banner', '-nostats', '-benchmark',
+        '-f', 'lavfi', '-i', f"testsrc2=size={preset['resolution']}:rate={preset['fps']}",
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=44100',
+        '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency',
+        '-b:v', preset['bitrate'], '-maxrate', preset['maxrate'], '-bufsize', preset['bufsize'],
+        '-pix_fmt', 'yuv420p', '-g', str(int(preset['fps']) * 2),
+        '-c:a', 'aac', '-b:a', preset.get('audio_bitrate', '128k'),
+        '-f', 'null', '-'
+    ]
+    started = time.time()
+    result = subprocess.run(args, capture_output=True, text=True, timeout=seconds * 20)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-200:])
+    match = BENCH_PATTERN.search(result.stderr)
+    if match:
+        cpu_seconds = float(match.group(1)) + float(match.group(2))
+    else:
+        # بدون -benchmark: الزمن الفعلي حد أدنى تقريبي (نواة واحدة على الأقل)
+        cpu_seconds = time.time() - started
+    return round(cpu_seconds / seconds, 3)
+
+
+class CapacityScheduler:
+    """حجز الأنوية لكل بث نشط، مع طابور FIFO للبثوث التي لا تتسع لها السعة الحالية"""
+
+    def __init__(self, presets, cores=None, target=0.8, max_queued=10,
+                 on_admit=None, on_change=None):
+        self.cores = cores or len(os.sched_getaffinity(0))
+        self.budget = round(self.cores * target, 2)
+        self.max_queued = max_queued
+        self.presets = presets
+        self.costs = {name: estimate_cost(preset) for name, preset in presets.items()}
+        self.calibrated = False
+        self._lock = threading.Lock()
+        self._active = {}
+        self._queue = OrderedDict()
+        self._on_admit = on_admit
+        self._on_change = on_change
+
+    def cost(self, preset_name, copy=False):
+        if copy:
+            return COPY_COST
+        return self.costs.get(preset_name, max(self.costs.values(), default=1.0))
+
+    def load_costs(self, costs):
+        """كلفة محفوظة من معايرة سابقة (تُستخدم حتى تنتهي معايرة هذا التشغيل)"""
+        with self._lock:
+            self.costs.update({k: v for k, v in costs.items() if k in self.presets})
+        self._changed()
+
+    def calibrate(self, seconds=5):
+        """قياس كلفة كل إعداد جودة بالتتابع؛ الفشل يُبقي التقدير السابق"""
+        for name, preset in self.presets.items():
+            try:
+                cost = calibrate_preset(preset, seconds)
+            except Exception as e:
+                print(f"تعذّرت معايرة الإعداد {name}: {e}")
+                continue
+            with self._lock:
+                self.costs[name] = cost
+            print(f"معايرة {name}: {cost} نواة لكل بث")
+        self.calibrated = True
+        self._changed()
+
+    def used(self):
+        with self._lock:
+            return round(sum(self._active.values()), 3)
+
+    def admit(self, stream_id, cost):
+        """'admitted' أو 'queued'؛ يرفع CapacityError عندما يمتلئ الطابور
+
+        البث الذي تتجاوز كلفته السعة كلها (تقدير قبل المعايرة على خادم صغير مثلاً)
+        يُقبل إذا لم يعمل غيره، وإلا ينتظر في الطابور حتى يخلو الخادم.
+        """
+        with self._lock:
+            if stream_id in self._active:
+                return 'admitted'
+            if not self._queue and self._fits(cost):
+                self._active[stream_id] = cost
+                decision = 'admitted'
+            elif len(self._queue) < self.max_queued:
+                self._queue[stream_id] = cost
+                decision = 'queued'
+            else:
+                raise CapacityError('لا توجد سعة كافية والطابور ممتلئ')
+        self._changed()
+        return decision
+
+    def reserve(self, key, cost):
+        """حجز خارج الطابور لعملية مشتركة (مثل مُرمِّز التوزيع) أو تعديل حجز قائم"""
+        with self._lock:
+            self._active[key] = cost
+        self._changed()
+
+    def release(self, key):
+        """تحرير حجز (أو إزالة من الطابور) ثم قبول ما يتسع من رأس الطابور"""
+        admitted = []
+        with self._lock:
+            self._active.pop(key, None)
+            self._queue.pop(key, None)
+            while self._queue:
+                stream_id, cost = next(iter(self._queue.items()))
+                if not self._fits(cost):
+                    break
+                self._queue.popitem(last=False)
+                self._active[stream_id] = cost
+                admitted.append(stream_id)
+        self._changed()
+        for stream_id in admitted:
+            if self._on_admit:
+                try:
+                    self._on_admit(stream_id)
+                except Exception as e:
+                    print(f"خطأ في قبول البث {stream_id} من الطابور: {e}")
+
+    def _fits(self, cost):
+        """يتسع البث ضمن السعة المتبقية، أو لا يعمل شيء آخر (تحت القفل)"""
+        return not self._active or sum(self._active.values()) + cost <= self.budget
+
+    def snapshot(self):
+        with self._lock:
+            used = round(sum(self._active.values()), 3)
+            return {
+                'cores': self.cores,
+                'budget': self.budget,
+                'used': used,
+                'free': round(max(self.budget - used, 0), 3),
+                'calibrated': self.calibrated,
+                'preset_costs': dict(self.costs),
+                'active': dict(self._active),
+                'queued': list(self._queue),
+                'max_queued': self.max_queued,
+                'updated_at': time.time()
+            }
+
+    def _changed(self):
+        if self._on_change:
+            try:
+                self._on_change(self.snapshot())
+            except Exception as e:
+                print(f"خطأ في مستمع السعة: {e}")
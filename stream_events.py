@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Stream Event Bus
+ناقل أحداث لقناة Server-Sent Events (تغيّر الحالات وأسطر السجلات)
+الأحداث المشتركة تمر عبر جدول في المخزن حتى تصل إلى جميع عمليات gunicorn
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+
+class EventBus:
+    """توزيع الأحداث على جميع المشتركين، كل مشترك له طابور محدود"""
+
+    def __init__(self, max_queue=1000):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._listeners = []
+        self._max_queue = max_queue
+
+    def add_listener(self, callback):
+        """دالة تُستدعى مباشرة مع كل حدث: callback(event_type, data, seq)
+
+        seq رقم الحدث في جدول الأحداث المشترك (None للأحداث المحلية).
+        """
+        self._listeners.append(callback)
+
+    def subscribe(self, accept=None):
+        """إنشاء طابور اشتراك؛ accept(event) اختيارية لتصفية الأحداث قبل إدخالها"""
+        q = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            self._subscribers[q] = accept
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def publish(self, event_type, data, seq=None):
+        for callback in self._listeners:
+            try:
+                callback(event_type, data, seq)
+            except Exception as e:
+                print(f"خطأ في مستمع الأحداث: {e}")
+        event = {'type': event_type, 'data': data, 'seq': seq}
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for q, accept in subscribers:
+            if accept and not accept(event):
+                continue
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # مشترك بطيء: نتخلص من أقدم حدث بدل أن نوقف الناشر
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stream(self, accept=None, keepalive=15):
+        """مولّد نصوص SSE لمشترك واحد، مع نبضات keepalive"""
+        q = self.subscribe(accept)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                data = json.dumps(event['data'], ensure_ascii=False)
+                # رقم الحدث المشترك (id) يطابق cursor في واجهة السجلات
+                event_id = f"id: {event['seq']}\n" if event['seq'] is not None else ''
+                yield f"{event_id}event: {event['type']}\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+class EventRelay:
+    """نقل الأحداث بين العمليات: الكتابة على دفعات في المخزن، وقراءة الجديد منها للناقل المحلي"""
+
+    def __init__(self, store, bus, interval=0.1, max_age=300):
+        self._store = store
+        self._bus = bus
+        self._interval = interval
+        self._max_age = max_age
+        self._pending = queue.Queue()
+        self._after = None
+
+    def start(self):
+        self._after = self._store.last_event_seq()
+        threading.Thread(target=self._write_loop, name='events-writer', daemon=True).start()
+        threading.Thread(target=self._tail_loop, name='events-tail', daemon=True).start()
+
+    def emit(self, event_type, data):
+        """حدث مشترك: يصل لمشتركي جميع العمليات (وهذه منها) خلال interval تقريباً"""
+        self._pending.put((event_type, data))
+
+    def _write_loop(self):
+        last_prune = time.time()
+        while True:
+            batch = [self._pending.get()]
+            time.sleep(self._interval)
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._store.append_events(batch)
+                if time.time() - last_prune > 60:
+                    self._store.prune_events(self._max_age)
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"خطأ في كتابة الأحداث: {e}")
+
+    def _tail_loop(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                for seq, event_type, data in self._store.read_events(self._after):
+                    self._after = seq
+                    self._bus.publish(event_type, data, seq)
+            except Exception as e:
+                print(f"خطأ في قراءة الأحداث: {e}")
+
+
+class LogTails:
+    """حلقة أسطر محدودة لكل بث مبنية من أحداث log (متاحة في أي عملية)
+
+    رقم كل سطر (cursor) هو رقم حدثه في جدول الأحداث المشترك، فالرقم نفسه صالح في
+    أي عملية gunicorn وبعد إعادة تشغيلها؛ الذاكرة محدودة بـ max_lines لكل بث.
+    """
+
+    def __init__(self, max_lines=500):
+        self._lock = threading.Lock()
+        self._tails = {}
+        self._last = {}
+        self._dropped = {}
+        # أحداث قبل هذا الرقم لم تصل إلى هذه العملية (بدأت بعدها)
+        self._since = None
+        self._max_lines = max_lines
+
+    def on_event(self, event_type, data, seq=None):
+        if event_type == 'deleted':
+            # حذف البث (مفرداً أو ضمن عملية جماعية) يحرر حلقته
+            self.discard(data['id'])
+            return
+        if event_type != 'log' or seq is None:
+            return
+        stream_id = data['id']
+        with self._lock:
+            if self._since is None:
+                self._since = seq
+            tail = self._tails.setdefault(stream_id, deque(maxlen=self._max_lines))
+            self._last[stream_id] = seq
+            # سطر إحصائيات ffmpeg (\r) يستبدل السطر السابق بدل تكديسه، برقم جديد
+            # replaces يحمل رقم أول سطر في سلسلة الاستبدال (قد يكون لدى العميل أيّ منها)
+            replaces = None
+            if data.get('replace') and tail:
+                old_seq, _, old_replaces = tail.pop()
+                replaces = old_seq if old_replaces is None else old_replaces
+            elif len(tail) == self._max_lines:
+                # أقدم سطر سيخرج من الحلقة: ما بعد cursor أقدم منه لن يُقرأ
+                self._dropped[stream_id] = tail[0][0]
+            tail.append((seq, data['line'], replaces))
+
+    def get(self, stream_id):
+        with self._lock:
+            tail = self._tails.get(stream_id)
+            return [line for _, line, _ in tail] if tail is not None else None
+
+    def read(self, stream_id, cursor=0):
+        """الأسطر بعد cursor: {'lines', 'cursor', 'replace_last', 'truncated'}
+
+        replace_last=True: أول سطر مُعاد يستبدل آخر سطر لدى العميل.
+        truncated=True: بعض الأسطر بعد cursor خرجت من الحلقة (أو سبقت بدء هذه العملية)
+        قبل قراءتها.
+        """
+        with self._lock:
+            tail = list(self._tails.get(stream_id, ()))
+            last = self._last.get(stream_id, 0)
+            dropped = self._dropped.get(stream_id, 0)
+            since = self._since
+        entries = [entry for entry in tail if entry[0] > cursor]
+        replace_last = cursor > 0 and bool(entries) and entries[0][2] is not None and entries[0][2] <= cursor
+        truncated = dropped > cursor or (0 < cursor and since is not None and cursor < since - 1)
+        return {
+            'lines': [line for _, line, _ in entries],
+            # عملية متأخرة قليلاً عن العميل لا تعيده إلى الوراء
+            'cursor': max(last, cursor),
+            'replace_last': replace_last,
+            'truncated': truncated
+        }
+
+    def discard(self, stream_id):
+        with self._lock:
+            self._tails.pop(stream_id, None)
+            self._last.pop(stream_id, None)
+            self._dropped.pop(stream_id, None)
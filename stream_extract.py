@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Stream Extract
+استخراج روابط البث (m3u8/mpd) من صفحات فيسبوك وتليجرام بمكتبة yt_dlp داخل العملية،
+مع ذاكرة مؤقتة مشتركة مفتاحها (رابط الصفحة، بصمة الكوكيز) وصلاحيتها من انتهاء
+التوكن داخل الرابط
+"""
+
+import calendar
+import hashlib
+import http.cookiejar
+import io
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import parse_qs, urlsplit
+
+# معاملات الاستعلام التي تحمل وقت انتهاء التوكن (ثوانٍ منذ epoch)
+EXPIRY_PARAMS = ('expires', 'expire', 'exp', 'expiry', 'x-expires', 'validto', 'valid_to')
+# توكن Akamai: hdnts=st=...~exp=...~acl=...
+AKAMAI_EXP_PATTERN = re.compile(r'(?:^|~)exp=(\d+)')
+# روابط googlevideo تضع المعاملات في المسار: /expire/1700000000/
+PATH_EXPIRY_PATTERN = re.compile(r'/(?:expire|expires)/(\d{9,13})(?:/|$)')
+
+# يُعاد الاستخراج قبل انتهاء التوكن بهذه المدة (ثوانٍ)
+EXPIRY_MARGIN = 60
+
+# مستخرجات تُهيّأ مسبقاً عند التسخين (روابطنا تأتي من هذه المواقع)
+WARM_EXTRACTORS = ('Facebook', 'Generic')
+
+
+class ExtractError(RuntimeError):
+    """فشل الاستخراج؛ الرسالة جاهزة للعرض في لوحة التحكم"""
+
+
+def _epoch(value, base=10):
+    try:
+        number = int(value, base)
+    except (TypeError, ValueError):
+        return None
+    # بعض الشبكات تكتب الوقت بالمللي ثانية
+    if number > 10 ** 12:
+        number //= 1000
+    # أي قيمة خارج نطاق معقول ليست وقتاً
+    if not 10 ** 9 <= number < 10 ** 11:
+        return None
+    return number
+
+
+def url_expiry(url):
+    """وقت انتهاء التوكن المضمّن في الرابط (epoch) أو None إذا لم يوجد"""
+    parts = urlsplit(url)
+    params = {key.lower(): values[-1] for key, values in parse_qs(parts.query).items()}
+
+    # فيسبوك (fbcdn): oe = وقت الانتهاء بالست عشري
+    if 'oe' in params:
+        expiry = _epoch(params['oe'], 16)
+        if expiry:
+            return expiry
+    for name in EXPIRY_PARAMS:
+        if name in params:
+            expiry = _epoch(params[name])
+            if expiry:
+                return expiry
+    # AWS SigV4: X-Amz-Date + X-Amz-Expires
+    if 'x-amz-date' in params and 'x-amz-expires' in params:
+        try:
+            signed = calendar.timegm(time.strptime(params['x-amz-date'], '%Y%m%dT%H%M%SZ'))
+            return signed + int(params['x-amz-expires'])
+        except (ValueError, OverflowError):
+            pass
+    for name in ('hdnts', '__token__'):
+        match = AKAMAI_EXP_PATTERN.search(params.get(name, ''))
+        if match:
+            return _epoch(match.group(1))
+    match = PATH_EXPIRY_PATTERN.search(parts.path)
+    if match:
+        return _epoch(match.group(1))
+    return None
+
+
+def stream_format(stream_url):
+    if '.m3u8' in stream_url:
+        return 'M3U8 (HLS)'
+    if '.mpd' in stream_url:
+        return 'DASH (MPD)'
+    return 'Direct Stream'
+
+
+def _stream_url(info):
+    """رابط البث من نتيجة extract_info (مثل أول سطر http من yt-dlp --get-url مع تفضيل M3U8)"""
+    if info.get('entries'):
+        info = next((entry for entry in info['entries'] if entry), {})
+    urls = [
+        fmt.get('url') for fmt in (info.get('requested_formats') or [info])
+        if (fmt.get('url') or '').startswith('http')
+    ]
+    return next((url for url in urls if '.m3u8' in url), urls[0] if urls else None)
+
+
+class _Instance:
+    """نسخة YoutubeDL دافئة وقفلها وعدد من يستخدمها الآن
+
+    النسخة المُخرجة (retired) لا تُعطى لطلب جديد، وتُغلق بعد انتهاء آخر مستخدم لها.
+    """
+
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+
+
+class ExtractEngine:
+    """yt_dlp داخل العملية بدلاً من تشغيل yt-dlp لكل طلب
+
+    الاستيراد وتسجيل المستخرجات يحدثان مرة واحدة (warm)، ولكل (كوكيز، صيغة) نسخة
+    YoutubeDL دافئة تحتفظ بجرة كوكيز في الذاكرة بدلاً من ملف temp_cookies.txt.
+    """
+
+    def __init__(self, max_instances=8, max_workers=4):
+        self.max_instances = max_instances
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self._instances = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='extract')
+        self._yt_dlp = None
+
+    @staticmethod
+    def _params(fmt):
+        params = {'quiet': True, 'no_warnings': True, 'noprogress': True,
+                  'skip_download': True, 'socket_timeout': 15}
+        if fmt:
+            params['format'] = fmt
+        return params
+
+    def warm(self):
+        """استيراد yt_dlp وتهيئة المستخرجات الشائعة (يُستدعى في الخلفية عند البدء)"""
+        with self._warm_lock:
+            if self._yt_dlp is None:
+                import yt_dlp
+                with yt_dlp.YoutubeDL(self._params(None)) as ydl:
+                    for name in WARM_EXTRACTORS:
+                        ydl.get_info_extractor(name)
+                self._yt_dlp = yt_dlp
+        return self._yt_dlp
+
+    @staticmethod
+    def _key(cookies, fmt):
+        return hashlib.sha256(cookies.encode('utf-8')).hexdigest(), fmt
+
+    def _acquire(self, cookies, fmt):
+        """نسخة هذه الكوكيز والصيغة محجوزة للمستدعي (الأقدم استخداماً يُخرج)؛ تُعاد بـ _release"""
+        yt_dlp = self.warm()
+        key = self._key(cookies, fmt)
+        retired = []
+        with self._lock:
+            entry = self._instances.get(key)
+            if entry:
+                self._instances.move_to_end(key)
+            else:
+                ydl = yt_dlp.YoutubeDL(self._params(fmt))
+                try:
+                    ydl.cookiejar.load(io.StringIO(cookies))
+                except (http.cookiejar.LoadError, ValueError) as e:
+                    ydl.close()
+                    raise ExtractError(f'ملف الكوكيز غير صالح (يجب أن يكون بصيغة Netscape): {e}')
+                entry = self._instances[key] = _Instance(ydl)
+                while len(self._instances) > self.max_instances:
+                    _, old = self._instances.popitem(last=False)
+                    retired.append(self._retire(old))
+            entry.users += 1
+        self._close(retired)
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            closing = entry if entry.retired and not entry.users else None
+        self._close([closing])
+
+    def _retire(self, entry):
+        """إخراج نسخة (تحت القفل)؛ يعيدها إذا كان يمكن إغلاقها الآن"""
+        entry.retired = True
+        return None if entry.users else entry
+
+    def _retire_key(self, key):
+        with self._lock:
+            entry = self._instances.pop(key, None)
+            closing = self._retire(entry) if entry else None
+        self._close([closing])
+
+    @staticmethod
+    def _close(entries):
+        for entry in entries:
+            if entry:
+                entry.ydl.close()
+
+    def _extract(self, page_url, cookies, fmt):
+        entry = self._acquire(cookies, fmt)
+        try:
+            # YoutubeDL ليست آمنة للخيوط: طلب واحد لكل نسخة في الوقت نفسه
+            with entry.lock:
+                info = entry.ydl.extract_info(page_url, download=False)
+        except self._yt_dlp.utils.DownloadError as e:
+            raise ExtractError(str(e).removeprefix('ERROR: ')[:200])
+        finally:
+            self._release(entry)
+        stream_url = _stream_url(info or {})
+        if not stream_url:
+            raise ExtractError('لم يتم العثور على رابط البث. تأكد أن البث مباشر الآن وملف الكوكيز صحيح')
+        return {
+            'stream_url': stream_url,
+            'format': stream_format(stream_url),
+            'extracted_at': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def extract(self, page_url, cookies, fmt=None, timeout=30):
+        """{'stream_url', 'format', 'extracted_at'} أو ExtractError"""
+        future = self._executor.submit(self._extract, page_url, cookies, fmt)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            if not future.cancel():
+                # العامل ما زال يستخرج بنسخة هذا المفتاح (أو ينتظر قفلها): الطلب التالي
+                # يأخذ نسخة جديدة، والقديمة تُغلق عند انتهائه
+                self._retire_key(self._key(cookies, fmt))
+            raise ExtractError(f'انتهت مهلة الاستخراج ({timeout} ثانية)')
+
+
+def extraction_key(page_url, cookies):
+    """مفتاح الذاكرة المؤقتة: رابط الصفحة + بصمة sha256 للكوكيز (الكوكيز نفسها لا تُحفظ)"""
+    cookies_hash = hashlib.sha256(cookies.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f'{page_url.strip()}\n{cookies_hash}'.encode('utf-8')).hexdigest()
+
+
+class ExtractionCache:
+    """نتائج الاستخراج في المخزن (تبقى بعد إعادة التشغيل) مع إخراج الأقل استخداماً"""
+
+    def __init__(self, store, ttl=600, max_entries=200):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, page_url, cookies):
+        """{'stream_url', 'format', 'extracted_at', 'expires_at'} أو None"""
+        entry = self.store.get_extraction(extraction_key(page_url, cookies))
+        if not entry:
+            return None
+        result, expires_at = entry
+        return dict(result, expires_at=expires_at)
+
+    def put(self, page_url, cookies, result):
+        """حفظ نتيجة ناجحة؛ يعيد وقت انتهاء صلاحيتها (أو None إذا انتهى التوكن فعلاً)"""
+        now = time.time()
+        token_expiry = url_expiry(result['stream_url'])
+        if token_expiry is not None:
+            expires_at = token_expiry - EXPIRY_MARGIN
+        else:
+            expires_at = now + self.ttl
+        if expires_at <= now:
+            return None
+        self.store.put_extraction(extraction_key(page_url, cookies), result, expires_at, self.max_entries)
+        return expires_at
+
+    def invalidate(self, page_url, cookies):
+        self.store.delete_extraction(extraction_key(page_url, cookies))
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Stream Fan-out
+ترميز واحد لكل مصدر يُوزَّع على عدة وجهات RTMP
+
+ffmpeg المُرمِّز يكتب MPEG-TS إلى stdout، وخيط التوزيع ينسخ كل دفعة إلى أنبوب
+stdin لعملية ffmpeg خفيفة لكل وجهة (-c copy). إضافة وجهة أو إزالتها لا تمس
+المُرمِّز ولا الوجهات الأخرى، وتكلفة الوجهة الإضافية إعادة تغليف فقط.
+
+يمكن استبدال مُرمِّز المصدر (swap) تحت الوجهات الحية دون قطع اتصالات RTMP: عند
+تجديد رابط مصدر انتهى توكنه، أو الانتقال إلى مصدر احتياطي عند توقف المصدر الحالي.
+"""
+
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+# حجم حزمة MPEG-TS؛ القراءة بمضاعفاتها حتى لا تنقسم حزمة عند إسقاط دفعة
+TS_PACKET = 188
+CHUNK_SIZE = TS_PACKET * 348
+
+
+class FanoutSink:
+    """وجهة واحدة: طابور محدود وخيط يكتب في أنبوب stdin لعملية الوجهة"""
+
+    def __init__(self, stream_id, fd, max_chunks=256):
+        self.stream_id = stream_id
+        self.dropped = 0
+        self._fd = fd
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._closed = threading.Event()
+        threading.Thread(target=self._run, name=f'fanout-sink-{stream_id}', daemon=True).start()
+
+    def put(self, chunk):
+        try:
+            self._queue.put_nowait(chunk)
+        except queue.Full:
+            # وجهة بطيئة: نسقط الدفعة (حزم TS كاملة) بدل إبطاء باقي الوجهات
+            self.dropped += 1
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        # لا ننتظر أبداً هنا (قد يُستدعى تحت قفل المدير)
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def _run(self):
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    written = os.write(self._fd, view)
+                    view = view[written:]
+        except OSError:
+            # عملية الوجهة انتهت (أنبوب مكسور)
+            pass
+        finally:
+            self._closed.set()
+            os.close(self._fd)
+
+
+class FanoutHub:
+    """مُرمِّز واحد لمصدر واحد ووجهاته"""
+
+    def __init__(self, key, candidates, log_lines=50):
+        self.key = key
+        # أوامر المُرمِّز بالترتيب: المصدر الأساسي ثم الاحتياطية
+        self.candidates = list(candidates)
+        self.index = 0
+        self.sinks = {}
+        self.logs = deque(maxlen=log_lines)
+        self.proc = None
+        # مُرمِّز بديل ينتظر أول دفعة منه قبل أن تنتقل إليه الوجهات
+        self.pending = None
+        self.swap_done = threading.Event()
+        self.switching = False
+        self.last_output = time.time()
+        self.switched_at = time.time()
+        self.exit_code = None
+
+    @property
+    def args(self):
+        return self.candidates[self.index]
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    @property
+    def alive(self):
+        """يعمل، أو ينتقل إلى مصدر آخر بعد توقف مُرمِّزه"""
+        return self.running or self.switching or self.pending is not None
+
+
+class FanoutManager:
+    """مُرمِّز مشترك لكل مصدر يبدأ مع أول وجهة ويتوقف بعد آخرها"""
+
+    def __init__(self, log_lines=50, on_exit=None, on_switch=None,
+                 stall_timeout=10.0, switch_timeout=20.0, failback_interval=300.0):
+        """on_exit(key, exit_code, stream_ids, logs) عند توقف أي مُرمِّز؛ stream_ids
+        هي الوجهات التي كانت ما تزال مرتبطة به (فارغة عند التوقف بعد آخر وجهة)
+
+        on_switch(key, index, reason, stream_ids) بعد انتقال الوجهات إلى مُرمِّز المصدر
+        رقم index. المُرمِّز الذي لا يُخرج شيئاً لمدة stall_timeout يُستبدل بالمصدر التالي،
+        وبعد failback_interval على مصدر احتياطي تُجرَّب العودة إلى الأساسي.
+        """
+        self._lock = threading.Lock()
+        self._hubs = {}
+        self._members = {}
+        self._log_lines = log_lines
+        self._on_exit = on_exit
+        self._on_switch = on_switch
+        self.stall_timeout = stall_timeout
+        self.switch_timeout = switch_timeout
+        self.failback_interval = failback_interval
+        self._watchdog = None
+
+    def attach(self, stream_id, key, args, backups=()):
+        """ضم وجهة إلى مُرمِّز المفتاح (وتشغيله إن لم يكن يعمل)
+
+        backups أوامر مُرمِّز احتياطية بالترتيب. يعيد طرف القراءة من أنبوب يُمرَّر
+        stdin لعملية الوجهة؛ على المستدعي إغلاقه بعد تشغيلها.
+        """
+        with self._lock:
+            if stream_id in self._members:
+                raise RuntimeError(f'الوجهة {stream_id} مرتبطة بالفعل')
+            hub = self._hubs.get(key)
+            if not hub or not hub.alive:
+                hub = FanoutHub(key, [args, *backups], self._log_lines)
+                hub.proc = self._spawn(hub, args)
+                self._hubs[key] = hub
+            read_fd, write_fd = os.pipe()
+            hub.sinks[stream_id] = FanoutSink(stream_id, write_fd)
+            self._members[stream_id] = key
+            if len(hub.candidates) > 1 and not self._watchdog:
+                self._watchdog = threading.Thread(target=self._watch, name='fanout-watchdog', daemon=True)
+                self._watchdog.start()
+        return read_fd
+
+    def active(self, key):
+        """هل يعمل مُرمِّز لهذا المفتاح حالياً"""
+        with self._lock:
+            hub = self._hubs.get(key)
+            return bool(hub and hub.alive)
+
+    def active_index(self, key):
+        """رقم المصدر الذي يعمل منه مُرمِّز المفتاح (0 = الأساسي) أو None"""
+        with self._lock:
+            hub = self._hubs.get(key)
+            return hub.index if hub else None
+
+    def detach(self, stream_id):
+        """فصل وجهة؛ يتوقف المُرمِّز إذا لم تبق له وجهات"""
+        with self._lock:
+            key = self._members.pop(stream_id, None)
+            hub = self._hubs.get(key)
+            if not hub:
+                return
+            sink = hub.sinks.pop(stream_id, None)
+            if sink:
+                sink.close()
+            if hub.sinks:
+                return
+            del self._hubs[key]
+            pending, hub.pending = hub.pending, None
+        if pending:
+            self._terminate(pending)
+        self._terminate(hub.proc)
+
+    def swap(self, key, index, args=None, timeout=30, reason='swap'):
+        """نقل وجهات المفتاح إلى مُرمِّز المصدر index (بأمر جديد args إن أُعطي)
+
+        يعمل المُرمِّز الجديد بجانب القديم، وعند وصول أول دفعة منه تنتقل إليه الوجهات
+        (عند حد حزمة TS) ويُوقف القديم. يعيد False ويُبقي القديم إذا لم يُخرج الجديد
+        شيئاً خلال timeout.
+        """
+        with self._lock:
+            hub = self._hubs.get(key)
+            if not hub or hub.pending:
+                return False
+            args = args or hub.candidates[index]
+            hub.swap_done.clear()
+            proc = hub.pending = self._spawn(hub, args)
+        hub.swap_done.wait(timeout)
+        with self._lock:
+            promoted = hub.proc is proc
+            if promoted:
+                hub.candidates[index] = args
+                hub.index = index
+                hub.switched_at = time.time()
+                stream_ids = list(hub.sinks)
+            elif hub.pending is proc:
+                hub.pending = None
+        if not promoted:
+            self._terminate(proc)
+            return False
+        if self._on_switch:
+            try:
+                self._on_switch(key, index, reason, stream_ids)
+            except Exception as e:
+                print(f"خطأ في مستمع تبديل المصدر: {e}")
+        return True
+
+    def _failover(self, hub, reason):
+        """تجربة المصادر التالية بالترتيب (ثم الحالي) حتى يُخرج أحدها بيانات"""
+        with self._lock:
+            if hub.switching or self._hubs.get(hub.key) is not hub:
+                return
+            hub.switching = True
+        try:
+            count = len(hub.candidates)
+            for step in range(1, count + 1):
+                if self._hubs.get(hub.key) is not hub:
+                    return
+                if self.swap(hub.key, (hub.index + step) % count, timeout=self.switch_timeout, reason=reason):
+                    return
+        finally:
+            with self._lock:
+                hub.switching = False
+                # لا مصدر يعمل: مهلة توقف كاملة قبل المحاولة التالية
+                hub.last_output = time.time()
+        if not hub.running:
+            self._close(hub)
+
+    def _failback(self, hub):
+        with self._lock:
+            if hub.switching:
+                return
+            hub.switching = True
+        try:
+            self.swap(hub.key, 0, timeout=self.switch_timeout, reason='failback')
+        finally:
+            with self._lock:
+                hub.switching = False
+                hub.switched_at = time.time()
+
+    def _watch(self):
+        """كشف توقف مُرمِّزات المصادر التي لها بدائل، والعودة إلى الأساسي بعد مدة"""
+        while True:
+            time.sleep(1)
+            now = time.time()
+            with self._lock:
+                hubs = [hub for hub in self._hubs.values()
+                        if len(hub.candidates) > 1 and not hub.switching and not hub.pending]
+            for hub in hubs:
+                if now - hub.last_output >= self.stall_timeout:
+                    target, args = self._failover, (hub, 'stall')
+                elif hub.index and now - hub.switched_at >= self.failback_interval:
+                    target, args = self._failback, (hub,)
+                else:
+                    continue
+                threading.Thread(target=target, args=args, name=f'fanout-switch-{hub.proc.pid}', daemon=True).start()
+
+    def _spawn(self, hub, args):
+        proc = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+        threading.Thread(target=self._pump, args=(hub, proc), name=f'fanout-{proc.pid}', daemon=True).start()
+        threading.Thread(target=self._drain_logs, args=(hub, proc), name=f'fanout-log-{proc.pid}', daemon=True).start()
+        return proc
+
+    def _pump(self, hub, proc):
+        """نسخ مخرجات المُرمِّز إلى جميع الوجهات الحية"""
+        while True:
+            chunk = proc.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            replaced = None
+            with self._lock:
+                if proc is hub.pending:
+                    # أول دفعة من المُرمِّز البديل: تنتقل إليه الوجهات من هنا
+                    replaced, hub.proc, hub.pending = hub.proc, proc, None
+                    hub.swap_done.set()
+                elif proc is not hub.proc:
+                    # مُرمِّز مستبدل ما زال يُنهي: مخرجاته لم تعد تُرسل
+                    continue
+                hub.last_output = time.time()
+                sinks = list(hub.sinks.values())
+            if replaced:
+                threading.Thread(target=self._terminate, args=(replaced,), daemon=True).start()
+            for sink in sinks:
+                if not sink.closed:
+                    sink.put(chunk)
+        exit_code = proc.wait()
+
+        with self._lock:
+            if proc is not hub.proc:
+                # مُرمِّز مستبدل، أو بديل توقف قبل أول دفعة (الوجهات باقية على الحالي)
+                if hub.pending is proc:
+                    hub.pending = None
+                    hub.swap_done.set()
+                return
+            hub.exit_code = exit_code
+            # للمصدر بدائل: الوجهات تنتظر على أنابيبها (اتصال RTMP باقٍ) حتى يعمل أحدها
+            failover = len(hub.candidates) > 1 and hub.sinks and self._hubs.get(hub.key) is hub
+        if failover:
+            self._failover(hub, f'exit {exit_code}')
+        else:
+            self._close(hub)
+
+    def _close(self, hub):
+        """انتهى المُرمِّز: إغلاق الأنابيب حتى تنتهي عمليات الوجهات أيضاً"""
+        with self._lock:
+            orphaned = list(hub.sinks)
+            sinks = [hub.sinks.pop(stream_id) for stream_id in orphaned]
+            for stream_id in orphaned:
+                self._members.pop(stream_id, None)
+            if self._hubs.get(hub.key) is hub:
+                del self._hubs[hub.key]
+            pending, hub.pending = hub.pending, None
+        if pending:
+            self._terminate(pending)
+            hub.swap_done.set()
+        # المستمع يُبلَّغ قبل إغلاق الأنابيب: خروج الوجهات بعده نتيجة لتوقف المُرمِّز
+        if self._on_exit:
+            try:
+                self._on_exit(hub.key, hub.exit_code, orphaned, list(hub.logs))
+            except Exception as e:
+                print(f"خطأ في مستمع المُرمِّز: {e}")
+        for sink in sinks:
+            sink.close()
+
+    def _drain_logs(self, hub, proc):
+        for raw in iter(proc.stderr.readline, b''):
+            line = raw.decode('utf-8', errors='replace').rstrip()
+            if line:
+                hub.logs.append(line)
+
+    @staticmethod
+    def _terminate(proc, timeout=5):
+        if proc.poll() is not None:
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
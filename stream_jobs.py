@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Stream Jobs
+تنفيذ عمليات البث الطويلة (تشغيل/إيقاف/حذف) في الخلفية مع معرف مهمة يمكن انتظاره
+
+المهام محفوظة في المخزن المشترك: أي عملية gunicorn تستطيع إنشاءها أو انتظارها،
+وينفذها فقط مالك عمليات ffmpeg.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobManager:
+    """طابور مهام مشترك عبر المخزن مع مجمّع خيوط محدود لدى المالك"""
+
+    def __init__(self, store, max_workers=4, poll_interval=0.2, on_change=None, actions=None):
+        self._store = store
+        # أنواع المهام التي ينفذها هذا المدير (None = الكل)؛ يسمح بمجمّع منفصل لكل فئة
+        self._actions = tuple(actions) if actions else None
+        self._max_workers = max_workers
+        self._poll_interval = poll_interval
+        self._on_change = on_change
+        self._handlers = {}
+        self._wake = threading.Event()
+        self._executor = None
+
+    def register(self, action, handler):
+        """handler(stream_id, **payload) يعيد قاموس نتيجة أو يرفع استثناء"""
+        self._handlers[action] = handler
+
+    def submit(self, action, stream_id, secret=None, single_flight=False, **payload):
+        """تسجيل مهمة معلّقة وإرجاعها فوراً
+
+        secret يصل إلى المعالج كوسيط secret ولا يظهر في حالة المهمة، ويُحذف بعد التنفيذ.
+        single_flight يعيد المهمة الجارية لنفس (action, stream_id) إن وُجدت.
+        """
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'action': action,
+            'stream_id': stream_id,
+            'payload': payload,
+            'status': 'pending',
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None
+        }
+        registered = self._store.insert_job(job, secret=secret, single_flight=single_flight)
+        if registered['id'] != job['id']:
+            return registered
+        self._notify(job)
+        self._wake.set()
+        return job
+
+    def start(self):
+        """بدء تنفيذ المهام المعلّقة (يُستدعى في العملية المالكة فقط)"""
+        if self._executor:
+            return
+        for job_id in self._store.fail_running_jobs('توقف المالك السابق أثناء تنفيذ المهمة', self._actions):
+            self._notify(self._store.get_job(job_id))
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='job')
+        threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True).start()
+
+    def _dispatch(self):
+        while True:
+            self._wake.wait(self._poll_interval)
+            self._wake.clear()
+            try:
+                for job in self._store.pending_jobs(actions=self._actions):
+                    if self._store.claim_job(job['id']):
+                        job['status'] = 'running'
+                        self._notify(job)
+                        self._executor.submit(self._run, job)
+            except Exception as e:
+                print(f"خطأ في موزع المهام: {e}")
+
+    def _run(self, job):
+        handler = self._handlers.get(job['action'])
+        try:
+            if not handler:
+                raise RuntimeError(f"نوع مهمة غير معروف: {job['action']}")
+            payload = dict(job['payload'])
+            secret = self._store.get_secret(f"job:{job['id']}")
+            if secret:
+                payload['secret'] = secret
+            result = handler(job['stream_id'], **payload)
+        except Exception as e:
+            self._store.finish_job(job['id'], 'failed', error=str(e))
+        else:
+            self._store.finish_job(job['id'], 'succeeded', result=result)
+        self._store.delete_secret(f"job:{job['id']}")
+        self._notify(self._store.get_job(job['id']))
+
+    def _notify(self, job):
+        if self._on_change and job:
+            try:
+                self._on_change(dict(job))
+            except Exception as e:
+                print(f"خطأ في مستمع المهام: {e}")
+
+    def get(self, job_id):
+        return self._store.get_job(job_id)
+
+    def wait(self, job_id, timeout):
+        """انتظار انتهاء المهمة حتى timeout ثانية ثم إرجاع حالتها"""
+        deadline = time.time() + timeout
+        while True:
+            job = self._store.get_job(job_id)
+            if not job or job['status'] in ('succeeded', 'failed') or time.time() >= deadline:
+                return job
+            time.sleep(self._poll_interval)
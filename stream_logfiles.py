@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Stream Log Files
+كتابة سجلات ffmpeg على القرص على دفعات، مع تدوير حسب الحجم والعمر، وضغط
+المقاطع المغلقة (gzip)، وحد أقصى إجمالي لمساحة القرص لجميع البثوث
+
+التخطيط: logs/<stream_id>/<وقت البدء>.log للمقطع الحالي، و .log.gz للمقاطع المغلقة.
+"""
+
+import gzip
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class LogSegment:
+    """المقطع المفتوح حالياً لبث واحد"""
+
+    def __init__(self, path):
+        self.path = path
+        self.opened_at = time.time()
+        self.size = 0
+        self.file = open(path, 'a', encoding='utf-8', buffering=64 * 1024)
+
+
+class LogWriter:
+    """خيط واحد يكتب سجلات جميع البثوث كل flush_interval ثانية"""
+
+    def __init__(self, directory, max_bytes=10 * 1024 * 1024, max_age=6 * 3600,
+                 budget_bytes=200 * 1024 * 1024, stats_interval=10.0, flush_interval=1.0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.budget_bytes = budget_bytes
+        self.stats_interval = stats_interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._closing = set()
+        self._last_stats = {}
+        self._segments = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # مقاطع تركها تشغيل سابق مفتوحة تُضغط كما لو أُغلقت
+        for path in self.directory.glob('*/*.log'):
+            self._compress(path)
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, stream_id, line, replace=False):
+        """سطر سجل جديد؛ أسطر الإحصائيات (replace) تُكتب مرة كل stats_interval فقط"""
+        now = time.time()
+        with self._lock:
+            if replace:
+                if now - self._last_stats.get(stream_id, 0) < self.stats_interval:
+                    return
+                self._last_stats[stream_id] = now
+            self._pending.append((stream_id, now, line))
+
+    def close(self, stream_id):
+        """إغلاق مقطع البث الحالي وضغطه عند الدفعة القادمة"""
+        with self._lock:
+            self._closing.add(stream_id)
+            self._last_stats.pop(stream_id, None)
+
+    def _run(self):
+        last_budget = 0
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                rotated = self._flush()
+                if rotated or time.time() - last_budget > 60:
+                    self._enforce_budget()
+                    last_budget = time.time()
+            except Exception as e:
+                print(f"خطأ في كتابة ملفات السجل: {e}")
+
+    def _flush(self):
+        """كتابة الدفعة المتراكمة، ثم تدوير وضغط المقاطع المنتهية"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            closing, self._closing = self._closing, set()
+
+        batches = {}
+        for stream_id, stamp, line in pending:
+            prefix = datetime.fromtimestamp(stamp).strftime('%Y-%m-%d %H:%M:%S')
+            batches.setdefault(stream_id, []).append(f'{prefix} {line}\n')
+
+        finished = []
+        for stream_id, lines in batches.items():
+            segment = self._segments.get(stream_id) or self._open(stream_id)
+            text = ''.join(lines)
+            segment.file.write(text)
+            segment.size += len(text.encode('utf-8'))
+
+        now = time.time()
+        for stream_id, segment in list(self._segments.items()):
+            segment.file.flush()
+            expired = segment.size >= self.max_bytes or now - segment.opened_at >= self.max_age
+            if stream_id in closing or expired:
+                segment.file.close()
+                del self._segments[stream_id]
+                finished.append(segment.path)
+
+        for path in finished:
+            self._compress(path)
+        return bool(finished)
+
+    def _open(self, stream_id):
+        stream_dir = self.directory / stream_id
+        stream_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = stream_dir / f'{stamp}.log'
+        counter = 1
+        while path.exists() or Path(f'{path}.gz').exists():
+            path = stream_dir / f'{stamp}_{counter}.log'
+            counter += 1
+        segment = LogSegment(path)
+        self._segments[stream_id] = segment
+        return segment
+
+    @staticmethod
+    def _compress(path):
+        try:
+            with open(path, 'rb') as src, gzip.open(f'{path}.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            print(f"تعذّر ضغط {path}: {e}")
+
+    def _enforce_budget(self):
+        """حذف أقدم المقاطع المغلقة (من جميع البثوث) حتى يعود الإجمالي تحت الحد"""
+        active = {segment.path for segment in self._segments.values()}
+        files = []
+        total = 0
+        for path in self.directory.rglob('*.log*'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            total += stat.st_size
+            if path not in active:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.budget_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                continue
+        for stream_dir in self.directory.iterdir():
+            if stream_dir.is_dir() and not any(stream_dir.iterdir()):
+                stream_dir.rmdir()
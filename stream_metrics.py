@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Stream Metrics
+مقاييس المُرمِّز لكل بث من قناة ffmpeg -progress (مفتاح=قيمة، كتلة كل stats_period)
+"""
+
+import threading
+import time
+
+# بدون نمو في حجم المُخرج لهذه المدة نعتبر الكتابة إلى RTMP متوقفة
+STALL_SECONDS = 5.0
+
+
+def _number(value, suffix=''):
+    """'3000.5kbits/s' أو '1.01x' أو 'N/A' -> رقم أو None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ProgressMetrics:
+    """آخر قيم كتلة progress لبث واحد مع كشف توقف الكتابة"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._block = {}
+        self._values = {}
+        self._started_at = time.time()
+        self._last_block_at = None
+        self._last_growth_at = time.time()
+        self._last_size = 0
+        self._stall_count = 0
+        self._stalled = False
+
+    def feed_line(self, line):
+        """سطر واحد من القناة؛ يعيد True عند اكتمال كتلة"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return False
+        self._block[key] = value
+        if key != 'progress':
+            return False
+        self._apply(self._block)
+        self._block = {}
+        return True
+
+    def _apply(self, block):
+        now = time.time()
+        size = int(_number(block.get('total_size')) or 0)
+        with self._lock:
+            self._last_block_at = now
+            if size > self._last_size:
+                self._last_size = size
+                self._last_growth_at = now
+                self._stalled = False
+            out_time_us = _number(block.get('out_time_us'))
+            self._values = {
+                'frame': int(_number(block.get('frame')) or 0),
+                'fps': _number(block.get('fps')),
+                'bitrate_kbps': _number(block.get('bitrate'), 'kbits/s'),
+                'speed': _number(block.get('speed'), 'x'),
+                'total_size': size,
+                'out_time_s': round(out_time_us / 1e6, 3) if out_time_us is not None else None,
+                'dup_frames': int(_number(block.get('dup_frames')) or 0),
+                'drop_frames': int(_number(block.get('drop_frames')) or 0),
+                'ended': block.get('progress') == 'end'
+            }
+
+    @property
+    def output_started(self):
+        with self._lock:
+            return self._last_size > 0
+
+    def snapshot(self):
+        """القيم الحالية مع حالة التوقف (تُحسب لحظة القراءة)"""
+        now = time.time()
+        with self._lock:
+            stall = now - self._last_growth_at
+            stalled = self._last_block_at is not None and stall >= STALL_SECONDS
+            if stalled and not self._stalled:
+                self._stall_count += 1
+            self._stalled = stalled
+            data = dict(self._values)
+            data.update({
+                'stalled': stalled,
+                'stall_seconds': round(stall, 1) if stalled else 0.0,
+                'stall_count': self._stall_count,
+                'uptime_s': round(now - self._started_at, 1),
+                'updated_at': self._last_block_at
+            })
+            return data
+
+
+# (اسم المقياس، المفتاح، النوع، الوصف)
+PROMETHEUS_METRICS = (
+    ('ffmpeg_frames_total', 'frame', 'counter', 'Frames written by the encoder'),
+    ('ffmpeg_fps', 'fps', 'gauge', 'Current encode frame rate'),
+    ('ffmpeg_bitrate_kbps', 'bitrate_kbps', 'gauge', 'Current output bitrate in kbit/s'),
+    ('ffmpeg_speed', 'speed', 'gauge', 'Encode speed relative to real time'),
+    ('ffmpeg_output_bytes_total', 'total_size', 'counter', 'Bytes written to the output'),
+    ('ffmpeg_dup_frames_total', 'dup_frames', 'counter', 'Duplicated frames'),
+    ('ffmpeg_drop_frames_total', 'drop_frames', 'counter', 'Dropped frames'),
+    ('ffmpeg_output_stalled', 'stalled', 'gauge', '1 while the output has not grown for the stall window'),
+    ('ffmpeg_output_stalls_total', 'stall_count', 'counter', 'Output write stalls detected'),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def prometheus_text(streams):
+    """نص Prometheus من {stream_id: {'labels': {...}, 'metrics': {...}}}"""
+    lines = []
+    for name, key, kind, help_text in PROMETHEUS_METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for stream_id, entry in streams.items():
+            value = entry['metrics'].get(key)
+            if value is None:
+                continue
+            labels = {'stream_id': stream_id, **entry.get('labels', {})}
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {float(value):g}')
+    return '\n'.join(lines) + '\n'
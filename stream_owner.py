@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Stream Owner Election
+انتخاب عملية واحدة من عمليات gunicorn لتملك عمليات ffmpeg (قفل ملف fcntl)
+"""
+
+import fcntl
+import os
+import threading
+
+
+class OwnerElection:
+    """القفل يُحرَّر تلقائياً عند موت العملية، فتتولى عملية أخرى الملكية"""
+
+    def __init__(self, lock_file, on_elected, interval=2.0):
+        self.lock_file = str(lock_file)
+        self.is_owner = False
+        self._on_elected = on_elected
+        self._interval = interval
+        self._fd = None
+
+    def start(self):
+        """محاولة فورية ثم إعادة المحاولة في الخلفية حتى الفوز بالقفل"""
+        if self._try_acquire():
+            return
+        threading.Thread(target=self._run, name='owner-election', daemon=True).start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self._interval):
+            if self._try_acquire():
+                return
+
+    def _try_acquire(self):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.is_owner = True
+        print(f"العملية {os.getpid()} أصبحت مالكة عمليات البث")
+        try:
+            self._on_elected()
+        except Exception as e:
+            print(f"خطأ أثناء تولي الملكية: {e}")
+        return True
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Stream Pipeline
+بناء أمر ffmpeg لكل بث من ملف تعريف خاص به (المصدر، إعداد الجودة، الشعار، وضع
+الصوت) وتشغيله مباشرة، بدل تعديل config.sh المشترك ثم bash main.sh أو سكربت مؤقت
+في /tmp لكل بث
+
+config.sh يبقى مصدر الإعدادات العامة (إعدادات الجودة، الشعار، المُرمِّز) ويُقرأ فقط.
+"""
+
+import re
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+from stream_relay import is_hls
+
+SETTING_PATTERN = re.compile(r'^([A-Z][A-Z0-9_]*)="([^"]*)"', re.MULTILINE)
+
+AUDIO_MODES = ('auto', 'copy', 'aac')
+LOGO_POSITIONS = {
+    'topleft': 'x={x}:y={y}',
+    'topright': 'x=W-w-{x}:y={y}',
+    'bottomleft': 'x={x}:y=H-h-{y}',
+    'bottomright': 'x=W-w-{x}:y=H-h-{y}',
+}
+# مُرمِّزات GPU حسب USE_GPU بترتيب detect_gpu_encoder في config.sh
+GPU_ENCODERS = (
+    ('nvidia', 'h264_nvenc'),
+    ('intel', 'h264_vaapi'),
+    ('intel', 'h264_qsv'),
+    ('amd', 'h264_amf'),
+)
+
+_encoders_lock = threading.Lock()
+_encoders = None
+
+
+def load_settings(config_file):
+    """الإعدادات الثابتة في config.sh: {'PRESET': 'ultrafast', 'LOGO_ENABLED': 'false', ...}
+
+    القيم المحسوبة (مثل "${VIDEO_CODEC:-auto}") تُترك، و LOGO_PATH يُحل نسبةً لمجلد الملف.
+    """
+    config_file = Path(config_file)
+    settings = {
+        key: value for key, value in SETTING_PATTERN.findall(config_file.read_text(encoding='utf-8'))
+        if '$' not in value
+    }
+    if settings.get('LOGO_PATH'):
+        settings['LOGO_PATH'] = str((config_file.parent / settings['LOGO_PATH']).resolve())
+    return settings
+
+
+def _available_encoders():
+    global _encoders
+    with _encoders_lock:
+        if _encoders is None:
+            try:
+                result = subprocess.run(
+                    ['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=10
+                )
+                _encoders = result.stdout
+            except (subprocess.TimeoutExpired, FileNotFoundError):
+                _encoders = ''
+        return _encoders
+
+
+def video_encoder(use_gpu):
+    """libx264 أو مُرمِّز GPU متاح حسب USE_GPU (off/auto/nvidia/intel/amd)"""
+    if use_gpu not in ('auto', 'nvidia', 'intel', 'amd'):
+        return 'libx264'
+    for vendor, encoder in GPU_ENCODERS:
+        if use_gpu not in ('auto', vendor):
+            continue
+        if use_gpu == 'auto' and vendor == 'nvidia' and not shutil.which('nvidia-smi'):
+            continue
+        if encoder in _available_encoders():
+            return encoder
+    return 'libx264'
+
+
+def _logo(settings, enabled):
+    if enabled is None:
+        enabled = settings.get('LOGO_ENABLED') == 'true'
+    path = settings.get('LOGO_PATH')
+    if not enabled or not path or not Path(path).is_file():
+        return None
+    return {
+        'path': path,
+        'position': settings.get('LOGO_POSITION', 'topright'),
+        'offset_x': settings.get('LOGO_OFFSET_X', '10'),
+        'offset_y': settings.get('LOGO_OFFSET_Y', '10'),
+        'size': settings.get('LOGO_SIZE', ''),
+        'opacity': settings.get('LOGO_OPACITY', '1.0'),
+    }
+
+
+def build_profile(settings, source, preset, codecs, logo=None, audio_mode='auto'):
+    """ملف تعريف البث: كل ما يحتاجه بناء أمر ffmpeg، كقيم فقط
+
+    codecs نتيجة فحص المصدر (choose_codecs). logo=None يتبع LOGO_ENABLED، و audio_mode
+    'copy' أو 'aac' يفرض وضع الصوت بدل نتيجة الفحص.
+    """
+    logo = _logo(settings, logo)
+    return {
+        'source': source,
+        'preset': dict(preset or {}),
+        # الشعار يُرسم على الإطارات فلا يمكن نسخ الفيديو
+        'video': 'encode' if logo else codecs['video'],
+        'audio': codecs['audio'] if audio_mode not in ('copy', 'aac') else audio_mode,
+        'encoder': video_encoder(settings.get('USE_GPU', 'off')),
+        'encoder_preset': settings.get('PRESET', 'ultrafast'),
+        'tune': settings.get('TUNE', 'zerolatency'),
+        'pix_fmt': settings.get('PIXEL_FORMAT', 'yuv420p'),
+        'reconnect_delay_max': settings.get('RECONNECT_DELAY_MAX', '10'),
+        'logo': logo,
+    }
+
+
+def input_args(profile):
+    """معاملات المدخل (مثل build_ffmpeg_command في main.sh)
+
+    خيارات إعادة الاتصال لمصادر HTTP المتصلة (TS) فقط: مع HLS (والمُرحِّل المحلي)
+    يجعل -reconnect_at_eof ffmpeg يعيد الاتصال عند نهاية كل قائمة ومقطع.
+    """
+    args = []
+    source = profile['source']
+    if source.startswith(('http://', 'https://')) and not is_hls(source):
+        args += [
+            '-multiple_requests', '1', '-reconnect', '1', '-reconnect_streamed', '1',
+            '-reconnect_at_eof', '1', '-reconnect_delay_max', profile['reconnect_delay_max'],
+            '-timeout', '10000000',
+        ]
+    args += [
+        '-analyzeduration', '3000000', '-probesize', '3000000',
+        '-fflags', '+genpts+discardcorrupt+igndts', '-rw_timeout', '10000000',
+        '-i', profile['source'],
+    ]
+    logo = profile['logo']
+    if logo:
+        args += ['-i', logo['path']]
+    return args
+
+
+def _scale(profile):
+    """تصغير (دون تكبير) إلى ارتفاع إعداد الجودة مع الحفاظ على النسبة"""
+    try:
+        height = int(profile['preset']['resolution'].split('x')[1])
+    except (KeyError, IndexError, ValueError):
+        return None
+    return f"scale=-2:'min({height},ih)'"
+
+
+def filter_args(profile):
+    if profile['video'] == 'copy':
+        return []
+    scale = _scale(profile)
+    logo = profile['logo']
+    if not logo:
+        return ['-vf', scale] if scale else []
+    position = LOGO_POSITIONS.get(logo['position'], LOGO_POSITIONS['topright'])
+    logo_chain = ''
+    if logo['size']:
+        logo_chain += f"scale={logo['size']},"
+    if logo['opacity'] != '1.0':
+        logo_chain += f"format=rgba,colorchannelmixer=aa={logo['opacity']},"
+    base = f'[0:v]{scale}[base];' if scale else '[0:v]null[base];'
+    graph = (
+        f'[1:v]{logo_chain}format=rgba[logo];{base}'
+        f"[base][logo]overlay={position.format(x=logo['offset_x'], y=logo['offset_y'])}[v]"
+    )
+    return ['-filter_complex', graph, '-map', '[v]', '-map', '0:a?']
+
+
+def codec_args(profile, container):
+    """معاملات الترميز لكل مسار: copy للمتوافق، وإلا إعادة ترميز H.264/AAC بإعداد الجودة"""
+    preset = profile['preset']
+    if profile['video'] == 'copy':
+        args = ['-c:v', 'copy']
+    else:
+        fps = int(preset.get('fps') or 30)
+        gop = str(fps * int(preset.get('keyint') or 2))
+        args = ['-c:v', profile['encoder']]
+        if profile['encoder'] == 'libx264':
+            args += ['-preset', profile['encoder_preset'], '-tune', profile['tune']]
+        args += [
+            '-b:v', preset.get('bitrate', '3000k'), '-maxrate', preset.get('maxrate', '3500k'),
+            '-bufsize', preset.get('bufsize', '6000k'), '-pix_fmt', profile['pix_fmt'],
+            '-g', gop, '-keyint_min', gop
+        ]
+    if profile['audio'] == 'copy':
+        args += ['-c:a', 'copy']
+        if container == 'flv':
+            # AAC داخل TS يأتي بترويسات ADTS و FLV يحتاج ASC
+            args += ['-bsf:a', 'aac_adtstoasc']
+    else:
+        args += ['-c:a', 'aac', '-b:a', preset.get('audio_bitrate', '128k'), '-ar', '44100', '-ac', '2']
+    return args
+
+
+def ffmpeg_args(profile, destination, progress=None):
+    """أمر ffmpeg كامل من المصدر إلى وجهة RTMP (progress: هدف -progress اختياري)"""
+    args = ['ffmpeg', '-hide_banner'] + input_args(profile) + filter_args(profile) + codec_args(profile, 'flv')
+    # تصحيح التزامن للمسارات المُعاد ترميزها فقط
+    if profile['audio'] != 'copy':
+        args += ['-async', '1']
+    if profile['video'] != 'copy':
+        args += ['-vsync', 'cfr']
+    args += ['-copytb', '1', '-max_muxing_queue_size', '9999']
+    if progress:
+        args += ['-progress', progress]
+    return args + ['-f', 'flv', '-flvflags', 'no_duration_filesize', destination]
+
+
+def encoder_args(profile):
+    """المُرمِّز المشترك (أو ناسخ مباشر حسب فحص المصدر) يكتب MPEG-TS إلى stdout"""
+    return (
+        ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'warning']
+        + input_args(profile) + filter_args(profile) + codec_args(profile, 'mpegts')
+        + ['-f', 'mpegts', 'pipe:1']
+    )
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Stream Probe
+فحص المصدر بـ ffprobe لاختيار النسخ المباشر (-c copy) لكل مسار عندما
+يستوفي متطلبات المنصة، والرجوع لإعادة الترميز فقط عند الحاجة
+
+واختيار جودة قائمة HLS الرئيسية الأقرب لإعداد الجودة المطلوب بدل ترك ffmpeg
+يختار (غالباً الأعلى) ثم تصغيرها.
+"""
+
+import json
+import subprocess
+import threading
+import time
+
+import m3u8
+
+# متطلبات RTMP لفيسبوك وتليجرام: H.264 (بدون 10-bit أو 4:2:2) و AAC
+COPY_VIDEO_PROFILES = ('Constrained Baseline', 'Baseline', 'Main', 'High')
+COPY_PIX_FMTS = ('yuv420p', 'yuvj420p')
+MAX_COPY_HEIGHT = 1080
+# أقصى مسافة بين الإطارات المفتاحية التي تقبلها المنصة (ثوانٍ)
+MAX_KEYFRAME_INTERVAL = 4.0
+COPY_AUDIO_RATES = (44100, 48000)
+
+# مدة العينة المقروءة لقياس المسافة بين الإطارات المفتاحية
+PROBE_SECONDS = 8
+# نتيجة الفحص تُعاد لنفس المصدر خلال هذه المدة (عدة بثوث من مصدر واحد)
+PROBE_CACHE_TTL = 300
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def probe_source(source_url, timeout=20):
+    """خصائص أول مسار فيديو وأول مسار صوت، أو None إذا فشل الفحص"""
+    try:
+        result = subprocess.run(
+            [
+                'ffprobe', '-v', 'error', '-print_format', 'json',
+                '-show_streams', '-show_packets',
+                '-read_intervals', f'%+{PROBE_SECONDS}',
+                '-show_entries',
+                'stream=index,codec_type,codec_name,profile,pix_fmt,height,sample_rate,channels'
+                ':packet=stream_index,pts_time,flags',
+                source_url
+            ],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        print(f"تعذّر فحص المصدر {source_url}: {e}")
+        return None
+    if result.returncode != 0:
+        print(f"تعذّر فحص المصدر {source_url}: {result.stderr.strip()[:200]}")
+        return None
+
+    try:
+        data = json.loads(result.stdout or '{}')
+    except ValueError:
+        return None
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    if video:
+        video['keyframe_interval'] = _keyframe_interval(data.get('packets', []), video.get('index'))
+    return {'video': video, 'audio': audio}
+
+
+def _keyframe_interval(packets, stream_index):
+    """أكبر مسافة (ثوانٍ) بين إطارين مفتاحيين متتاليين في العينة"""
+    keyframes = []
+    for packet in packets:
+        if packet.get('stream_index') != stream_index or 'K' not in packet.get('flags', ''):
+            continue
+        try:
+            keyframes.append(float(packet['pts_time']))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if len(keyframes) < 2:
+        # إطار مفتاحي واحد أو أقل في العينة: المسافة أطول من مدتها
+        return None
+    return max(b - a for a, b in zip(keyframes, keyframes[1:]))
+
+
+def video_copy_ok(video):
+    if not video or video.get('codec_name') != 'h264':
+        return False
+    if video.get('profile') not in COPY_VIDEO_PROFILES:
+        return False
+    if video.get('pix_fmt') not in COPY_PIX_FMTS:
+        return False
+    if (video.get('height') or 0) > MAX_COPY_HEIGHT:
+        return False
+    interval = video.get('keyframe_interval')
+    return interval is not None and interval <= MAX_KEYFRAME_INTERVAL
+
+
+def audio_copy_ok(audio):
+    if not audio or audio.get('codec_name') != 'aac':
+        return False
+    try:
+        sample_rate = int(audio.get('sample_rate') or 0)
+    except ValueError:
+        return False
+    return sample_rate in COPY_AUDIO_RATES and (audio.get('channels') or 0) in (1, 2)
+
+
+def choose_codecs(source_url):
+    """{'video': 'copy'|'encode', 'audio': 'copy'|'aac'} حسب فحص المصدر
+
+    عند فشل الفحص نعيد الترميز بالكامل (السلوك السابق).
+    """
+    with _cache_lock:
+        cached = _cache.get(source_url)
+        if cached and time.time() - cached[0] < PROBE_CACHE_TTL:
+            return dict(cached[1])
+
+    info = probe_source(source_url)
+    if not info:
+        return {'video': 'encode', 'audio': 'aac'}
+    codecs = {
+        'video': 'copy' if video_copy_ok(info['video']) else 'encode',
+        'audio': 'copy' if audio_copy_ok(info['audio']) else 'aac'
+    }
+    with _cache_lock:
+        _cache[source_url] = (time.time(), codecs)
+    return dict(codecs)
+
+
+def _bits(value):
+    """'3000k' أو '3M' -> بت/ثانية"""
+    value = str(value).strip().lower()
+    factor = {'k': 1000, 'm': 1000 * 1000}.get(value[-1:], 1)
+    try:
+        return int(float(value.rstrip('km')) * factor)
+    except ValueError:
+        return 0
+
+
+def _external_audio(playlist, variant):
+    """هل صوت هذه الجودة في قائمة منفصلة (فيضيع إذا مُرر رابط الجودة وحده)"""
+    group = variant.stream_info.audio
+    return bool(group) and any(
+        media.type == 'AUDIO' and media.group_id == group and media.uri for media in playlist.media
+    )
+
+
+def select_variant(source_url, preset, timeout=10):
+    """(رابط الجودة المختارة، وصفها) من قائمة HLS رئيسية حسب دقة ومعدل بت الإعداد
+
+    أصغر جودة لا تقل عن دقة الإعداد (الأقرب معدل بت عند التساوي)، وإلا أعلى جودة
+    دونها. يعيد (source_url، None) إذا لم يكن المصدر قائمة رئيسية أو تعذّر تحليله.
+    """
+    if not preset or '.m3u8' not in source_url.split('?')[0]:
+        return source_url, None
+    try:
+        playlist = m3u8.load(source_url, timeout=timeout)
+    except Exception as e:
+        print(f"تعذّر تحليل قائمة HLS {source_url}: {e}")
+        return source_url, None
+    if not playlist.is_variant:
+        return source_url, None
+
+    variants = [
+        variant for variant in playlist.playlists
+        if variant.stream_info and variant.stream_info.bandwidth and not _external_audio(playlist, variant)
+    ]
+    if not variants:
+        return source_url, None
+    try:
+        target_height = int(preset['resolution'].split('x')[1])
+    except (KeyError, IndexError, ValueError):
+        target_height = 0
+    target_bits = _bits(preset.get('bitrate', 0))
+
+    def distance(variant):
+        info = variant.stream_info
+        if info.resolution and target_height:
+            below = info.resolution[1] < target_height
+            gap = abs(info.resolution[1] - target_height)
+        else:
+            below = info.bandwidth < target_bits
+            gap = 0
+        return below, gap, abs(info.bandwidth - target_bits)
+
+    chosen = min(variants, key=distance)
+    resolution = chosen.stream_info.resolution
+    return chosen.absolute_uri, {
+        'resolution': f'{resolution[0]}x{resolution[1]}' if resolution else None,
+        'bandwidth': chosen.stream_info.bandwidth
+    }
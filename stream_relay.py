@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Stream Relay
+مُرحِّل HLS محلي: كل قائمة m3u8 تُسحب من الأصل مرة واحدة مهما كان عدد المستهلكين
+(بثوث ffmpeg وفحص ffprobe و check_source)، والمقاطع الحديثة تبقى في ذاكرة LRU
+محدودة الحجم وتُقدَّم لهم من 127.0.0.1
+
+القوائم تُعاد كتابتها: الجودات والمسارات البديلة تشير إلى /hls/<id>.m3u8 والمقاطع
+إلى /seg/<token> على المُرحِّل، والمفاتيح (EXT-X-KEY) تبقى روابط مطلقة إلى الأصل.
+"""
+
+import hashlib
+import posixpath
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+TARGET_DURATION_PATTERN = re.compile(r'^#EXT-X-TARGETDURATION:\s*(\d+)', re.MULTILINE)
+# وسوم روابطها قوائم أخرى (تمر بالمُرحِّل أيضاً)
+PLAYLIST_TAGS = ('#EXT-X-MEDIA', '#EXT-X-I-FRAME-STREAM-INF')
+# وسوم روابطها مقاطع قابلة للتخزين
+SEGMENT_TAGS = ('#EXT-X-MAP',)
+
+# القائمة الرئيسية لا تتغير تقريباً؛ قائمة البث المباشر تُعاد كل نصف مدة مقطع
+MASTER_PLAYLIST_TTL = 10.0
+MIN_PLAYLIST_TTL = 0.5
+MAX_PLAYLIST_TTL = 2.0
+# عدد الروابط المحفوظة (معرف -> رابط الأصل) قبل نسيان الأقدم
+MAX_PLAYLISTS = 1000
+MAX_SEGMENT_URLS = 20000
+
+CONTENT_TYPES = {
+    '.ts': 'video/mp2t',
+    '.aac': 'audio/aac',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+}
+
+
+def is_hls(url):
+    return '.m3u8' in urlsplit(url).path
+
+
+class SegmentCache:
+    """المقاطع الأحدث استخداماً حتى max_bytes (الأقدم يخرج أولاً)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        # مقطع يأخذ أكثر من ربع الذاكرة يُقدَّم دون تخزين
+        if len(data) > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class _Flight:
+    """طلب واحد إلى الأصل ينتظره جميع المستهلكين المتزامنين"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class HlsRelay:
+    """خادم HTTP محلي يعمل لدى المالك (حيث تعمل عمليات ffmpeg)"""
+
+    def __init__(self, port=0, max_bytes=128 * 1024 * 1024, timeout=15):
+        self.port = port
+        self.timeout = timeout
+        self.segments = SegmentCache(max_bytes)
+        self._lock = threading.Lock()
+        self._playlists = OrderedDict()
+        self._segment_urls = OrderedDict()
+        self._playlist_cache = {}
+        self._flights = {}
+        self._server = None
+
+    @property
+    def running(self):
+        return self._server is not None
+
+    def start(self):
+        if self._server:
+            return
+        relay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                relay._serve(self, body=True)
+
+            def do_HEAD(self):
+                relay._serve(self, body=False)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        server.daemon_threads = True
+        self.port = server.server_address[1]
+        self._server = server
+        threading.Thread(target=server.serve_forever, name='hls-relay', daemon=True).start()
+        print(f"مُرحِّل HLS المحلي على المنفذ {self.port}")
+
+    def local_url(self, url):
+        """رابط المُرحِّل لقائمة HLS (أي مصدر آخر، أو المُرحِّل متوقف: الرابط كما هو)"""
+        if not self._server or not url or not is_hls(url):
+            return url
+        return self._playlist_url(url)
+
+    def _playlist_url(self, url):
+        playlist_id = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self._playlists[playlist_id] = url
+            self._playlists.move_to_end(playlist_id)
+            while len(self._playlists) > MAX_PLAYLISTS:
+                old_id, _ = self._playlists.popitem(last=False)
+                self._playlist_cache.pop(old_id, None)
+        return f'http://127.0.0.1:{self.port}/hls/{playlist_id}.m3u8'
+
+    def _segment_url(self, url):
+        extension = posixpath.splitext(urlsplit(url).path)[1][:8]
+        token = hashlib.sha1(url.encode('utf-8')).hexdigest()[:20] + extension
+        with self._lock:
+            self._segment_urls[token] = url
+            self._segment_urls.move_to_end(token)
+            while len(self._segment_urls) > MAX_SEGMENT_URLS:
+                self._segment_urls.popitem(last=False)
+        return f'http://127.0.0.1:{self.port}/seg/{token}'
+
+    def _rewrite(self, text, base_url):
+        """روابط القائمة -> روابط المُرحِّل (مع حل الروابط النسبية من رابط الأصل النهائي)"""
+        master = '#EXT-X-STREAM-INF' in text
+
+        def tag_uri(line, local):
+            return URI_ATTRIBUTE.sub(lambda m: f'URI="{local(urljoin(base_url, m.group(1)))}"', line)
+
+        lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                lines.append(line)
+            elif stripped.startswith(PLAYLIST_TAGS):
+                lines.append(tag_uri(stripped, self._playlist_url))
+            elif stripped.startswith(SEGMENT_TAGS):
+                lines.append(tag_uri(stripped, self._segment_url))
+            elif stripped.startswith('#'):
+                lines.append(tag_uri(stripped, lambda url: url))
+            else:
+                url = urljoin(base_url, stripped)
+                lines.append(self._playlist_url(url) if master else self._segment_url(url))
+        return '\n'.join(lines) + '\n', master
+
+    def _once(self, key, fetch):
+        """fetch() مرة واحدة لكل مفتاح مهما تزامن الطالبون"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if not flight.done.wait(self.timeout * 2):
+                raise TimeoutError('انتهت مهلة انتظار الأصل')
+            if flight.error:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fetch()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _fetch(self, url, user_agent):
+        request = urllib.request.Request(url, headers={'User-Agent': user_agent or 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read(), response.geturl()
+
+    def _playlist(self, playlist_id, user_agent):
+        with self._lock:
+            url = self._playlists.get(playlist_id)
+            cached = self._playlist_cache.get(playlist_id)
+        if url is None:
+            return None
+        if cached and time.time() < cached[0]:
+            return cached[1]
+
+        def fetch():
+            data, final_url = self._fetch(url, user_agent)
+            text, master = self._rewrite(data.decode('utf-8', 'replace'), final_url)
+            if master:
+                ttl = MASTER_PLAYLIST_TTL
+            else:
+                match = TARGET_DURATION_PATTERN.search(text)
+                ttl = min(max(int(match.group(1)) / 2 if match else 0, MIN_PLAYLIST_TTL), MAX_PLAYLIST_TTL)
+            body = text.encode('utf-8')
+            with self._lock:
+                self._playlist_cache[playlist_id] = (time.time() + ttl, body)
+            return body
+
+        return self._once(('playlist', playlist_id), fetch)
+
+    def _segment(self, token, user_agent):
+        data = self.segments.get(token)
+        if data is not None:
+            return data
+        with self._lock:
+            url = self._segment_urls.get(token)
+        if url is None:
+            return None
+
+        def fetch():
+            data, _ = self._fetch(url, user_agent)
+            self.segments.put(token, data)
+            return data
+
+        return self._once(('segment', token), fetch)
+
+    def _serve(self, handler, body):
+        path = urlsplit(handler.path).path
+        user_agent = handler.headers.get('User-Agent')
+        try:
+            if path.startswith('/hls/') and path.endswith('.m3u8'):
+                data = self._playlist(path[len('/hls/'):-len('.m3u8')], user_agent)
+                content_type = 'application/vnd.apple.mpegurl'
+            elif path.startswith('/seg/'):
+                token = path[len('/seg/'):]
+                data = self._segment(token, user_agent)
+                content_type = CONTENT_TYPES.get(posixpath.splitext(token)[1], 'application/octet-stream')
+            else:
+                data = None
+            if data is None:
+                handler.send_error(404)
+                return
+        except urllib.error.HTTPError as e:
+            handler.send_error(e.code)
+            return
+        except Exception as e:
+            print(f"خطأ في المُرحِّل عند جلب {path}: {e}")
+            handler.send_error(502)
+            return
+        try:
+            handler.send_response(200)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(data)))
+            handler.send_header('Cache-Control', 'no-cache')
+            handler.end_headers()
+            if body:
+                handler.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Stream Status Snapshot
+لقطة مُرقّمة لحالات البثوث يحدّثها خيط خلفي، تُقدَّم مع ETag ودلتا ?since=
+
+رقم الإصدار هو إصدار المخزن المشترك، فيبقى متسقاً بين جميع عمليات gunicorn.
+"""
+
+import copy
+import threading
+
+
+class StatusSnapshot:
+    """لقطة بثوث نوع واحد مع رقم إصدار يزيد عند كل تغيير في المخزن"""
+
+    def __init__(self, name, store, kind, interval=1.0, on_change=None):
+        self.name = name
+        self._store = store
+        self._kind = kind
+        self._interval = interval
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._version = -1
+        self._streams = []
+
+    def start(self):
+        """تشغيل خيط التحديث الدوري"""
+        if self._thread:
+            return
+        self.refresh()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f'snapshot-{self.name}',
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"خطأ في تحديث لقطة {self.name}: {e}")
+
+    def wake(self):
+        """طلب تحديث فوري من الخيط الخلفي"""
+        self._wake.set()
+
+    def refresh(self):
+        """إعادة تحميل القائمة فقط إذا تغيّر إصدار المخزن (استعلام رقم واحد)"""
+        version = self._store.version()
+        if version == self._version:
+            return version
+        streams = self._store.list(self._kind)
+        with self._lock:
+            self._version = version
+            self._streams = streams
+        if self._on_change:
+            self._on_change(self.name, version)
+        return version
+
+    @property
+    def version(self):
+        return self._version
+
+    def etag(self, version, since=None):
+        if since is None:
+            return f'{self.name}-{version}'
+        return f'{self.name}-{version}-{since}'
+
+    def payload(self, since=None):
+        """القائمة كاملة، أو التغييرات فقط منذ الإصدار since"""
+        if since is not None:
+            delta = self._store.changes(self._kind, since)
+            if delta is not None:
+                delta['full'] = False
+                return delta
+        with self._lock:
+            return {
+                'version': self._version,
+                'full': True,
+                'streams': copy.deepcopy(self._streams)
+            }
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Stream Store
+مخزن البثوث في SQLite (وضع WAL): تحديث لكل سجل، بحث بالمعرف، كتابة آمنة عند الانهيار
+ومشترك بين جميع عمليات gunicorn (الحالات، المهام، الأحداث)
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS streams_kind ON streams (kind, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS removed (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS secrets (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    action TEXT NOT NULL,
+    stream_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extractions (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS extractions_used ON extractions (used_at);
+"""
+
+# عدد شواهد الحذف المحفوظة لحساب دلتا ?since=
+MAX_REMOVED = 500
+
+
+class StreamStore:
+    """سجلات البثوث (قاموس JSON لكل بث) مفهرسة بالمعرف والنوع"""
+
+    def __init__(self, path, on_change=None):
+        self.path = str(path)
+        self._local = threading.local()
+        self._on_change = on_change
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(streams)')]
+        if 'version' not in columns:
+            conn.execute('ALTER TABLE streams ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS streams_version ON streams (kind, version)')
+
+    def _connection(self):
+        """اتصال واحد لكل خيط؛ SQLite يتولى القفل بين الخيوط والعمليات"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, mode='IMMEDIATE'):
+        """معاملة (كتابة حصرية افتراضياً) تُلغى بالكامل عند أي خطأ"""
+        conn = self._connection()
+        conn.execute(f'BEGIN {mode}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _changed(self, kind):
+        if self._on_change:
+            try:
+                self._on_change(kind)
+            except Exception as e:
+                print(f"خطأ في مستمع المخزن: {e}")
+
+    @staticmethod
+    def _bump(conn):
+        """رفع رقم الإصدار العام داخل المعاملة الحالية"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        return conn.execute("SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'version'").fetchone()[0]
+
+    @staticmethod
+    def _meta_int(conn, key):
+        row = conn.execute('SELECT CAST(value AS INTEGER) FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    # ========== Streams ==========
+
+    def version(self):
+        """رقم الإصدار العام: يزيد مع كل كتابة على أي بث"""
+        return self._meta_int(self._connection(), 'version')
+
+    def list(self, kind):
+        """جميع بثوث نوع معين بترتيب الإضافة"""
+        rows = self._connection().execute(
+            'SELECT data FROM streams WHERE kind = ? ORDER BY seq', (kind,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def changes(self, kind, since):
+        """البثوث المعدلة والمحذوفة بعد الإصدار since (قراءة متسقة واحدة)
+
+        يعيد None إذا كان since أقدم من شواهد الحذف المحفوظة.
+        """
+        with self.transaction('DEFERRED') as conn:
+            version = self._meta_int(conn, 'version')
+            if since < self._meta_int(conn, 'removed_floor') or since > version:
+                return None
+            rows = conn.execute(
+                'SELECT data FROM streams WHERE kind = ? AND version > ? ORDER BY seq', (kind, since)
+            ).fetchall()
+            removed = conn.execute(
+                'SELECT id FROM removed WHERE kind = ? AND version > ?', (kind, since)
+            ).fetchall()
+        return {
+            'version': version,
+            'streams': [json.loads(row[0]) for row in rows],
+            'removed': [row[0] for row in removed]
+        }
+
+    def get(self, stream_id, kind=None):
+        """بث واحد بالمعرف (أو None)"""
+        if kind:
+            row = self._connection().execute(
+                'SELECT data FROM streams WHERE id = ? AND kind = ?', (stream_id, kind)
+            ).fetchone()
+        else:
+            row = self._connection().execute(
+                'SELECT data FROM streams WHERE id = ?', (stream_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def kind_of(self, stream_id):
+        row = self._connection().execute(
+            'SELECT kind FROM streams WHERE id = ?', (stream_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def insert(self, kind, record, secret=None):
+        """إضافة بث؛ secret (مثل مفتاح البث الكامل) يُحفظ منفصلاً ولا يظهر في القوائم"""
+        with self.transaction() as conn:
+            version = self._bump(conn)
+            conn.execute(
+                'INSERT INTO streams (id, kind, data, updated_at, version) VALUES (?, ?, ?, ?, ?)',
+                (record['id'], kind, json.dumps(record, ensure_ascii=False), time.time(), version)
+            )
+            conn.execute('DELETE FROM removed WHERE id = ?', (record['id'],))
+            if secret is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO secrets (id, data) VALUES (?, ?)',
+                    (record['id'], json.dumps(secret, ensure_ascii=False))
+                )
+        self._changed(kind)
+        return record
+
+    def update(self, stream_id, **fields):
+        """تعديل حقول بث واحد؛ يعيد السجل الجديد أو None إذا لم يوجد"""
+        with self.transaction() as conn:
+            row = conn.execute(
+                'SELECT kind, data FROM streams WHERE id = ?', (stream_id,)
+            ).fetchone()
+            if not row:
+                return None
+            kind, record = row[0], json.loads(row[1])
+            if all(record.get(key) == value for key, value in fields.items()):
+                return record
+            record.update(fields)
+            version = self._bump(conn)
+            conn.execute(
+                'UPDATE streams SET data = ?, updated_at = ?, version = ? WHERE id = ?',
+                (json.dumps(record, ensure_ascii=False), time.time(), version, stream_id)
+            )
+        self._changed(kind)
+        return record
+
+    def update_many(self, stream_ids, **fields):
+        """تعديل نفس الحقول لعدة بثوث بكتابة واحدة؛ يعيد معرفات البثوث الموجودة"""
+        updated = []
+        kinds = set()
+        with self.transaction() as conn:
+            version = None
+            for stream_id in stream_ids:
+                row = conn.execute(
+                    'SELECT kind, data FROM streams WHERE id = ?', (stream_id,)
+                ).fetchone()
+                if not row:
+                    continue
+                updated.append(stream_id)
+                record = json.loads(row[1])
+                if all(record.get(key) == value for key, value in fields.items()):
+                    continue
+                record.update(fields)
+                version = version or self._bump(conn)
+                conn.execute(
+                    'UPDATE streams SET data = ?, updated_at = ?, version = ? WHERE id = ?',
+                    (json.dumps(record, ensure_ascii=False), time.time(), version, stream_id)
+                )
+                kinds.add(row[0])
+        for kind in kinds:
+            self._changed(kind)
+        return updated
+
+    def delete(self, stream_id):
+        """حذف بث؛ يعيد السجل المحذوف أو None"""
+        deleted = self.delete_many([stream_id])
+        return deleted[0] if deleted else None
+
+    def delete_many(self, stream_ids):
+        """حذف عدة بثوث بكتابة واحدة؛ يعيد السجلات المحذوفة"""
+        deleted = []
+        kinds = set()
+        with self.transaction() as conn:
+            version = None
+            for stream_id in stream_ids:
+                row = conn.execute(
+                    'SELECT kind, data FROM streams WHERE id = ?', (stream_id,)
+                ).fetchone()
+                if not row:
+                    continue
+                version = version or self._bump(conn)
+                conn.execute('DELETE FROM streams WHERE id = ?', (stream_id,))
+                conn.execute('DELETE FROM secrets WHERE id = ?', (stream_id,))
+                conn.execute(
+                    'INSERT OR REPLACE INTO removed (id, kind, version) VALUES (?, ?, ?)',
+                    (stream_id, row[0], version)
+                )
+                deleted.append(json.loads(row[1]))
+                kinds.add(row[0])
+            if deleted:
+                # تقليم شواهد الحذف القديمة ورفع الحد الأدنى لدلتا ?since=
+                cutoff = conn.execute(
+                    'SELECT version FROM removed ORDER BY version DESC LIMIT 1 OFFSET ?', (MAX_REMOVED,)
+                ).fetchone()
+                if cutoff:
+                    conn.execute('DELETE FROM removed WHERE version <= ?', (cutoff[0],))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('removed_floor', ?)", (cutoff[0],)
+                    )
+        for kind in kinds:
+            self._changed(kind)
+        return deleted
+
+    def get_secret(self, stream_id):
+        row = self._connection().execute(
+            'SELECT data FROM secrets WHERE id = ?', (stream_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def delete_secret(self, secret_id):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM secrets WHERE id = ?', (secret_id,))
+
+    def import_json(self, kind, json_file):
+        """ترحيل ملف JSON القديم مرة واحدة؛ الملف التالف يُترك كما هو ولا يُستبدل بقائمة فارغة"""
+        json_file = Path(json_file)
+        key = f'imported:{kind}'
+        with self.transaction() as conn:
+            if conn.execute('SELECT 1 FROM meta WHERE key = ?', (key,)).fetchone():
+                return 0
+            records = []
+            if json_file.exists():
+                content = json_file.read_text(encoding='utf-8').strip()
+                if content:
+                    try:
+                        records = json.loads(content)
+                    except ValueError as e:
+                        print(f"تعذر ترحيل {json_file.name} (ملف تالف): {e}")
+                        return 0
+            if records:
+                version = self._bump(conn)
+            for record in records:
+                conn.execute(
+                    'INSERT OR IGNORE INTO streams (id, kind, data, updated_at, version) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (record['id'], kind, json.dumps(record, ensure_ascii=False), time.time(), version)
+                )
+            conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?)', (key, json_file.name)
+            )
+        if records:
+            self._changed(kind)
+        return len(records)
+
+    # ========== Meta ==========
+
+    def get_meta(self, key, default=None):
+        """قيمة JSON مشتركة بين العمليات (مثل حالة السعة والمعايرة)"""
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+
+    # ========== Jobs ==========
+
+    @staticmethod
+    def _job_row(row):
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'action': row[1],
+            'stream_id': row[2],
+            'payload': json.loads(row[3]),
+            'status': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'created_at': row[7],
+            'finished_at': row[8]
+        }
+
+    _JOB_COLUMNS = 'id, action, stream_id, payload, status, result, error, created_at, finished_at'
+
+    def insert_job(self, job, keep=500, secret=None, single_flight=False):
+        """تسجيل مهمة؛ يعيد المهمة المسجلة
+
+        single_flight: إذا وُجدت مهمة معلّقة أو قيد التنفيذ بنفس النوع والمعرف تُعاد هي بدلاً
+        من إنشاء مهمة جديدة. secret يُحفظ منفصلاً (job:<id>) ولا يظهر في حالة المهمة.
+        """
+        with self.transaction() as conn:
+            if single_flight:
+                row = conn.execute(
+                    f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE action = ? AND stream_id = ? "
+                    "AND status IN ('pending', 'running') ORDER BY created_at LIMIT 1",
+                    (job['action'], job['stream_id'])
+                ).fetchone()
+                if row:
+                    return self._job_row(row)
+            conn.execute(
+                'INSERT INTO jobs (id, action, stream_id, payload, status, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job['id'], job['action'], job['stream_id'],
+                 json.dumps(job['payload'], ensure_ascii=False), job['status'], job['created_at'])
+            )
+            if secret is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO secrets (id, data) VALUES (?, ?)',
+                    (f"job:{job['id']}", json.dumps(secret, ensure_ascii=False))
+                )
+            # الاحتفاظ بآخر المهام المنتهية فقط
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND id NOT IN "
+                "(SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)", (keep,)
+            )
+        return job
+
+    def get_job(self, job_id):
+        row = self._connection().execute(
+            f'SELECT {self._JOB_COLUMNS} FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        return self._job_row(row)
+
+    def pending_jobs(self, limit=20, actions=None):
+        """أقدم المهام المعلّقة، مقصورة على أنواع actions إن حُددت"""
+        query = f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE status = 'pending'"
+        params = []
+        if actions:
+            query += f" AND action IN ({', '.join('?' * len(actions))})"
+            params.extend(actions)
+        rows = self._connection().execute(
+            query + ' ORDER BY created_at LIMIT ?', (*params, limit)
+        ).fetchall()
+        return [self._job_row(row) for row in rows]
+
+    def claim_job(self, job_id):
+        """حجز مهمة معلّقة للتنفيذ (ذرّياً بين العمليات)"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'pending'", (job_id,)
+            )
+            return cursor.rowcount == 1
+
+    def finish_job(self, job_id, status, result=None, error=None):
+        with self.transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id)
+            )
+
+    def fail_running_jobs(self, error, actions=None):
+        """المهام التي كانت قيد التنفيذ لدى مالك سابق توقف فجأة"""
+        condition = "status = 'running'"
+        params = []
+        if actions:
+            condition += f" AND action IN ({', '.join('?' * len(actions))})"
+            params.extend(actions)
+        with self.transaction() as conn:
+            rows = conn.execute(
+                f"SELECT {self._JOB_COLUMNS} FROM jobs WHERE {condition}", params
+            ).fetchall()
+            conn.execute(
+                f"UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE {condition}",
+                (error, time.time(), *params)
+            )
+            conn.executemany('DELETE FROM secrets WHERE id = ?', [(f'job:{row[0]}',) for row in rows])
+        return [row[0] for row in rows]
+
+    # ========== Events ==========
+
+    def append_events(self, events):
+        """إلحاق دفعة أحداث في معاملة واحدة"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO events (type, data, created_at) VALUES (?, ?, ?)',
+                [(event_type, json.dumps(data, ensure_ascii=False), now) for event_type, data in events]
+            )
+
+    def last_event_seq(self):
+        row = self._connection().execute('SELECT MAX(seq) FROM events').fetchone()
+        return row[0] or 0
+
+    def read_events(self, after, limit=1000):
+        rows = self._connection().execute(
+            'SELECT seq, type, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?', (after, limit)
+        ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def prune_events(self, max_age):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM events WHERE created_at < ?', (time.time() - max_age,))
+
+    # ========== Extractions ==========
+
+    def get_extraction(self, key):
+        """نتيجة استخراج محفوظة لم تنتهِ صلاحيتها (مع تحديث وقت آخر استخدام) أو None"""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                'SELECT result, expires_at FROM extractions WHERE key = ?', (key,)
+            ).fetchone()
+            if not row:
+                return None
+            if row[1] <= now:
+                conn.execute('DELETE FROM extractions WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE extractions SET used_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0]), row[1]
+
+    def put_extraction(self, key, result, expires_at, max_entries):
+        """حفظ نتيجة استخراج ثم حذف المنتهية والأقل استخداماً فوق max_entries"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO extractions (key, result, expires_at, used_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(result, ensure_ascii=False), expires_at, now)
+            )
+            conn.execute('DELETE FROM extractions WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM extractions WHERE key IN '
+                '(SELECT key FROM extractions ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (max_entries,)
+            )
+
+    def delete_extraction(self, key):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM extractions WHERE key = ?', (key,))
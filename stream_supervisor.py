@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Stream Supervisor
+مشرف عمليات البث - يملك عمليات ffmpeg ويحتفظ بجدول حالاتها في الذاكرة
+"""
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+from stream_metrics import ProgressMetrics
+
+# يُستبدل في معاملات التشغيل بقناة -progress (pipe:<fd>)
+PROGRESS_TARGET = '{progress}'
+
+# يُضاف لبيئة كل عملية حتى يتعرف مالك جديد على العمليات الناجية من سابقه
+STREAM_ID_ENV = 'STREAM_SUPERVISOR_ID'
+
+# أول إطارات مُرمّزة فعلياً في سطر إحصائيات ffmpeg (frame= أو size= أكبر من صفر)
+READY_PATTERN = re.compile(r'frame=\s*[1-9]\d*|size=\s*[1-9]\d*\s*[kKmM]i?B')
+
+
+def owns_process(stream_id, pid):
+    """هل pid قائد مجموعة عمليات شغّلها مشرف (هذا أو سابق) لهذا البث"""
+    try:
+        if os.getpgid(pid) != pid:
+            return False
+        with open(f'/proc/{pid}/environ', 'rb') as f:
+            return f'{STREAM_ID_ENV}={stream_id}'.encode() in f.read().split(b'\0')
+    except OSError:
+        return False
+
+
+class AdoptedProcess:
+    """عملية ناجية من مالك سابق (ليست ابنة لنا): واجهة Popen الدنيا التي يحتاجها المشرف"""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def poll(self):
+        # عملية منتهية لم يحصدها أبوها الجديد بعد (zombie) تُعد منتهية أيضاً
+        try:
+            with open(f'/proc/{self.pid}/stat', 'rb') as f:
+                state = f.read().rpartition(b')')[2].split()[0]
+        except (OSError, IndexError):
+            return -1
+        return -1 if state in (b'Z', b'X') else None
+
+    def wait(self, timeout=None):
+        """رمز الخروج غير معروف لغير الأب: -1 عند الانتهاء"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.time() >= deadline:
+                raise subprocess.TimeoutExpired(f'pid {self.pid}', timeout)
+            time.sleep(0.2)
+        return -1
+
+
+class StreamSupervisor:
+    """تشغيل عمليات البث ومراقبتها بدون tmux"""
+
+    def __init__(self, log_lines=50):
+        self._lock = threading.Lock()
+        self._procs = {}
+        self._states = {}
+        self._logs = {}
+        self._stopping = set()
+        self._failing = set()
+        self._ready = {}
+        self._metrics = {}
+        self._listeners = []
+        self._log_listeners = []
+        self._log_lines = log_lines
+
+    def add_listener(self, callback):
+        """تسجيل دالة تُستدعى عند كل تغيّر في حالة بث: callback(stream_id, state)"""
+        self._listeners.append(callback)
+
+    def add_log_listener(self, callback):
+        """تسجيل دالة تُستدعى مع كل سطر سجل جديد: callback(stream_id, line, replace)
+
+        replace=True يعني أن السطر يستبدل السابق (سطر إحصائيات ffmpeg المنتهي بـ \\r).
+        """
+        self._log_listeners.append(callback)
+
+    def _notify_log(self, stream_id, line, replace=False):
+        for callback in self._log_listeners:
+            try:
+                callback(stream_id, line, replace)
+            except Exception as e:
+                print(f"خطأ في مستمع السجلات: {e}")
+
+    def _notify(self, stream_id, state):
+        for callback in self._listeners:
+            try:
+                callback(stream_id, state)
+            except Exception as e:
+                print(f"خطأ في مستمع الحالة: {e}")
+
+    def start(self, stream_id, args, cwd=None, env=None, stdin=None, progress=False):
+        """تشغيل عملية بث جديدة وتسجيلها في جدول الحالات
+
+        stdin اختياري (واصف ملف) لعمليات تقرأ مدخلها من أنبوب، مثل وجهات التوزيع.
+        progress=True يفتح قناة ffmpeg -progress: PROGRESS_TARGET في args يُستبدل
+        بطرف الكتابة.
+        """
+        with self._lock:
+            proc = self._procs.get(stream_id)
+            if proc and proc.poll() is None:
+                raise RuntimeError(f'البث {stream_id} يعمل بالفعل')
+
+            pass_fds = ()
+            progress_read = None
+            env = dict(os.environ if env is None else env, **{STREAM_ID_ENV: stream_id})
+            if progress:
+                progress_read, progress_write = os.pipe()
+                target = f'pipe:{progress_write}'
+                args = [target if arg == PROGRESS_TARGET else arg for arg in args]
+                pass_fds = (progress_write,)
+
+            # جلسة مستقلة حتى نستطيع إيقاف bash و ffmpeg معاً
+            try:
+                proc = subprocess.Popen(
+                    args,
+                    stdin=subprocess.DEVNULL if stdin is None else stdin,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=cwd,
+                    env=env,
+                    pass_fds=pass_fds,
+                    start_new_session=True
+                )
+            except Exception:
+                if progress_read is not None:
+                    os.close(progress_read)
+                raise
+            finally:
+                for fd in pass_fds:
+                    os.close(fd)
+            self._procs[stream_id] = proc
+            self._metrics[stream_id] = ProgressMetrics() if progress else None
+            self._logs[stream_id] = deque(maxlen=self._log_lines)
+            self._ready[stream_id] = threading.Event()
+            self._stopping.discard(stream_id)
+            self._failing.discard(stream_id)
+            self._states[stream_id] = {
+                'status': 'starting',
+                'pid': proc.pid,
+                'started_at': time.time(),
+                'exit_code': None
+            }
+            state = dict(self._states[stream_id])
+
+        self._notify(stream_id, state)
+        threading.Thread(
+            target=self._watch,
+            args=(stream_id, proc),
+            name=f'stream-{stream_id}',
+            daemon=True
+        ).start()
+        if progress_read is not None:
+            threading.Thread(
+                target=self._read_progress,
+                args=(stream_id, proc, progress_read),
+                name=f'progress-{stream_id}',
+                daemon=True
+            ).start()
+        return proc.pid
+
+    def _read_progress(self, stream_id, proc, fd):
+        """تحليل كتل -progress؛ أول كتلة بحجم مُخرج أكبر من صفر تعني أن البث يعمل"""
+        metrics = self._metrics.get(stream_id)
+        with os.fdopen(fd, 'r', encoding='utf-8', errors='replace') as channel:
+            for line in channel:
+                if metrics.feed_line(line) and metrics.output_started:
+                    self._mark_ready(stream_id, proc)
+
+    def _mark_ready(self, stream_id, proc):
+        """ffmpeg أخرج أول إطاراته: البث يعمل فعلاً"""
+        with self._lock:
+            state = self._states.get(stream_id)
+            if self._procs.get(stream_id) is not proc or not state or state['status'] != 'starting':
+                return
+            state['status'] = 'running'
+            state['ready_at'] = time.time()
+            state = dict(state)
+            self._ready[stream_id].set()
+        self._notify(stream_id, state)
+
+    def _watch(self, stream_id, proc):
+        """قراءة مخرجات العملية حتى تنتهي ثم تسجيل حالة الخروج"""
+        logs = self._logs[stream_id]
+        ready = False
+        pending = b''
+        overwrite = False
+        while True:
+            chunk = proc.stdout.read1(4096)
+            if not chunk:
+                break
+            pending += chunk
+            # ffmpeg يكتب سطر الإحصائيات بـ \r، فنستبدل السطر السابق بدل تكديسه
+            parts = re.split(rb'(\r\n|\r|\n)', pending)
+            pending = parts.pop()
+            for text, sep in zip(parts[::2], parts[1::2]):
+                line = text.decode('utf-8', 'replace')
+                replace = overwrite and bool(logs)
+                if replace:
+                    logs[-1] = line
+                else:
+                    logs.append(line)
+                overwrite = sep == b'\r'
+                self._notify_log(stream_id, line, replace)
+                if not ready and READY_PATTERN.search(line):
+                    ready = True
+                    self._mark_ready(stream_id, proc)
+        if pending:
+            line = pending.decode('utf-8', 'replace')
+            logs.append(line)
+            self._notify_log(stream_id, line)
+        proc.stdout.close()
+        self._finish(stream_id, proc, proc.wait())
+
+    def adopt(self, stream_id, pid):
+        """تبنّي عملية بث ناجية من مالك سابق بدل إعادة تشغيلها
+
+        يعيد False إذا لم تكن pid عملية هذا البث. العملية المتبناة تُراقب حتى تنتهي
+        وتُوقف كغيرها، لكن بدون سجلات أو مقاييس (مخرجاتها كانت للمالك السابق).
+        """
+        if not owns_process(stream_id, pid):
+            return False
+        proc = AdoptedProcess(pid)
+        with self._lock:
+            if stream_id in self._procs:
+                return False
+            self._procs[stream_id] = proc
+            self._metrics[stream_id] = None
+            self._logs[stream_id] = deque(maxlen=self._log_lines)
+            self._ready[stream_id] = threading.Event()
+            self._ready[stream_id].set()
+            self._stopping.discard(stream_id)
+            self._failing.discard(stream_id)
+            self._states[stream_id] = {
+                'status': 'running',
+                'pid': pid,
+                'started_at': time.time(),
+                'ready_at': time.time(),
+                'exit_code': None,
+                'adopted': True
+            }
+            state = dict(self._states[stream_id])
+        self._notify(stream_id, state)
+        threading.Thread(
+            target=lambda: self._finish(stream_id, proc, proc.wait()),
+            name=f'adopted-{stream_id}',
+            daemon=True
+        ).start()
+        return True
+
+    def _finish(self, stream_id, proc, exit_code):
+        """تسجيل حالة خروج العملية"""
+        with self._lock:
+            if self._procs.get(stream_id) is not proc:
+                return
+            del self._procs[stream_id]
+            stopped = (stream_id in self._stopping or exit_code == 0) and stream_id not in self._failing
+            self._stopping.discard(stream_id)
+            self._failing.discard(stream_id)
+            self._ready[stream_id].set()
+            state = self._states.get(stream_id)
+            if not state:
+                return
+            state.update({
+                'status': 'stopped' if stopped else 'failed',
+                'pid': None,
+                'exit_code': exit_code
+            })
+            state = dict(state)
+        self._notify(stream_id, state)
+
+    def stop(self, stream_id, timeout=5, failed=False):
+        """إيقاف عملية البث (SIGTERM ثم SIGKILL عند انتهاء المهلة)
+
+        failed=True يسجّل الخروج فشلاً لا إيقافاً (مثل استسلام المراقب بعد تكرار الانهيار).
+        """
+        with self._lock:
+            proc = self._procs.get(stream_id)
+            if not proc:
+                return False
+            (self._failing if failed else self._stopping).add(stream_id)
+
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            pass
+        return True
+
+    def forget(self, stream_id):
+        """إيقاف البث وحذف حالته وسجلاته من الذاكرة
+
+        المستمعون يتلقون الحالة الأخيرة (stopped أو failed) دائماً حتى يحرروا ما يخص
+        البث، سواء سجّلها خيط المراقبة قبل الحذف أو لم يصل إليها بعد.
+        """
+        self.stop(stream_id)
+        with self._lock:
+            proc = self._procs.pop(stream_id, None)
+            failed = stream_id in self._failing
+            self._stopping.discard(stream_id)
+            self._failing.discard(stream_id)
+            state = self._states.pop(stream_id, None)
+            self._logs.pop(stream_id, None)
+            self._metrics.pop(stream_id, None)
+            ready = self._ready.pop(stream_id, None)
+        if ready:
+            ready.set()
+        # _finish لن يسجّل خروج عملية حُذفت من الجدول
+        if proc and state:
+            state.update({'status': 'failed' if failed else 'stopped', 'pid': None, 'exit_code': proc.poll()})
+            self._notify(stream_id, dict(state))
+
+    def wait_ready(self, stream_id, timeout):
+        """انتظار أول إطارات مُخرجة؛ يعيد True إذا أصبح البث يعمل قبل المهلة"""
+        with self._lock:
+            ready = self._ready.get(stream_id)
+        if not ready:
+            return False
+        ready.wait(timeout)
+        return self.is_running(stream_id)
+
+    def status(self, stream_id):
+        """حالة البث الحالية بدون أي استدعاء خارجي"""
+        state = self._states.get(stream_id)
+        return state['status'] if state else 'stopped'
+
+    def is_running(self, stream_id):
+        return self.status(stream_id) == 'running'
+
+    def state(self, stream_id):
+        """نسخة من سجل حالة البث"""
+        with self._lock:
+            state = self._states.get(stream_id)
+            return dict(state) if state else None
+
+    def logs(self, stream_id):
+        """آخر أسطر مخرجات ffmpeg للبث"""
+        with self._lock:
+            logs = self._logs.get(stream_id)
+            return list(logs) if logs is not None else None
+
+    def metrics(self, stream_id):
+        """مقاييس -progress للبث إذا كان يعمل بقناة progress"""
+        with self._lock:
+            if stream_id not in self._procs:
+                return None
+            metrics = self._metrics.get(stream_id)
+        return metrics.snapshot() if metrics else None
+
+    def all_metrics(self):
+        with self._lock:
+            items = [(sid, m) for sid, m in self._metrics.items() if m and sid in self._procs]
+        return {sid: m.snapshot() for sid, m in items}
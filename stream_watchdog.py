@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Stream Watchdog
+مراقبة صحة البثوث فوق المشرف: البث "يعمل" ما دامت عملية ffmpeg حية، لكنه قد يكون
+عالقاً في إعادة الاتصال بمصدر ميت أو يُرمِّز أبطأ من الوقت الحقيقي. المراقب يكشف:
+توقف نمو المُخرج، وسرعة أقل من min_speed لمدة متصلة، وأخطاء كتابة RTMP متكررة،
+وخروج العملية بخطأ؛ ثم يعيد التشغيل بتأخير أُسّي عشوائي، ويعلن فشل البث عند تكرار
+الانهيار (max_restarts خلال restart_window)
+"""
+
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# أخطاء الكتابة إلى وجهة RTMP في سجل ffmpeg
+WRITE_ERROR_PATTERN = re.compile(
+    r'av_interleaved_write_frame|Error muxing a packet|Error writing trailer|Broken pipe'
+    r'|Connection reset by peer|Failed to update header|RTMP_SendPacket|Error in the pull function',
+    re.IGNORECASE
+)
+
+
+class StreamHealth:
+    """ما يعرفه المراقب عن بث واحد"""
+
+    def __init__(self):
+        self.restarts = deque()
+        self.total_restarts = 0
+        self.errors = deque()
+        self.samples = deque()
+        self.restart_at = None
+        self.restarting = False
+
+    def reset(self):
+        self.errors.clear()
+        self.samples.clear()
+
+
+class StreamWatchdog:
+    """خيط واحد يفحص مقاييس جميع البثوث كل interval ثانية
+
+    restart(stream_id) يعيد تشغيل البث ويرفع استثناءً إذا فشل، و on_restart(stream_id,
+    reason, delay, count) يُستدعى عند جدولة إعادة التشغيل، و on_failed(stream_id,
+    reason, count) عند الاستسلام.
+    """
+
+    def __init__(self, supervisor, restart, on_restart=None, on_failed=None, stall_seconds=30,
+                 min_speed=0.9, slow_seconds=60, write_errors=5, error_window=30, backoff_base=2,
+                 backoff_max=120, max_restarts=5, restart_window=600, interval=2):
+        self.supervisor = supervisor
+        self.stall_seconds = stall_seconds
+        self.min_speed = min_speed
+        self.slow_seconds = slow_seconds
+        self.write_errors = write_errors
+        self.error_window = error_window
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.interval = interval
+        self._restart = restart
+        self._on_restart = on_restart
+        self._on_failed = on_failed
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='stream-watchdog', daemon=True)
+        self._thread.start()
+
+    def forget(self, stream_id):
+        """البث أُوقف أو حُذف عمداً: إلغاء أي إعادة تشغيل مجدولة"""
+        with self._lock:
+            self._streams.pop(stream_id, None)
+
+    def on_state(self, stream_id, state):
+        """مستمع حالات المشرف"""
+        status = state['status']
+        with self._lock:
+            health = self._streams.get(stream_id)
+            if status == 'running':
+                health = self._streams.setdefault(stream_id, health or StreamHealth())
+                health.reset()
+                return
+            # أحداث الإيقاف والفشل أثناء إعادة التشغيل نحن سببها
+            if not health or health.restarting or health.restart_at:
+                return
+            if status == 'stopped':
+                del self._streams[stream_id]
+                return
+        if status == 'failed':
+            self.report(stream_id, f"خروج ffmpeg ({state.get('exit_code')})")
+
+    def on_log(self, stream_id, line, replace):
+        """مستمع سجلات المشرف: عدّ أخطاء الكتابة إلى الوجهة"""
+        if replace or not WRITE_ERROR_PATTERN.search(line):
+            return
+        now = time.time()
+        with self._lock:
+            health = self._streams.get(stream_id)
+            if not health or health.restarting or health.restart_at:
+                return
+            health.errors.append(now)
+            while health.errors and now - health.errors[0] > self.error_window:
+                health.errors.popleft()
+            count = len(health.errors)
+        if count >= self.write_errors:
+            self.report(stream_id, f'{count} أخطاء كتابة RTMP خلال {self.error_window} ثانية')
+
+    def report(self, stream_id, reason):
+        """بث غير سليم: جدولة إعادة تشغيله أو إعلان فشله عند تكرار الانهيار"""
+        now = time.time()
+        with self._lock:
+            health = self._streams.get(stream_id)
+            if not health or health.restart_at:
+                return
+            while health.restarts and now - health.restarts[0] > self.restart_window:
+                health.restarts.popleft()
+            if len(health.restarts) >= self.max_restarts:
+                del self._streams[stream_id]
+                count = health.total_restarts
+                failed = True
+            else:
+                # تأخير أُسّي مع عشوائية (بين نصفه وكامله) حتى لا تعود البثوث معاً
+                delay = min(self.backoff_max, self.backoff_base * 2 ** len(health.restarts))
+                delay = round(random.uniform(delay / 2, delay), 1)
+                health.restarts.append(now)
+                health.total_restarts += 1
+                health.restart_at = now + delay
+                count = health.total_restarts
+                failed = False
+        if failed:
+            callback, args = self._on_failed, (stream_id, reason, count)
+        else:
+            callback, args = self._on_restart, (stream_id, reason, delay, count)
+        if callback:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"خطأ في مستمع المراقب: {e}")
+
+    def _check(self, health, metrics, now):
+        """سبب عدم السلامة من مقاييس -progress أو None"""
+        if metrics.get('stall_seconds', 0) >= self.stall_seconds:
+            return f"لا مُخرج منذ {metrics['stall_seconds']:.0f} ثانية"
+        out_time = metrics.get('out_time_s')
+        if out_time is None or not self.min_speed:
+            return None
+        # السرعة الفعلية في آخر slow_seconds (speed في progress متوسط منذ البدء)
+        health.samples.append((now, out_time))
+        while len(health.samples) > 1 and now - health.samples[1][0] >= self.slow_seconds:
+            health.samples.popleft()
+        started, first = health.samples[0]
+        if now - started < self.slow_seconds:
+            return None
+        speed = (out_time - first) / (now - started)
+        if speed < self.min_speed:
+            return f'سرعة {speed:.2f}x أقل من {self.min_speed}x لمدة {self.slow_seconds:.0f} ثانية'
+        return None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                items = list(self._streams.items())
+            for stream_id, health in items:
+                try:
+                    if health.restart_at:
+                        if not health.restarting and now >= health.restart_at:
+                            health.restarting = True
+                            threading.Thread(
+                                target=self._do_restart, args=(stream_id, health),
+                                name=f'restart-{stream_id}', daemon=True
+                            ).start()
+                        continue
+                    if not self.supervisor.is_running(stream_id):
+                        continue
+                    metrics = self.supervisor.metrics(stream_id)
+                    reason = metrics and self._check(health, metrics, now)
+                    if reason:
+                        self.report(stream_id, reason)
+                except Exception as e:
+                    print(f"خطأ في مراقبة البث {stream_id}: {e}")
+
+    def _do_restart(self, stream_id, health):
+        try:
+            self._restart(stream_id)
+            error = None
+        except Exception as e:
+            error = e
+        with self._lock:
+            if self._streams.get(stream_id) is not health:
+                return
+            health.restarting = False
+            health.restart_at = None
+            health.reset()
+        if error:
+            self.report(stream_id, f'فشلت إعادة التشغيل: {error}')
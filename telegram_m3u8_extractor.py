@@ -2,21 +2,92 @@
 """
 Telegram M3U8 Stream Extractor
 استخراج روابط M3U8 من بثوث تليجرام بطريقة تلقائية
+
+الطرق الثلاث وجميع فحوص الروابط المرشحة تعمل بالتوازي على مجمّع خيوط يتشارك
+مجمّع اتصالات محدود؛ أول رابط صالح يفوز وتُلغى بقية الفحوص، والاستخراج كله
+مقيد بمهلة إجمالية.
 """
 
 import re
 import json
+import threading
+import time
 import requests
-from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
-import m3u8
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+
+# مهلة كل طلب (ثوانٍ)؛ تُقص دائماً إلى ما تبقى من المهلة الإجمالية
+PAGE_TIMEOUT = 30
+PROBE_TIMEOUT = 10
+CDN_PROBE_TIMEOUT = 5
+
+# رابط M3U8 ينتهي عند أول مسافة أو علامة تنصيص أو < >
+M3U8_URL_PATTERN = re.compile(r'https?://[^\s<>"\']+?\.m3u8[^\s<>"\']*')
+URL_DELIMITERS = ' \t\n\r\f\v<>"\''
+# أطول رابط يُحتفظ به معلقاً بين دفعتين
+MAX_URL_LENGTH = 8192
+# حجم دفعة القراءة من الصفحة
+SCAN_CHUNK_SIZE = 64 * 1024
+
+
+class M3U8Scanner:
+    """ماسح روابط M3U8 بمرور واحد على نص يصل دفعة بعد دفعة
+
+    الرابط لا يحتوي أي فاصل (مسافة، تنصيص، < >)، لذلك كل ما قبل آخر فاصل في الدفعة
+    نهائي، وما بعده فقط يُحتفظ به لأن الرابط قد يكمل في الدفعة التالية.
+    """
+    
+    def __init__(self):
+        self.urls = []
+        self._seen = set()
+        self._tail = ''
+    
+    def feed(self, text):
+        """مسح دفعة جديدة؛ يعيد الروابط الجديدة بترتيب ظهورها"""
+        buffer = self._tail + text
+        cut = max(buffer.rfind(char) for char in URL_DELIMITERS) + 1
+        if len(buffer) - cut > MAX_URL_LENGTH:
+            cut = len(buffer) - MAX_URL_LENGTH
+        self._tail = buffer[cut:]
+        return self._scan(buffer, cut)
+    
+    def close(self):
+        """نهاية النص: ما بقي معلقاً أصبح نهائياً"""
+        buffer, self._tail = self._tail, ''
+        return self._scan(buffer, len(buffer))
+    
+    def _scan(self, buffer, end):
+        found = []
+        if '.m3u8' not in buffer:
+            return found
+        for match in M3U8_URL_PATTERN.finditer(buffer, 0, end):
+            url = match.group()
+            if url not in self._seen:
+                self._seen.add(url)
+                self.urls.append(url)
+                found.append(url)
+        return found
+
+
+def sort_candidates(urls):
+    """ترتيب حسب الأولوية (master.m3u8 أولاً) مع الحفاظ على ترتيب الظهور داخل كل فئة"""
+    return sorted(urls, key=lambda x: (
+        'master.m3u8' not in x.lower(),
+        'playlist.m3u8' not in x.lower(),
+        'index.m3u8' not in x.lower()
+    ))
 
 
 class TelegramM3U8Extractor:
     """مستخرج روابط M3U8 من تليجرام"""
     
-    def __init__(self):
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
         self.session = requests.Session()
+        # اتصالات محدودة يتشاركها كل الخيوط (تنتظر عند امتلاء المجمّع بدل فتح المزيد)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': '*/*',
@@ -49,38 +120,10 @@ class TelegramM3U8Extractor:
     
     def extract_m3u8_from_html(self, html_content, base_url):
         """استخراج روابط M3U8 من HTML"""
-        m3u8_urls = []
-        
-        # البحث باستخدام regex
-        patterns = [
-            r'https?://[^\s<>"\']+?\.m3u8[^\s<>"\']*',
-            r'"(https?://[^"]+\.m3u8[^"]*)"',
-            r"'(https?://[^']+\.m3u8[^']*)'",
-        ]
-        
-        for pattern in patterns:
-            found = re.findall(pattern, html_content)
-            m3u8_urls.extend(found)
-        
-        # البحث في script tags
-        soup = BeautifulSoup(html_content, 'html.parser')
-        scripts = soup.find_all('script')
-        for script in scripts:
-            if script.string:
-                found = re.findall(r'https?://[^\s<>"\']+?\.m3u8[^\s<>"\']*', script.string)
-                m3u8_urls.extend(found)
-        
-        # إزالة المكررات
-        unique_urls = list(set(m3u8_urls))
-        
-        # ترتيب حسب الأولوية (master.m3u8 أولاً)
-        unique_urls.sort(key=lambda x: (
-            'master.m3u8' not in x.lower(),
-            'playlist.m3u8' not in x.lower(),
-            'index.m3u8' not in x.lower()
-        ))
-        
-        return unique_urls
+        scanner = M3U8Scanner()
+        scanner.feed(html_content)
+        scanner.close()
+        return sort_candidates(scanner.urls)
     
     def try_common_cdn_patterns(self, telegram_url):
         """محاولة الأنماط الشائعة لـ CDN تليجرام"""
@@ -105,13 +148,52 @@ class TelegramM3U8Extractor:
         
         return possible_urls
     
-    def extract_from_telegram(self, telegram_url, cookies_text):
+    @staticmethod
+    def _timeout(limit, deadline_at):
+        """مهلة الطلب: limit أو ما تبقى من المهلة الإجمالية أيهما أقل"""
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('انتهت المهلة الإجمالية')
+        return min(limit, remaining)
+    
+    def _fetch_page(self, telegram_url, deadline_at):
+        """الطريقة 1: روابط M3U8 المرشحة من صفحة البث"""
+        scanner = M3U8Scanner()
+        with self.session.get(telegram_url, stream=True, timeout=self._timeout(PAGE_TIMEOUT, deadline_at)) as response:
+            if response.status_code != 200:
+                return []
+            # مسح الصفحة أثناء تحميلها دون الاحتفاظ بها كاملة في الذاكرة
+            response.encoding = response.encoding or 'utf-8'
+            for chunk in response.iter_content(chunk_size=SCAN_CHUNK_SIZE, decode_unicode=True):
+                scanner.feed(chunk)
+        scanner.close()
+        return sort_candidates(scanner.urls)
+    
+    def _scan_web_api(self, deadline_at):
+        """الطريقة 2: عدد نقاط API الظاهرة في Telegram Web"""
+        response = self.session.get('https://web.telegram.org/k/', timeout=self._timeout(PAGE_TIMEOUT, deadline_at))
+        if response.status_code != 200:
+            return 0
+        return len(re.findall(r'/api/\w+', response.text))
+    
+    def _probe(self, url, limit, deadline_at, stop, statuses=(200,)):
+        """HEAD لرابط مرشح؛ يعيد الرابط إذا كان صالحاً"""
+        if stop.is_set():
+            return None
+        try:
+            response = self.session.head(url, timeout=self._timeout(limit, deadline_at))
+        except (requests.RequestException, TimeoutError):
+            return None
+        return url if response.status_code in statuses else None
+    
+    def extract_from_telegram(self, telegram_url, cookies_text, deadline=45):
         """
         استخراج رابط M3U8 من تليجرام
         
         Args:
             telegram_url: رابط البث في تليجرام
             cookies_text: نص الكوكيز
+            deadline: المهلة الإجمالية للاستخراج (ثوانٍ)
         
         Returns:
             dict: معلومات الاستخراج
@@ -134,61 +216,52 @@ class TelegramM3U8Extractor:
             result['error'] = f'فشل تحليل الكوكيز: {str(e)}'
             return result
         
-        # الطريقة 1: محاولة فتح الصفحة مباشرة
-        try:
-            result['tried_methods'].append('Method 1: Direct page fetch')
-            response = self.session.get(telegram_url, timeout=30)
-            
-            if response.status_code == 200:
-                m3u8_urls = self.extract_m3u8_from_html(response.text, telegram_url)
-                
-                if m3u8_urls:
-                    # التحقق من صلاحية أول رابط
-                    test_url = m3u8_urls[0]
-                    try:
-                        test_response = self.session.head(test_url, timeout=10)
-                        if test_response.status_code in [200, 302, 301]:
-                            result['success'] = True
-                            result['stream_url'] = test_url
-                            result['method'] = 'Direct HTML parsing'
-                            return result
-                    except:
-                        pass
-        except Exception as e:
-            result['tried_methods'].append(f'Method 1 failed: {str(e)}')
+        deadline_at = time.monotonic() + deadline
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tg-probe')
         
-        # الطريقة 2: محاولة API calls مباشرة
-        try:
-            result['tried_methods'].append('Method 2: Telegram Web API')
-            
-            # محاولة استدعاء Telegram Web API
-            api_url = 'https://web.telegram.org/k/'
-            response = self.session.get(api_url, timeout=30)
-            
-            if response.status_code == 200:
-                # البحث عن API endpoints في الكود
-                api_matches = re.findall(r'/api/\w+', response.text)
-                result['tried_methods'].append(f'Found {len(api_matches)} API endpoints')
-        except Exception as e:
-            result['tried_methods'].append(f'Method 2 failed: {str(e)}')
+        # الطرق الثلاث معاً: الصفحة، Web API، وفحص أنماط CDN الشائعة (أول 5 فقط)
+        result['tried_methods'].extend([
+            'Method 1: Direct page fetch', 'Method 2: Telegram Web API', 'Method 3: Common CDN patterns'
+        ])
+        pending = {
+            pool.submit(self._fetch_page, telegram_url, deadline_at): ('page', 'Method 1'),
+            pool.submit(self._scan_web_api, deadline_at): ('api', 'Method 2')
+        }
+        for url in self.try_common_cdn_patterns(telegram_url)[:5]:
+            future = pool.submit(self._probe, url, CDN_PROBE_TIMEOUT, deadline_at, stop)
+            pending[future] = ('probe', 'CDN pattern matching')
         
-        # الطريقة 3: محاولة الأنماط الشائعة
         try:
-            result['tried_methods'].append('Method 3: Common CDN patterns')
-            possible_urls = self.try_common_cdn_patterns(telegram_url)
-            
-            for url in possible_urls[:5]:  # جرب أول 5 فقط
-                try:
-                    test_response = self.session.head(url, timeout=5)
-                    if test_response.status_code == 200:
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    result['tried_methods'].append(f'Deadline of {deadline}s reached')
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, method = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        result['tried_methods'].append(f'{method} failed: {str(e)}')
+                        continue
+                    if kind == 'page':
+                        # فحص جميع الروابط المرشحة من الصفحة بالتوازي
+                        for url in value:
+                            future = pool.submit(self._probe, url, PROBE_TIMEOUT, deadline_at, stop, (200, 301, 302))
+                            pending[future] = ('probe', 'Direct HTML parsing')
+                    elif kind == 'api':
+                        result['tried_methods'].append(f'Found {value} API endpoints')
+                    elif value:
                         result['success'] = True
-                        result['stream_url'] = url
-                        result['method'] = 'CDN pattern matching'
+                        result['stream_url'] = value
+                        result['method'] = method
                         return result
-                except:
-                    continue
-        except Exception as e:
-            result['tried_methods'].append(f'Method 3 failed: {str(e)}')
+        finally:
+            # أول نتيجة فازت (أو انتهت المهلة): إلغاء ما لم يبدأ وإيقاف ما ينتظر دوره
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
         
         # إذا فشلت جميع الطرق
         result['error'] = 'فشل استخراج الرابط. استخدم الطريقة اليدوية (F12 → Network → m3u8)'
@@ -0,0 +1,38 @@
+"""web_app يُستورد مرة واحدة بمجلد بيانات مؤقت (مخزن وقفل مالك خاصان بالاختبارات)"""
+
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def web_app(tmp_path_factory):
+    os.environ.update({
+        'DATA_DIR': str(tmp_path_factory.mktemp('data')),
+        'CAPACITY_CALIBRATE': 'false',
+        'HLS_RELAY': 'false',
+    })
+    import web_app
+    return web_app
+
+
+@pytest.fixture
+def add_stream(web_app):
+    """إضافة سجل بث مباشرة إلى المخزن (دون تشغيله) وحذفه بعد الاختبار"""
+    added = []
+
+    def add(kind='telegram', **fields):
+        record = {
+            'id': uuid.uuid4().hex[:8],
+            'name': 'test',
+            'source_url': 'http://example.com/live/index.m3u8',
+            'status': 'stopped',
+            **fields
+        }
+        web_app.store.insert(kind, record)
+        added.append(record['id'])
+        return record
+
+    yield add
+    web_app.store.delete_many(added)
@@ -0,0 +1,66 @@
+"""العمليات الجماعية: اختيار البثوث والتحقق من الطلب"""
+
+import pytest
+
+
+@pytest.fixture
+def client(web_app):
+    return web_app.app.test_client()
+
+
+def selected(web_app, selector, among):
+    ids, missing = web_app.select_streams({'selector': selector})
+    assert missing == []
+    return {stream_id for stream_id in ids if stream_id in among}
+
+
+def test_selector_matches_kind_source_and_status(web_app, add_stream):
+    source = 'http://example.com/bulk/index.m3u8'
+    tg_running = add_stream('telegram', source_url=source, status='running')
+    tg_stopped = add_stream('telegram', source_url=source, status='stopped')
+    fb_running = add_stream('facebook', source_url=source, status='running')
+    page = add_stream('telegram', source_url='http://cdn/x.m3u8', page_url=source, status='running')
+    other = add_stream('telegram', source_url='http://example.com/other.m3u8', status='running')
+    among = {s['id'] for s in (tg_running, tg_stopped, fb_running, page, other)}
+
+    assert selected(web_app, {'source_url': source}, among) == {
+        tg_running['id'], tg_stopped['id'], fb_running['id'], page['id']
+    }
+    assert selected(web_app, {'kind': 'telegram', 'source_url': source, 'status': 'running'}, among) == {
+        tg_running['id'], page['id']
+    }
+    assert selected(web_app, {'kind': 'facebook', 'status': 'running'}, among) == {fb_running['id']}
+
+
+def test_ids_keep_order_and_report_missing(web_app, add_stream):
+    first, second = add_stream(), add_stream()
+    ids, missing = web_app.select_streams({'ids': [second['id'], 'nope', first['id'], second['id']]})
+    assert ids == [second['id'], first['id']]
+    assert missing == ['nope']
+
+
+@pytest.mark.parametrize('payload', [
+    {'action': 'stop', 'ids': 'abc'},
+    {'action': 'stop', 'ids': [1, 2]},
+    {'action': 'stop', 'selector': 'x'},
+    {'action': 'stop', 'selector': {'kind': 'youtube'}},
+    {'action': 'stop', 'selector': {'state': 'running'}},
+    {'action': 'stop', 'selector': {'status': ['running']}},
+    {'action': 'explode', 'ids': []},
+    {'action': 'stop'},
+    ['stop'],
+])
+def test_invalid_requests_are_rejected(client, payload):
+    response = client.post('/api/streams/bulk', json=payload)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_bulk_stop_reports_each_stream(client, web_app, add_stream):
+    stream = add_stream(status='running')
+    response = client.post('/api/streams/bulk?wait=10', json={'action': 'stop', 'ids': [stream['id'], 'nope']})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[stream['id']] == {'success': True}
+    assert results['nope']['success'] is False
+    assert web_app.store.get(stream['id'])['status'] == 'stopped'
@@ -0,0 +1,35 @@
+"""قبول البثوث على خادم صغير: كلفة تتجاوز السعة كلها لا تعني الرفض"""
+
+import pytest
+
+from stream_capacity import CapacityError, CapacityScheduler
+
+PRESETS = {'ultra': {'resolution': '1920x1080', 'fps': '30'}}
+
+
+def test_oversized_stream_admitted_on_idle_host():
+    capacity = CapacityScheduler(PRESETS, cores=1)
+    assert capacity.cost('ultra') > capacity.budget
+
+    assert capacity.admit('a', capacity.cost('ultra')) == 'admitted'
+
+
+def test_oversized_stream_waits_until_host_is_idle():
+    admitted = []
+    capacity = CapacityScheduler(PRESETS, cores=1, on_admit=admitted.append)
+    capacity.admit('a', 0.5)
+
+    assert capacity.admit('b', capacity.cost('ultra')) == 'queued'
+    capacity.release('a')
+
+    assert admitted == ['b']
+    assert capacity.snapshot()['active'] == {'b': capacity.cost('ultra')}
+
+
+def test_full_queue_rejects():
+    capacity = CapacityScheduler(PRESETS, cores=1, max_queued=1)
+    capacity.admit('a', 1.0)
+    capacity.admit('b', 1.0)
+
+    with pytest.raises(CapacityError):
+        capacity.admit('c', 1.0)
@@ -0,0 +1,89 @@
+"""نسخ YoutubeDL في ExtractEngine: لا تُغلق نسخة قيد الاستخدام، ومهلة عامل عالق لا تحجز المفتاح
+
+yt_dlp هنا وحدة مزيفة: extract_info تنتظر حدثاً قبل أن تعيد رابطاً.
+"""
+
+import threading
+import types
+
+import pytest
+
+from stream_extract import ExtractEngine, ExtractError
+
+COOKIES = '# Netscape HTTP Cookie File\n'
+
+
+class FakeYoutubeDL:
+    instances = []
+
+    def __init__(self, params):
+        self.cookiejar = types.SimpleNamespace(load=lambda fp: None)
+        self.release = threading.Event()
+        self.closed = False
+        self.calls = 0
+        FakeYoutubeDL.instances.append(self)
+
+    def extract_info(self, url, download=False):
+        self.calls += 1
+        self.release.wait(5)
+        return {'url': f'https://cdn.example.com/{url}/index.m3u8'}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def engine():
+    FakeYoutubeDL.instances = []
+    engine = ExtractEngine(max_instances=1, max_workers=4)
+    engine._yt_dlp = types.SimpleNamespace(
+        YoutubeDL=FakeYoutubeDL,
+        utils=types.SimpleNamespace(DownloadError=type('DownloadError', (Exception,), {})))
+    yield engine
+    for ydl in FakeYoutubeDL.instances:
+        ydl.release.set()
+    engine._executor.shutdown(wait=True)
+
+
+def test_eviction_defers_close_until_extraction_finishes(engine):
+    results = []
+    worker = threading.Thread(target=lambda: results.append(engine.extract('a', COOKIES, 'best')))
+    worker.start()
+    while not FakeYoutubeDL.instances or not FakeYoutubeDL.instances[0].calls:
+        threading.Event().wait(0.01)
+    busy = FakeYoutubeDL.instances[0]
+
+    # صيغة أخرى تتجاوز max_instances=1 فتُخرج النسخة المشغولة من الذاكرة
+    second = threading.Thread(target=lambda: engine.extract('b', COOKIES, 'worst'))
+    second.start()
+    while len(FakeYoutubeDL.instances) < 2:
+        threading.Event().wait(0.01)
+    assert not busy.closed
+
+    busy.release.set()
+    worker.join(5)
+    assert results[0]['stream_url'] == 'https://cdn.example.com/a/index.m3u8'
+    assert busy.closed
+    FakeYoutubeDL.instances[1].release.set()
+    second.join(5)
+
+
+def test_timed_out_worker_does_not_block_next_extraction(engine):
+    with pytest.raises(ExtractError):
+        engine.extract('a', COOKIES, timeout=0.2)
+    stuck = FakeYoutubeDL.instances[0]
+    assert not stuck.closed
+
+    def answer_fresh():
+        while len(FakeYoutubeDL.instances) < 2:
+            threading.Event().wait(0.01)
+        FakeYoutubeDL.instances[1].release.set()
+
+    threading.Thread(target=answer_fresh).start()
+    result = engine.extract('a', COOKIES, timeout=2)
+
+    assert result['format'] == 'M3U8 (HLS)'
+    assert FakeYoutubeDL.instances[1] is not stuck
+    stuck.release.set()
+    engine._executor.shutdown(wait=True)
+    assert stuck.closed
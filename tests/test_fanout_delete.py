@@ -0,0 +1,121 @@
+"""حذف بث في وضع الترميز المشترك يحرر وجهته من المُرمِّز وحجز السعة
+
+التوصيل هنا مثل web_app: مستمع حالات المشرف يفصل الوجهة ويحرر حجزها، وتوقف
+المُرمِّز يحرر حجز fanout:<مصدر>. أوامر sh بدل ffmpeg.
+"""
+
+import os
+import time
+
+from stream_capacity import COPY_COST, CapacityScheduler
+from stream_fanout import FanoutManager
+from stream_supervisor import StreamSupervisor
+
+ENCODER = ['sh', '-c', 'while :; do head -c 65424 /dev/zero; sleep 0.05; done']
+DESTINATION = ['sh', '-c', 'cat > /dev/null']
+KEY = 'http://example.com/live.m3u8'
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def make_pipeline():
+    supervisor = StreamSupervisor()
+    capacity = CapacityScheduler({}, cores=4)
+    exits = []
+
+    def on_exit(key, exit_code, stream_ids, logs):
+        exits.append(stream_ids)
+        capacity.release(f'fanout:{key}')
+
+    fanout = FanoutManager(on_exit=on_exit)
+
+    def on_state(stream_id, state):
+        if state['status'] in ('stopped', 'failed'):
+            fanout.detach(stream_id)
+            capacity.release(stream_id)
+
+    supervisor.add_listener(on_state)
+    return supervisor, capacity, fanout, exits
+
+
+def attach(supervisor, capacity, fanout, stream_id):
+    """يعيد pid عملية الوجهة"""
+    new_hub = not fanout.active(KEY)
+    read_fd = fanout.attach(stream_id, KEY, ENCODER)
+    if new_hub:
+        capacity.reserve(f'fanout:{KEY}', 1.0)
+    capacity.reserve(stream_id, COPY_COST)
+    try:
+        return supervisor.start(stream_id, DESTINATION, stdin=read_fd)
+    finally:
+        os.close(read_fd)
+
+
+def exited(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    return False
+
+
+def test_forget_releases_fanout_members_and_capacity():
+    supervisor, capacity, fanout, exits = make_pipeline()
+    pids = [attach(supervisor, capacity, fanout, stream_id) for stream_id in ('a', 'b')]
+    assert capacity.snapshot()['active'].keys() == {'a', 'b', f'fanout:{KEY}'}
+
+    supervisor.forget('a')
+    assert fanout.active(KEY)
+    supervisor.forget('b')
+
+    # المُرمِّز توقف بعد آخر وجهة ولم تبق وجهات مرتبطة به
+    assert not fanout.active(KEY)
+    assert wait_until(lambda: exits == [[]])
+    assert wait_until(lambda: all(exited(pid) for pid in pids))
+    assert wait_until(lambda: not capacity.snapshot()['active'])
+
+    # نفس المعرّفات تُضم من جديد إلى مُرمِّز جديد
+    attach(supervisor, capacity, fanout, 'a')
+    attach(supervisor, capacity, fanout, 'b')
+    assert fanout.active(KEY)
+    assert capacity.snapshot()['active'].keys() == {'a', 'b', f'fanout:{KEY}'}
+    supervisor.forget('a')
+    supervisor.forget('b')
+    assert wait_until(lambda: exits == [[], []])
+
+
+def test_forget_after_stop_and_restart_releases_everything():
+    supervisor, capacity, fanout, exits = make_pipeline()
+    attach(supervisor, capacity, fanout, 'a')
+    supervisor.stop('a')
+    assert wait_until(lambda: not capacity.snapshot()['active'])
+    assert wait_until(lambda: len(exits) == 1)
+
+    pid = attach(supervisor, capacity, fanout, 'a')
+    supervisor.forget('a')
+
+    assert wait_until(lambda: exits == [[], []])
+    assert wait_until(lambda: exited(pid))
+    assert wait_until(lambda: not capacity.snapshot()['active'])
+    attach(supervisor, capacity, fanout, 'a')
+    supervisor.forget('a')
+
+
+def test_forget_sends_final_state_once():
+    supervisor, _, _, _ = make_pipeline()
+    states = []
+    supervisor.add_listener(lambda stream_id, state: states.append(state['status']))
+    supervisor.start('a', DESTINATION)
+
+    supervisor.forget('a')
+    time.sleep(0.3)
+
+    assert states == ['starting', 'stopped']
+    assert supervisor.state('a') is None
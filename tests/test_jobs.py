@@ -0,0 +1,57 @@
+"""مهام الاستخراج بوضع single_flight: طلبان لنفس البث ينتظران مهمة واحدة"""
+
+import threading
+
+import pytest
+
+from stream_jobs import JobManager
+from stream_store import StreamStore
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    manager = JobManager(StreamStore(tmp_path / 'streams.db'), poll_interval=0.05)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def extract(stream_id, secret=None, **payload):
+        calls.append((stream_id, secret))
+        started.set()
+        release.wait(5)
+        return {'stream_url': f'https://cdn.example.com/{stream_id}.m3u8'}
+
+    manager.register('extract', extract)
+    manager.calls, manager.started, manager.release = calls, started, release
+    yield manager
+    release.set()
+
+
+def test_single_flight_shares_pending_and_running_job(jobs):
+    first = jobs.submit('extract', 'a', secret={'cookies': 'x'}, single_flight=True)
+    assert jobs.submit('extract', 'a', single_flight=True)['id'] == first['id']
+
+    jobs.start()
+    assert jobs.started.wait(5)
+    assert jobs.submit('extract', 'a', single_flight=True)['id'] == first['id']
+    # بث آخر يحصل على مهمته الخاصة
+    assert jobs.submit('extract', 'b', single_flight=True)['id'] != first['id']
+
+    jobs.release.set()
+    done = jobs.wait(first['id'], timeout=5)
+    assert done['status'] == 'succeeded'
+    assert done['result']['stream_url'] == 'https://cdn.example.com/a.m3u8'
+    assert 'secret' not in done['payload']
+    assert jobs.calls[0] == ('a', {'cookies': 'x'})
+
+
+def test_finished_job_is_not_reused(jobs):
+    jobs.release.set()
+    jobs.start()
+    first = jobs.submit('extract', 'a', single_flight=True)
+    assert jobs.wait(first['id'], timeout=5)['status'] == 'succeeded'
+
+    second = jobs.submit('extract', 'a', single_flight=True)
+    assert second['id'] != first['id']
+    assert jobs.wait(second['id'], timeout=5)['status'] == 'succeeded'
+    assert [stream_id for stream_id, _ in jobs.calls] == ['a', 'a']
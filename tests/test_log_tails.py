@@ -0,0 +1,53 @@
+"""حلقات السجلات: الأرقام من جدول الأحداث المشترك، والفجوات الحقيقية فقط"""
+
+from stream_events import LogTails
+
+
+def feed(tails, seq, line, replace=False, stream_id='a'):
+    tails.on_event('log', {'id': stream_id, 'line': line, 'replace': replace}, seq)
+
+
+def test_cursor_is_shared_event_seq():
+    # عمليتان تريان نفس الأحداث (مع أحداث بثوث أخرى بينها) تعيدان نفس الأرقام
+    workers = [LogTails(max_lines=10), LogTails(max_lines=10)]
+    for tails in workers:
+        feed(tails, 10, 'one')
+        feed(tails, 11, 'other', stream_id='b')
+        feed(tails, 12, 'two')
+    first = workers[0].read('a')
+    assert first['cursor'] == 12
+    assert workers[1].read('a', first['cursor'])['lines'] == []
+    assert workers[1].read('a', 10)['lines'] == ['two']
+
+
+def test_lagging_worker_keeps_client_cursor():
+    tails = LogTails(max_lines=10)
+    feed(tails, 10, 'one')
+    tail = tails.read('a', 15)
+    assert tail['lines'] == [] and tail['cursor'] == 15 and not tail['truncated']
+
+
+def test_replaced_lines_are_not_a_gap():
+    tails = LogTails(max_lines=3)
+    feed(tails, 1, 'start')
+    for seq in range(2, 20):
+        feed(tails, seq, f'frame={seq}', replace=seq > 2)
+    tail = tails.read('a', 5)
+    assert tail['lines'] == ['frame=19']
+    assert tail['replace_last'] and not tail['truncated']
+
+
+def test_evicted_lines_are_a_gap():
+    tails = LogTails(max_lines=3)
+    for seq in range(1, 6):
+        feed(tails, seq, f'line {seq}')
+    assert tails.read('a', 1)['truncated']
+    assert not tails.read('a', 2)['truncated']
+    assert tails.read('a', 2)['lines'] == ['line 3', 'line 4', 'line 5']
+
+
+def test_deleted_event_discards_tail():
+    tails = LogTails()
+    feed(tails, 1, 'line')
+    tails.on_event('deleted', {'id': 'a'})
+    assert tails.get('a') is None
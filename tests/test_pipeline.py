@@ -0,0 +1,23 @@
+"""أوامر ffmpeg المبنية من ملف تعريف البث"""
+
+from stream_pipeline import build_profile, encoder_args, ffmpeg_args
+
+SETTINGS = {'USE_GPU': 'off', 'LOGO_ENABLED': 'false'}
+PRESET = {'resolution': '1280x720', 'fps': '30', 'keyint': '2', 'bitrate': '2500k'}
+COPY = {'video': 'copy', 'audio': 'copy'}
+RECONNECT_OPTIONS = ('-multiple_requests', '-reconnect', '-reconnect_streamed', '-reconnect_at_eof')
+
+
+def test_hls_source_has_no_reconnect_options():
+    for source in ('https://example.com/live/index.m3u8?token=x', 'http://127.0.0.1:8080/hls/0123456789abcdef.m3u8'):
+        profile = build_profile(SETTINGS, source, PRESET, COPY)
+        for args in (ffmpeg_args(profile, 'rtmp://example.com/live/key'), encoder_args(profile)):
+            assert not set(RECONNECT_OPTIONS) & set(args)
+            assert args[args.index('-i') + 1] == source
+
+
+def test_http_ts_source_keeps_reconnect_options():
+    profile = build_profile(SETTINGS, 'http://example.com/live/1.ts', PRESET, COPY)
+    args = ffmpeg_args(profile, 'rtmp://example.com/live/key')
+    assert set(RECONNECT_OPTIONS) <= set(args)
+    assert args.index('-reconnect_at_eof') < args.index('-i')
@@ -0,0 +1,55 @@
+"""قائمة البثوث مع ETag (304 عند عدم التغيير) ودلتا ?since="""
+
+
+def fetch(client, **kwargs):
+    return client.get('/api/telegram/streams', **kwargs)
+
+
+def test_unchanged_list_returns_304(web_app, add_stream):
+    add_stream()
+    web_app.telegram_snapshot.refresh()
+    client = web_app.app.test_client()
+
+    first = fetch(client)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert fetch(client, headers={'If-None-Match': etag}).status_code == 304
+
+    add_stream()
+    web_app.telegram_snapshot.refresh()
+    changed = fetch(client, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_since_returns_only_changes(web_app, add_stream):
+    unchanged = add_stream()
+    web_app.telegram_snapshot.refresh()
+    client = web_app.app.test_client()
+    version = fetch(client).get_json()['version']
+
+    added = add_stream()
+    web_app.store.delete_many([unchanged['id']])
+    web_app.telegram_snapshot.refresh()
+
+    delta = fetch(client, query_string={'since': version}).get_json()
+    assert delta['full'] is False
+    assert delta['version'] > version
+    assert [stream['id'] for stream in delta['streams']] == [added['id']]
+    assert delta['removed'] == [unchanged['id']]
+
+    # الدلتا لها ETag خاص بها
+    response = fetch(client, query_string={'since': version})
+    assert fetch(client, query_string={'since': version},
+                 headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_since_outside_history_returns_full_list(web_app, add_stream):
+    add_stream()
+    web_app.telegram_snapshot.refresh()
+    client = web_app.app.test_client()
+    version = fetch(client).get_json()['version']
+
+    data = fetch(client, query_string={'since': version + 1000}).get_json()
+    assert data['full'] is True
+    assert data['version'] == version
@@ -0,0 +1,78 @@
+"""إعادة التشغيل بتأخير أُسّي عشوائي وإعلان الفشل بعد max_restarts"""
+
+import threading
+import time
+
+import stream_watchdog
+from stream_watchdog import StreamWatchdog
+
+RUNNING = {'status': 'running'}
+
+
+class Recorder:
+    def __init__(self):
+        self.restarts = []
+        self.failed = threading.Event()
+        self.failures = []
+        self.restarted = []
+
+    def restart(self, stream_id):
+        self.restarted.append(stream_id)
+        raise RuntimeError('المصدر لا يستجيب')
+
+    def on_restart(self, stream_id, reason, delay, count):
+        self.restarts.append((delay, count))
+
+    def on_failed(self, stream_id, reason, count):
+        self.failures.append(count)
+        self.failed.set()
+
+
+def make_watchdog(recorder, **options):
+    return StreamWatchdog(None, recorder.restart, on_restart=recorder.on_restart,
+                          on_failed=recorder.on_failed, interval=0.01, **options)
+
+
+def test_delay_is_jittered_within_half_to_full_backoff():
+    for _ in range(20):
+        recorder = Recorder()
+        watchdog = make_watchdog(recorder, backoff_base=2)
+        watchdog.on_state('a', RUNNING)
+        watchdog.report('a', 'توقف المخرج')
+        # بلاغ ثانٍ أثناء انتظار إعادة التشغيل لا يجدول أخرى
+        watchdog.report('a', 'توقف المخرج')
+        [(delay, count)] = recorder.restarts
+        assert 1 <= delay <= 2
+        assert count == 1
+
+
+def test_backoff_doubles_up_to_max_then_gives_up(monkeypatch):
+    monkeypatch.setattr(stream_watchdog.random, 'uniform', lambda low, high: high)
+    recorder = Recorder()
+    watchdog = make_watchdog(recorder, backoff_base=0.1, backoff_max=0.4, max_restarts=4)
+    watchdog.on_state('a', RUNNING)
+    watchdog.start()
+
+    watchdog.report('a', 'توقف المخرج')
+
+    assert recorder.failed.wait(5)
+    assert recorder.restarts == [(0.1, 1), (0.2, 2), (0.4, 3), (0.4, 4)]
+    assert recorder.restarted == ['a'] * 4
+    assert recorder.failures == [4]
+    # بعد الاستسلام لا تُجدول إعادة تشغيل جديدة
+    watchdog.report('a', 'توقف المخرج')
+    assert len(recorder.restarts) == 4
+
+
+def test_forget_cancels_scheduled_restart():
+    recorder = Recorder()
+    watchdog = make_watchdog(recorder, backoff_base=0.2)
+    watchdog.on_state('a', RUNNING)
+    watchdog.start()
+
+    watchdog.report('a', 'توقف المخرج')
+    watchdog.forget('a')
+    time.sleep(0.4)
+
+    assert recorder.restarted == []
+    assert not recorder.failed.is_set()
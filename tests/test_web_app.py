@@ -0,0 +1,40 @@
+"""سلوك web_app على مخزن مؤقت (بدون تشغيل ffmpeg)"""
+
+import os
+
+
+def test_streams_with_different_encoder_settings_do_not_share_a_hub(web_app, add_stream):
+    low = add_stream(quality='low', fanout=True)
+    high = add_stream(quality='high', fanout=True)
+    low_again = add_stream(quality='low', fanout=True)
+    logo = add_stream(quality='low', logo=True, fanout=True)
+    aac = add_stream(quality='low', audio_mode='aac', fanout=True)
+
+    key = web_app.fanout_key('telegram', low)
+    assert web_app.fanout_key('telegram', low_again) == key
+    for other in (high, logo, aac):
+        assert web_app.fanout_key('telegram', other) != key
+
+    # مُرمِّز يعمل لإعداد low لا يُعد مُرمِّزاً لإعداد high
+    read_fd = web_app.fanout.attach(low['id'], key, ['sh', '-c', 'sleep 5'])
+    try:
+        assert web_app.fanout.active(key)
+        assert not web_app.fanout.active(web_app.fanout_key('telegram', high))
+    finally:
+        os.close(read_fd)
+        web_app.fanout.detach(low['id'])
+
+
+def test_shared_encoder_uses_the_attaching_streams_settings(web_app, add_stream):
+    encode = {'video': 'encode', 'audio': 'aac'}
+    facebook = add_stream('facebook', fanout=True, backup_sources=['http://example.com/backup.ts'])
+    telegram = add_stream('telegram', fanout=True)
+
+    for kind, stream in (('facebook', facebook), ('telegram', telegram)):
+        preset = web_app.capacity.presets[web_app.stream_preset(kind, stream)]
+        encoders = web_app.fanout_encoders(stream, web_app.stream_profile(kind, stream, encode))
+        assert len(encoders) == 1 + len(stream.get('backup_sources', []))
+        for args in encoders:
+            assert args[args.index('-b:v') + 1] == preset['bitrate']
+            assert args[args.index('-c:a') + 1] == 'aac'
+    assert web_app.stream_preset('facebook', facebook) != web_app.stream_preset('telegram', telegram)
@@ -1,61 +1,390 @@
-
 #!/usr/bin/env python3
-from flask import Flask, render_template, jsonify, request
-import subprocess
+from flask import Flask, Response, render_template, jsonify, request
 import os
 import json
+import signal
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from stream_capacity import COPY_COST, CapacityScheduler, load_presets, quality_mode
+from stream_events import EventBus, EventRelay, LogTails
+from stream_extract import ExtractEngine, ExtractionCache, extraction_key, url_expiry
+from stream_fanout import FanoutManager
+from stream_jobs import JobManager
+from stream_logfiles import LogWriter
+from stream_owner import OwnerElection
+from stream_pipeline import AUDIO_MODES, build_profile, encoder_args, ffmpeg_args, load_settings
+from stream_probe import choose_codecs, select_variant
+from stream_relay import HlsRelay, is_hls
+from stream_snapshot import StatusSnapshot
+from stream_store import StreamStore
+from stream_metrics import prometheus_text
+from stream_supervisor import PROGRESS_TARGET, StreamSupervisor, owns_process
+from stream_watchdog import StreamWatchdog
 
 app = Flask(__name__)
 
 BASE_DIR = Path(__file__).resolve().parent
 SCRIPTS_DIR = BASE_DIR / "scripts"
-LOGS_DIR = BASE_DIR / "logs"
-STREAMS_FILE = BASE_DIR / "streams.json"
+# مجلد البيانات (المخزن، قفل المالك، السجلات، ملفات JSON القديمة)؛ مجلد التطبيق افتراضياً
+DATA_DIR = Path(os.environ.get('DATA_DIR', BASE_DIR))
+LOGS_DIR = DATA_DIR / "logs"
+STREAMS_FILE = DATA_DIR / "streams.json"
+STORE_FILE = DATA_DIR / "streams.db"
+OWNER_LOCK_FILE = DATA_DIR / "controller.lock"
 
-def load_streams():
-    """تحميل قائمة البثوث من الملف"""
-    if STREAMS_FILE.exists():
-        try:
-            with open(STREAMS_FILE, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, ValueError):
-            # إذا كان الملف تالف، نرجع قائمة فارغة
-            return []
-    return []
-
-def save_streams(streams):
-    """حفظ قائمة البثوث"""
+# المصدر الافتراضي عند ترك الحقل فارغاً (نفس SOURCE في config.sh)
+DEFAULT_SOURCE_URL = 'http://soft24f.net/live/6872c3410e8cibopro/22bcpapc/237014.ts'
+FACEBOOK_RTMP_SERVER = 'rtmps://live-api-s.facebook.com:443/rtmp/'
+
+# سعة الخادم: نسبة الأنوية المتاحة للترميز وحجم طابور الانتظار
+CAPACITY_CORES = int(os.environ.get('CAPACITY_CORES', '0')) or None
+CAPACITY_TARGET = float(os.environ.get('CAPACITY_TARGET', '0.8'))
+CAPACITY_MAX_QUEUED = int(os.environ.get('CAPACITY_MAX_QUEUED', '10'))
+CAPACITY_CALIBRATE = os.environ.get('CAPACITY_CALIBRATE', 'true') == 'true'
+# عدد أسطر السجل المحفوظة في الذاكرة لكل بث
+LOG_TAIL_LINES = int(os.environ.get('LOG_TAIL_LINES', '500'))
+
+# ملفات السجل على القرص: حجم/عمر المقطع قبل تدويره، والحد الإجمالي لجميع البثوث
+LOG_SEGMENT_MB = float(os.environ.get('LOG_SEGMENT_MB', '10'))
+LOG_SEGMENT_HOURS = float(os.environ.get('LOG_SEGMENT_HOURS', '6'))
+LOG_DISK_BUDGET_MB = float(os.environ.get('LOG_DISK_BUDGET_MB', '200'))
+LOG_STATS_INTERVAL = float(os.environ.get('LOG_STATS_INTERVAL', '10'))
+
+# دورية نشر مقاييس -progress من المالك إلى المخزن (ثوانٍ)
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', '2'))
+
+# صلاحية نتيجة الاستخراج عندما لا يحمل الرابط وقت انتهاء التوكن، وعدد النتائج المحفوظة
+EXTRACT_CACHE_TTL = int(os.environ.get('EXTRACT_CACHE_TTL', '600'))
+EXTRACT_CACHE_MAX_ENTRIES = int(os.environ.get('EXTRACT_CACHE_MAX_ENTRIES', '200'))
+# عدد عمليات الاستخراج المتزامنة لدى المالك
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', '2'))
+# صيغة yt-dlp ومهلة الاستخراج لكل منصة
+EXTRACT_OPTIONS = {
+    'facebook': {'fmt': None, 'timeout': 30},
+    'telegram': {'fmt': 'best', 'timeout': 45}
+}
+
+# البثوث المنشأة من رابط مستخرج يُعاد استخراج مصدرها قبل انتهاء توكنه بهذه المدة (ثوانٍ)
+SOURCE_REFRESH_LEAD = int(os.environ.get('SOURCE_REFRESH_LEAD', '600'))
+SOURCE_REFRESH_CHECK = int(os.environ.get('SOURCE_REFRESH_CHECK', '30'))
+
+# بثوث لها مصادر احتياطية: مدة توقف مخرجات مُرمِّز المصدر قبل الانتقال للتالي،
+# ومدة البقاء على مصدر احتياطي قبل تجربة العودة إلى الأساسي (ثوانٍ)
+SOURCE_STALL_SECONDS = float(os.environ.get('SOURCE_STALL_SECONDS', '10'))
+SOURCE_FAILBACK_SECONDS = float(os.environ.get('SOURCE_FAILBACK_SECONDS', '300'))
+# مُرحِّل HLS المحلي: كل مصدر m3u8 يُسحب من الأصل مرة واحدة لجميع البثوث والفحوص
+HLS_RELAY = os.environ.get('HLS_RELAY', 'true') == 'true'
+HLS_RELAY_PORT = int(os.environ.get('HLS_RELAY_PORT', '0'))
+HLS_RELAY_CACHE_MB = float(os.environ.get('HLS_RELAY_CACHE_MB', '128'))
+# مراقب صحة البثوث: مدة توقف المُخرج، والسرعة الدنيا المتصلة، وعدد أخطاء كتابة RTMP
+# (خلال 30 ثانية) قبل إعادة التشغيل؛ وعدد إعادات التشغيل خلال النافذة قبل إعلان الفشل
+WATCHDOG_STALL_SECONDS = float(os.environ.get('WATCHDOG_STALL_SECONDS', '30'))
+WATCHDOG_MIN_SPEED = float(os.environ.get('WATCHDOG_MIN_SPEED', '0.9'))
+WATCHDOG_SLOW_SECONDS = float(os.environ.get('WATCHDOG_SLOW_SECONDS', '60'))
+WATCHDOG_WRITE_ERRORS = int(os.environ.get('WATCHDOG_WRITE_ERRORS', '5'))
+WATCHDOG_MAX_RESTARTS = int(os.environ.get('WATCHDOG_MAX_RESTARTS', '5'))
+WATCHDOG_RESTART_WINDOW = float(os.environ.get('WATCHDOG_RESTART_WINDOW', '600'))
+WATCHDOG_BACKOFF_MAX = float(os.environ.get('WATCHDOG_BACKOFF_MAX', '120'))
+
+# بثوث تليجرام تُرمَّز بإعدادات قريبة من MEDIUM (3000k)
+TELEGRAM_PRESET = 'medium'
+
+# العمليات الجماعية: عدد البثوث التي تُنفَّذ عليها العملية في الوقت نفسه
+BULK_WORKERS = int(os.environ.get('BULK_WORKERS', '8'))
+BULK_ACTIONS = ('start', 'stop', 'restart', 'delete')
+
+# المهلة القصوى لظهور أول إطارات مُخرجة من ffmpeg قبل اعتبار التشغيل فاشلاً
+STREAM_READY_TIMEOUT = int(os.environ.get('STREAM_READY_TIMEOUT', '30'))
+
+# مشرف العمليات يملك جميع عمليات ffmpeg؛ يعمل فقط في العملية المالكة (انظر election)
+supervisor = StreamSupervisor()
+# قناة الدفع (SSE) للوحات التحكم في هذه العملية
+events = EventBus()
+# مخزن البثوث (SQLite/WAL) المشترك بين جميع عمليات gunicorn
+store = StreamStore(STORE_FILE, on_change=lambda kind: snapshots[kind].wake())
+# الأحداث المشتركة (state/log/job) تمر عبر المخزن لتصل إلى مشتركي كل العمليات
+relay = EventRelay(store, events)
+# بثوث وضع الترميز المشترك: مُرمِّز واحد لكل مصدر ووجهة خفيفة (-c copy) لكل بث
+fanout = FanoutManager(
+    on_exit=lambda *args: on_fanout_exit(*args),
+    on_switch=lambda *args: on_fanout_switch(*args),
+    stall_timeout=SOURCE_STALL_SECONDS,
+    failback_interval=SOURCE_FAILBACK_SECONDS
+)
+# قبول البثوث حسب كلفة إعداد الجودة والأنوية المتبقية (لدى المالك)، وحالته منشورة في المخزن
+capacity = CapacityScheduler(
+    load_presets(SCRIPTS_DIR / 'config.sh'),
+    cores=CAPACITY_CORES,
+    target=CAPACITY_TARGET,
+    max_queued=CAPACITY_MAX_QUEUED,
+    on_admit=lambda stream_id: jobs.submit('start', stream_id, admitted=True),
+    on_change=lambda snapshot: store.set_meta('capacity', snapshot)
+)
+# آخر أسطر سجلات كل بث، متاحة في أي عملية
+log_tails = LogTails(max_lines=LOG_TAIL_LINES)
+events.add_listener(log_tails.on_event)
+# ملفات سجل مدوّرة ومضغوطة يكتبها المالك على دفعات
+log_files = LogWriter(
+    LOGS_DIR,
+    max_bytes=int(LOG_SEGMENT_MB * 1024 * 1024),
+    max_age=LOG_SEGMENT_HOURS * 3600,
+    budget_bytes=int(LOG_DISK_BUDGET_MB * 1024 * 1024),
+    stats_interval=LOG_STATS_INTERVAL
+)
+# نتائج استخراج الروابط حسب (الصفحة، الكوكيز) حتى قبيل انتهاء توكن الرابط
+extract_cache = ExtractionCache(store, ttl=EXTRACT_CACHE_TTL, max_entries=EXTRACT_CACHE_MAX_ENTRIES)
+# yt_dlp داخل العملية مع مستخرجات دافئة وكوكيز في الذاكرة (يُسخَّن لدى المالك فقط)
+extractor = ExtractEngine()
+# التشغيل والإيقاف يتمّان في الخلفية لدى المالك ويعيدان معرف مهمة فوراً
+jobs = JobManager(
+    store, on_change=lambda job: relay.emit('job', job), actions=('start', 'resume', 'stop', 'delete', 'bulk')
+)
+# الاستخراج (حتى 45 ثانية) في مجمّع منفصل حتى لا يؤخر تشغيل البثوث وإيقافها
+extract_jobs = JobManager(
+    store, max_workers=EXTRACT_WORKERS, on_change=lambda job: relay.emit('job', job), actions=('extract',)
+)
+# قوائم ومقاطع HLS من الأصل مرة واحدة، مع ذاكرة LRU للمقاطع الحديثة (لدى المالك فقط)
+hls_relay = HlsRelay(port=HLS_RELAY_PORT, max_bytes=int(HLS_RELAY_CACHE_MB * 1024 * 1024))
+# إعادة تشغيل البثوث العالقة أو البطيئة أو المنهارة بتأخير أُسّي (لدى المالك)
+watchdog = StreamWatchdog(
+    supervisor,
+    restart=lambda stream_id: restart_stream(stream_id),
+    on_restart=lambda *args: on_watchdog_restart(*args),
+    on_failed=lambda *args: on_watchdog_failed(*args),
+    stall_seconds=WATCHDOG_STALL_SECONDS,
+    min_speed=WATCHDOG_MIN_SPEED,
+    slow_seconds=WATCHDOG_SLOW_SECONDS,
+    write_errors=WATCHDOG_WRITE_ERRORS,
+    backoff_max=WATCHDOG_BACKOFF_MAX,
+    max_restarts=WATCHDOG_MAX_RESTARTS,
+    restart_window=WATCHDOG_RESTART_WINDOW
+)
+
+def snapshot_response(snapshot):
+    """تقديم لقطة الحالات مع ETag (304 إذا لم يتغير شيء) ودلتا ?since="""
+    since = request.args.get('since', type=int)
+    if request.if_none_match.contains(snapshot.etag(snapshot.version, since)):
+        response = app.response_class(status=304)
+        response.set_etag(snapshot.etag(snapshot.version, since))
+    else:
+        data = snapshot.payload(since)
+        response = jsonify(data)
+        response.set_etag(snapshot.etag(data['version'], since))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def stream_source(stream):
+    """مصدر البث الفعلي ('default' تعني المصدر الافتراضي)"""
+    source_url = stream.get('source_url')
+    if not source_url or source_url == 'default':
+        return DEFAULT_SOURCE_URL
+    return source_url
+
+def stream_preset(kind, stream=None):
+    """إعداد الجودة الذي يُرمَّز به البث: إعداده الخاص إن وُجد، وإلا إعداد نوعه"""
+    if stream and stream.get('quality') in capacity.presets:
+        return stream['quality']
+    if kind == 'telegram':
+        return TELEGRAM_PRESET
+    return quality_mode(SCRIPTS_DIR / 'config.sh')
+
+def stream_profile(kind, stream, codecs, source_url=None):
+    """ملف تعريف خط ffmpeg للبث (المصدر، إعداد الجودة، الشعار، وضع الصوت)"""
+    return build_profile(
+        load_settings(SCRIPTS_DIR / 'config.sh'),
+        source_url or stream_source(stream),
+        capacity.presets.get(stream_preset(kind, stream)),
+        codecs,
+        logo=stream.get('logo'),
+        audio_mode=stream.get('audio_mode', 'auto')
+    )
+
+def destination_url(kind, stream):
+    """رابط RTMP الكامل للبث"""
+    stream_key = store.get_secret(stream['id']).get('stream_key')
+    if not stream_key:
+        raise RuntimeError('مفتاح البث غير محفوظ')
+    if kind == 'telegram':
+        return stream_key
+    return FACEBOOK_RTMP_SERVER + stream_key
+
+def fanout_destination_args(rtmp_url):
+    """وجهة التوزيع: إعادة تغليف فقط بدون أي ترميز"""
+    return [
+        'ffmpeg', '-hide_banner', '-f', 'mpegts', '-i', 'pipe:0',
+        '-c', 'copy', '-progress', PROGRESS_TARGET, '-f', 'flv', rtmp_url
+    ]
+
+def fanout_key(kind, stream):
+    """مفتاح المُرمِّز المشترك: صفحة المصدر للروابط المستخرجة (يبقى ثابتاً عند تجديد الرابط)
+    متبوعة بالمصادر الاحتياطية بترتيبها، ثم إعدادات الترميز (الجودة والشعار والصوت)
+    حتى لا ينضم بث إلى مُرمِّز يعمل بإعدادات بث آخر"""
+    source = ' | '.join([stream.get('page_url') or stream_source(stream), *stream.get('backup_sources', [])])
+    logo = stream.get('logo')
+    logo = 'config' if logo is None else ('logo' if logo else 'nologo')
+    return f"{source} @ {stream_preset(kind, stream)}/{logo}/{stream.get('audio_mode', 'auto')}"
+
+def uses_fanout(stream):
+    """البثوث من روابط مستخرجة أو ذات مصادر احتياطية تمر دائماً بالمُرمِّز المشترك
+    حتى يمكن تبديل مصدرها دون قطع اتصال RTMP"""
+    return bool(stream.get('fanout') or stream.get('page_url') or stream.get('backup_sources'))
+
+def fanout_encoders(stream, profile):
+    """أوامر المُرمِّز المشترك من ملف تعريف البث نفسه (جودته وشعاره وصوته، لا إعدادات
+    نوع آخر): المصدر الأساسي ثم الاحتياطية بالترتيب"""
+    # المصادر الاحتياطية لم تُفحص: تُرمَّز دائماً حتى لا يصل ترميز غير متوافق إلى المنصة
+    return [encoder_args(profile)] + [
+        encoder_args(dict(profile, source=hls_relay.local_url(url), video='encode', audio='aac'))
+        for url in stream.get('backup_sources', [])
+    ]
+
+def start_fanout_destination(kind, stream, profile, encoder_cost):
+    """ضم البث إلى مُرمِّز مصدره (يبدأ المُرمِّز مع أول وجهة)"""
+    rtmp_url = destination_url(kind, stream)
+    key = fanout_key(kind, stream)
+    new_hub = not fanout.active(key)
+    args, *backups = fanout_encoders(stream, profile)
+    read_fd = fanout.attach(stream['id'], key, args, backups)
+    if new_hub:
+        # كلفة المُرمِّز المشترك تُحجز باسمه وتبقى حتى يتوقف، والوجهة تحجز كلفة النسخ فقط
+        capacity.reserve(f'fanout:{key}', encoder_cost)
+        capacity.reserve(stream['id'], COPY_COST)
     try:
-        with open(STREAMS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(streams if streams else [], f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"خطأ في حفظ البثوث: {e}")
+        supervisor.start(stream['id'], fanout_destination_args(rtmp_url), stdin=read_fd, progress=True)
+    except Exception:
+        fanout.detach(stream['id'])
+        raise
+    finally:
+        os.close(read_fd)
+
+def start_stream_job(stream_id, admitted=False, restart=False):
+    """مهمة خلفية: قبول البث حسب السعة، ثم تشغيل ffmpeg وانتظار أول إطارات مُخرجة
 
-def get_stream_status(session_name):
-    """التحقق من حالة بث معين"""
+    أي فشل (الاستخراج، فحص المصدر، الوجهة، تشغيل ffmpeg) يُظهر البث فاشلاً بدل أن
+    يبقى "starting" ويُستأنف عند كل انتخاب. restart=True (من المراقب): الفشل في
+    انتظار أول إطارات يُبقي البث في القائمة حتى تُعاد المحاولة.
+    """
     try:
-        result = subprocess.run(
-            ['tmux', 'has-session', '-t', session_name],
-            capture_output=True,
-            text=True
-        )
-        return result.returncode == 0
-    except:
-        return False
+        return launch_stream(stream_id, admitted, restart)
+    except Exception:
+        # بث يعمل بالفعل (تشغيل مكرر) يبقى كما هو
+        if supervisor.status(stream_id) not in ('starting', 'running'):
+            capacity.release(stream_id)
+            if store.update(stream_id, status='failed', pid=None):
+                relay.emit('state', {'id': stream_id, 'status': 'failed', 'exit_code': None})
+        raise
 
-def update_streams_status():
-    """تحديث حالة جميع البثوث"""
-    streams = load_streams()
-    for stream in streams:
-        stream['status'] = 'running' if get_stream_status(stream['session_name']) else 'stopped'
-    save_streams(streams)
-    return streams
+def launch_stream(stream_id, admitted, restart):
+    kind = store.kind_of(stream_id)
+    stream = store.get(stream_id, kind)
+    if not stream:
+        raise RuntimeError('البث غير موجود')
+    if stream.get('page_url') and not fanout.active(fanout_key(kind, stream)):
+        stream = ensure_fresh_source(kind, stream)
+
+    # قائمة HLS رئيسية: الجودة الأقرب لإعداد البث (الرابط المحفوظ يبقى الرئيسي)،
+    # والفحص والتشغيل يقرآن عبر المُرحِّل المحلي
+    source_url, variant = select_variant(
+        hls_relay.local_url(stream_source(stream)), capacity.presets.get(stream_preset(kind, stream))
+    )
+    if source_url != stream_source(stream):
+        stream = dict(stream, source_url=source_url)
+
+    # فحص المصدر: نسخ مباشر للمسارات المتوافقة بدل إعادة ترميزها
+    codecs = choose_codecs(source_url)
+    profile = stream_profile(kind, stream, codecs)
+    store.update(stream_id, codecs={'video': profile['video'], 'audio': profile['audio']}, variant=variant)
+    encoder_cost = capacity.cost(
+        stream_preset(kind, stream), copy=profile['video'] == 'copy' and not stream.get('backup_sources')
+    )
+    if uses_fanout(stream):
+        cost = COPY_COST if fanout.active(fanout_key(kind, stream)) else COPY_COST + encoder_cost
+    else:
+        cost = encoder_cost
+
+    if not admitted:
+        # الطابور ممتلئ (CapacityError): البث يبقى محفوظاً فاشلاً ويمكن تشغيله لاحقاً
+        decision = capacity.admit(stream_id, cost)
+        if decision == 'queued':
+            store.update(stream_id, status='queued')
+            relay.emit('state', {'id': stream_id, 'status': 'queued', 'exit_code': None})
+            return {'stream_id': stream_id, 'queued': True}
+
+    if uses_fanout(stream):
+        start_fanout_destination(kind, stream, profile, encoder_cost)
+    else:
+        args = ffmpeg_args(profile, destination_url(kind, stream), progress=PROGRESS_TARGET)
+        supervisor.start(stream_id, args, progress=True)
+    if supervisor.wait_ready(stream_id, STREAM_READY_TIMEOUT):
+        return {'stream_id': stream_id}
+
+    # حذف البث في حالة الفشل
+    logs = supervisor.logs(stream_id) or []
+    supervisor.stop(stream_id, failed=True)
+    supervisor.forget(stream_id)
+    fanout.detach(stream_id)
+    capacity.release(stream_id)
+    if not restart:
+        store.delete(stream_id)
+    reason = next((line for line in reversed(logs) if line.strip()), '')
+    raise RuntimeError(f'فشل بدء البث: {reason}' if reason else 'فشل بدء البث')
+
+def stop_stream(stream_id):
+    """إيقاف ffmpeg وإلغاء أي إعادة تشغيل مجدولة"""
+    watchdog.forget(stream_id)
+    supervisor.stop(stream_id)
+    # بث في الطابور لم يبدأ بعد: يكفي إخراجه من الطابور
+    capacity.release(stream_id)
+
+def forget_stream(stream_id):
+    """إيقاف ffmpeg وحذف حالته وسجلاته من المشرف
+
+    حالة stopped الأخيرة تمر بـ on_stream_state_change التي تفصل الوجهة عن المُرمِّز
+    المشترك وتحرر السعة وتغلق ملف السجل.
+    """
+    watchdog.forget(stream_id)
+    supervisor.forget(stream_id)
+    capacity.release(stream_id)
+    # كل عملية تحرر حلقة سجلات البث في الذاكرة
+    relay.emit('deleted', {'id': stream_id})
+
+def stop_stream_job(stream_id):
+    """مهمة خلفية: إيقاف ffmpeg وتحديث الحالة"""
+    stop_stream(stream_id)
+    store.update(stream_id, status='stopped', pid=None)
+    return {'stream_id': stream_id}
+
+def delete_stream_job(stream_id):
+    """مهمة خلفية: إيقاف ffmpeg بعد حذف البث من القائمة"""
+    forget_stream(stream_id)
+    return {'stream_id': stream_id}
+
+def resume_stream_job(stream_id):
+    """مهمة خلفية: استئناف بث كان يعمل لدى المالك السابق؛ الفشل يُظهره فاشلاً بدل حذفه"""
+    return start_stream_job(stream_id, restart=True)
+
+jobs.register('start', start_stream_job)
+jobs.register('resume', resume_stream_job)
+jobs.register('stop', stop_stream_job)
+jobs.register('delete', delete_stream_job)
+
+def stream_logs_response(stream):
+    """سجلات البث من حلقة الذاكرة؛ ?cursor=<رقم> يعيد الأسطر الجديدة فقط"""
+    cursor = request.args.get('cursor', 0, type=int)
+    tail = log_tails.read(stream['id'], max(cursor, 0))
+    if not tail['lines'] and not cursor:
+        tail['lines'] = ['لا توجد سجلات متاحة']
+    return jsonify({
+        'logs': tail['lines'],
+        'cursor': tail['cursor'],
+        'replace_last': tail['replace_last'],
+        'truncated': tail['truncated']
+    })
 
 @app.route('/')
 def main_index():
@@ -75,8 +404,102 @@ def telegram_index():
 @app.route('/api/streams')
 def api_streams():
     """الحصول على قائمة جميع البثوث"""
-    streams = update_streams_status()
-    return jsonify({'streams': streams})
+    return snapshot_response(facebook_snapshot)
+
+@app.route('/api/events')
+def api_events():
+    """قناة Server-Sent Events: تغيّر الحالات، إصدارات اللقطات، وسجلات بث محدد (?logs=<id>)"""
+    log_stream = request.args.get('logs')
+
+    def accept(event):
+        if event['type'] == 'log':
+            return event['data']['id'] == log_stream
+        return True
+
+    return Response(
+        events.stream(accept),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """حالة مهمة خلفية؛ ?wait=<ثوانٍ> لانتظار انتهائها"""
+    wait = min(request.args.get('wait', 0, type=float), 60)
+    job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'المهمة غير موجودة'}), 404
+    return jsonify({'job': job})
+
+@app.route('/api/capacity')
+def api_capacity():
+    """سعة الخادم: الأنوية المحجوزة والمتبقية، كلفة كل إعداد جودة، والطابور"""
+    return jsonify(store.get_meta('capacity') or capacity.snapshot())
+
+@app.route('/api/stream/metrics/<stream_id>')
+def api_stream_metrics(stream_id):
+    """مقاييس المُرمِّز لبث (فيسبوك أو تليجرام) من قناة ffmpeg -progress"""
+    if not store.kind_of(stream_id):
+        return jsonify({'error': 'البث غير موجود'}), 404
+    published = store.get_meta('metrics') or {}
+    return jsonify({
+        'stream_id': stream_id,
+        'metrics': published.get('streams', {}).get(stream_id),
+        'published_at': published.get('published_at')
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """المقاييس نفسها بصيغة Prometheus"""
+    published = (store.get_meta('metrics') or {}).get('streams', {})
+    streams = {}
+    for kind in ('facebook', 'telegram'):
+        for stream in store.list(kind):
+            if stream['id'] in published:
+                streams[stream['id']] = {
+                    'labels': {'kind': kind, 'name': stream.get('name', '')},
+                    'metrics': published[stream['id']]
+                }
+    return Response(prometheus_text(streams), mimetype='text/plain; version=0.0.4')
+
+def capacity_full():
+    """رفض فوري قبل إنشاء البث إذا لم تبق سعة ولا مكان في الطابور"""
+    snapshot = store.get_meta('capacity')
+    return bool(snapshot) and snapshot['free'] <= 0 and len(snapshot['queued']) >= snapshot['max_queued']
+
+def backup_sources(data):
+    """المصادر الاحتياطية بالترتيب: قائمة أو نص برابط في كل سطر"""
+    urls = data.get('backup_urls') or []
+    if isinstance(urls, str):
+        urls = urls.splitlines()
+    return [url.strip() for url in urls if url.strip()]
+
+def pipeline_options(data):
+    """خيارات خط ffmpeg الخاصة بالبث؛ الغائب منها يتبع config.sh وإعداد النوع"""
+    options = {}
+    quality = (data.get('quality') or '').strip().lower()
+    if quality:
+        if quality not in capacity.presets:
+            raise ValueError(f'إعداد جودة غير معروف: {quality}')
+        options['quality'] = quality
+    if data.get('logo') is not None:
+        options['logo'] = bool(data['logo'])
+    audio_mode = data.get('audio_mode') or 'auto'
+    if audio_mode not in AUDIO_MODES:
+        raise ValueError(f"وضع الصوت يجب أن يكون إحدى: {', '.join(AUDIO_MODES)}")
+    if audio_mode != 'auto':
+        options['audio_mode'] = audio_mode
+    return options
+
+def link_extracted_source(record, secret, data):
+    """رابط مصدر مستخرج: حفظ صفحته وكوكيزها ووقت انتهاء توكنه لتجديده تلقائياً"""
+    page_url = (data.get('page_url') or '').strip()
+    cookies = (data.get('cookies') or '').strip()
+    if not page_url or not cookies or record['source_url'] == 'default':
+        return
+    record['page_url'] = page_url
+    record['source_expires_at'] = url_expiry(record['source_url'])
+    secret['cookies'] = cookies
 
 @app.route('/api/stream/add', methods=['POST'])
 def api_add_stream():
@@ -90,6 +513,14 @@ def api_add_stream():
         if not stream_key:
             return jsonify({'success': False, 'error': 'يرجى إدخال مفتاح البث'}), 400
         
+        try:
+            options = pipeline_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        if capacity_full():
+            return jsonify({'success': False, 'error': 'لا توجد سعة كافية والطابور ممتلئ'}), 503
+        
         if not stream_name:
             stream_name = f'بث {datetime.now().strftime("%H:%M:%S")}'
         
@@ -97,9 +528,6 @@ def api_add_stream():
         stream_id = str(uuid.uuid4())[:8]
         session_name = f'fbstream_{stream_id}'
         
-        # تحميل البثوث الحالية
-        streams = load_streams()
-        
         # إضافة البث الجديد
         new_stream = {
             'id': stream_id,
@@ -107,44 +535,27 @@ def api_add_stream():
             'name': stream_name,
             'stream_key': stream_key[:10] + '...',  # إخفاء المفتاح
             'source_url': source_url or 'default',
+            'fanout': bool(data.get('fanout')),
             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'status': 'starting'
+            'status': 'starting',
+            **options
         }
-        streams.append(new_stream)
-        save_streams(streams)
-        
-        # بدء البث
-        env = os.environ.copy()
-        env['FB_STREAM_KEY'] = stream_key
-        if source_url:
-            # تحديث config.sh مؤقتاً للمصدر
-            update_config_source(source_url)
-        
-        subprocess.Popen(
-            ['bash', str(SCRIPTS_DIR / 'main.sh')],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            start_new_session=True,
-            cwd=str(SCRIPTS_DIR),
-            env=env,
-            preexec_fn=lambda: os.system(f'tmux rename-session -t fbstream {session_name}')
-        )
+        backups = backup_sources(data)
+        if backups:
+            new_stream['backup_sources'] = backups
+            new_stream['active_source'] = 0
+        secret = {'stream_key': stream_key}
+        link_extracted_source(new_stream, secret, data)
+        store.insert('facebook', new_stream, secret=secret)
         
-        import time
-        time.sleep(4)
-        
-        # تحديث الحالة
-        if get_stream_status(session_name):
-            for stream in streams:
-                if stream['id'] == stream_id:
-                    stream['status'] = 'running'
-            save_streams(streams)
-            return jsonify({'success': True, 'message': 'تم بدء البث بنجاح ✅', 'stream_id': stream_id})
-        else:
-            # حذف البث في حالة الفشل
-            streams = [s for s in streams if s['id'] != stream_id]
-            save_streams(streams)
-            return jsonify({'success': False, 'error': 'فشل بدء البث'}), 500
+        # بدء البث لدى العملية المالكة
+        job = jobs.submit('start', stream_id)
+        return jsonify({
+            'success': True,
+            'message': 'جاري بدء البث... ⏳',
+            'stream_id': stream_id,
+            'job_id': job['id']
+        }), 202
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -153,25 +564,13 @@ def api_add_stream():
 def api_stop_stream(stream_id):
     """إيقاف بث معين"""
     try:
-        streams = load_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'facebook')
         
         if not stream:
             return jsonify({'success': False, 'error': 'البث غير موجود'}), 404
         
-        subprocess.run(
-            ['tmux', 'kill-session', '-t', stream['session_name']],
-            check=False
-        )
-        
-        import time
-        time.sleep(1)
-        
-        # تحديث الحالة
-        stream['status'] = 'stopped'
-        save_streams(streams)
-        
-        return jsonify({'success': True, 'message': 'تم إيقاف البث'})
+        job = jobs.submit('stop', stream_id)
+        return jsonify({'success': True, 'message': 'جاري إيقاف البث', 'job_id': job['id']}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -179,21 +578,16 @@ def api_stop_stream(stream_id):
 def api_delete_stream(stream_id):
     """حذف بث من القائمة"""
     try:
-        streams = load_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'facebook')
         
         if not stream:
             return jsonify({'success': False, 'error': 'البث غير موجود'}), 404
         
-        # إيقاف البث إذا كان يعمل
-        if stream['status'] == 'running':
-            subprocess.run(['tmux', 'kill-session', '-t', stream['session_name']], check=False)
-        
-        # حذف من القائمة
-        streams = [s for s in streams if s['id'] != stream_id]
-        save_streams(streams)
+        # حذف من القائمة ثم إيقاف البث في الخلفية
+        store.delete(stream_id)
+        job = jobs.submit('delete', stream_id)
         
-        return jsonify({'success': True, 'message': 'تم حذف البث'})
+        return jsonify({'success': True, 'message': 'تم حذف البث', 'job_id': job['id']})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -201,74 +595,22 @@ def api_delete_stream(stream_id):
 def api_stream_logs(stream_id):
     """الحصول على سجلات بث معين"""
     try:
-        streams = load_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'facebook')
         
         if not stream:
             return jsonify({'error': 'البث غير موجود'}), 404
         
-        # محاولة قراءة السجلات من tmux
-        try:
-            result = subprocess.run(
-                ['tmux', 'capture-pane', '-t', stream['session_name'], '-p', '-S', '-50'],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            if result.returncode == 0:
-                logs = result.stdout.split('\n')
-                return jsonify({'logs': logs})
-        except:
-            pass
-        
-        return jsonify({'logs': ['لا توجد سجلات متاحة']})
+        return stream_logs_response(stream)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def update_config_source(source_url):
-    """تحديث مصدر البث في config.sh"""
-    config_file = SCRIPTS_DIR / 'config.sh'
-    if config_file.exists():
-        with open(config_file, 'r') as f:
-            content = f.read()
-        import re
-        content = re.sub(r'SOURCE="[^"]*"', f'SOURCE="{source_url}"', content)
-        with open(config_file, 'w') as f:
-            f.write(content)
-
 # ========== Telegram API Endpoints ==========
-TELEGRAM_STREAMS_FILE = BASE_DIR / "telegram_streams.json"
-
-def load_telegram_streams():
-    """تحميل قائمة بثوث تليجرام من الملف"""
-    if TELEGRAM_STREAMS_FILE.exists():
-        try:
-            with open(TELEGRAM_STREAMS_FILE, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (json.JSONDecodeError, ValueError):
-            # إذا كان الملف تالف، نرجع قائمة فارغة ونعيد إنشاء الملف
-            return []
-    return []
-
-def save_telegram_streams(streams):
-    """حفظ قائمة بثوث تليجرام"""
-    try:
-        with open(TELEGRAM_STREAMS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(streams if streams else [], f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"خطأ في حفظ البثوث: {e}")
+TELEGRAM_STREAMS_FILE = DATA_DIR / "telegram_streams.json"
 
 @app.route('/api/telegram/streams')
 def api_telegram_streams():
     """الحصول على قائمة جميع بثوث تليجرام"""
-    streams = load_telegram_streams()
-    for stream in streams:
-        stream['status'] = 'running' if get_stream_status(stream['session_name']) else 'stopped'
-    save_telegram_streams(streams)
-    return jsonify({'streams': streams})
+    return snapshot_response(telegram_snapshot)
 
 @app.route('/api/telegram/stream/add', methods=['POST'])
 def api_telegram_add_stream():
@@ -282,62 +624,46 @@ def api_telegram_add_stream():
         if not stream_key:
             return jsonify({'success': False, 'error': 'يرجى إدخال مفتاح البث (RTMP URL)'}), 400
         
+        try:
+            options = pipeline_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        if capacity_full():
+            return jsonify({'success': False, 'error': 'لا توجد سعة كافية والطابور ممتلئ'}), 503
+        
         if not stream_name:
             stream_name = f'بث تليجرام {datetime.now().strftime("%H:%M:%S")}'
         
         stream_id = str(uuid.uuid4())[:8]
         session_name = f'tgstream_{stream_id}'
         
-        streams = load_telegram_streams()
-        
         new_stream = {
             'id': stream_id,
             'session_name': session_name,
             'name': stream_name,
             'stream_key': stream_key[:30] + '...',
             'source_url': source_url or 'default',
+            'fanout': bool(data.get('fanout')),
             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'status': 'starting'
+            'status': 'starting',
+            **options
         }
-        streams.append(new_stream)
-        save_telegram_streams(streams)
-        
-        temp_script = f"/tmp/tg_stream_{stream_id}.sh"
-        with open(temp_script, 'w') as f:
-            f.write(f"""#!/bin/bash
-SOURCE="{source_url if source_url else 'http://soft24f.net/live/6872c3410e8cibopro/22bcpapc/237014.ts'}"
-RTMP_URL="{stream_key}"
-
-ffmpeg -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 10 \\
-  -i "$SOURCE" \\
-  -c:v libx264 -preset ultrafast -tune zerolatency \\
-  -b:v 3000k -maxrate 3500k -bufsize 6000k \\
-  -pix_fmt yuv420p -g 60 -keyint_min 60 \\
-  -c:a aac -b:a 128k -ar 44100 -ac 2 \\
-  -f flv "$RTMP_URL"
-""")
-        
-        os.chmod(temp_script, 0o755)
-        
-        subprocess.Popen(
-            ['tmux', 'new-session', '-d', '-s', session_name, temp_script],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
+        backups = backup_sources(data)
+        if backups:
+            new_stream['backup_sources'] = backups
+            new_stream['active_source'] = 0
+        secret = {'stream_key': stream_key}
+        link_extracted_source(new_stream, secret, data)
+        store.insert('telegram', new_stream, secret=secret)
         
-        import time
-        time.sleep(4)
-        
-        if get_stream_status(session_name):
-            for stream in streams:
-                if stream['id'] == stream_id:
-                    stream['status'] = 'running'
-            save_telegram_streams(streams)
-            return jsonify({'success': True, 'message': 'تم بدء البث إلى تليجرام بنجاح ✅', 'stream_id': stream_id})
-        else:
-            streams = [s for s in streams if s['id'] != stream_id]
-            save_telegram_streams(streams)
-            return jsonify({'success': False, 'error': 'فشل بدء البث'}), 500
+        job = jobs.submit('start', stream_id)
+        return jsonify({
+            'success': True,
+            'message': 'جاري بدء البث إلى تليجرام... ⏳',
+            'stream_id': stream_id,
+            'job_id': job['id']
+        }), 202
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -346,21 +672,13 @@ ffmpeg -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 10 \\
 def api_telegram_stop_stream(stream_id):
     """إيقاف بث تليجرام معين"""
     try:
-        streams = load_telegram_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'telegram')
         
         if not stream:
             return jsonify({'success': False, 'error': 'البث غير موجود'}), 404
         
-        subprocess.run(['tmux', 'kill-session', '-t', stream['session_name']], check=False)
-        
-        import time
-        time.sleep(1)
-        
-        stream['status'] = 'stopped'
-        save_telegram_streams(streams)
-        
-        return jsonify({'success': True, 'message': 'تم إيقاف البث'})
+        job = jobs.submit('stop', stream_id)
+        return jsonify({'success': True, 'message': 'جاري إيقاف البث', 'job_id': job['id']}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -368,19 +686,15 @@ def api_telegram_stop_stream(stream_id):
 def api_telegram_delete_stream(stream_id):
     """حذف بث من القائمة"""
     try:
-        streams = load_telegram_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'telegram')
         
         if not stream:
             return jsonify({'success': False, 'error': 'البث غير موجود'}), 404
         
-        if stream['status'] == 'running':
-            subprocess.run(['tmux', 'kill-session', '-t', stream['session_name']], check=False)
+        store.delete(stream_id)
+        job = jobs.submit('delete', stream_id)
         
-        streams = [s for s in streams if s['id'] != stream_id]
-        save_telegram_streams(streams)
-        
-        return jsonify({'success': True, 'message': 'تم حذف البث'})
+        return jsonify({'success': True, 'message': 'تم حذف البث', 'job_id': job['id']})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -388,32 +702,74 @@ def api_telegram_delete_stream(stream_id):
 def api_telegram_stream_logs(stream_id):
     """الحصول على سجلات بث معين"""
     try:
-        streams = load_telegram_streams()
-        stream = next((s for s in streams if s['id'] == stream_id), None)
+        stream = store.get(stream_id, 'telegram')
         
         if not stream:
             return jsonify({'error': 'البث غير موجود'}), 404
         
-        try:
-            result = subprocess.run(
-                ['tmux', 'capture-pane', '-t', stream['session_name'], '-p', '-S', '-50'],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            if result.returncode == 0:
-                logs = result.stdout.split('\n')
-                return jsonify({'logs': logs})
-        except:
-            pass
-        
-        return jsonify({'logs': ['لا توجد سجلات متاحة']})
+        return stream_logs_response(stream)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ملف آخر نتيجة استخراج وحقل رابط الصفحة فيه لكل منصة
+EXTRACT_LINK_FILES = {
+    'facebook': (BASE_DIR / 'link.json', 'facebook_url'),
+    'telegram': (BASE_DIR / 'telegram_link.json', 'telegram_url')
+}
+
+def extract_job(key, page_url, platform, secret=None):
+    """مهمة استخراج؛ key = بصمة (الصفحة، الكوكيز) لتوحيد الطلبات المتزامنة"""
+    cookies = (secret or {}).get('cookies', '')
+    result = extractor.extract(page_url, cookies, **EXTRACT_OPTIONS[platform])
+
+    link_file, source_field = EXTRACT_LINK_FILES[platform]
+    link_data = {
+        'extracted_at': result['extracted_at'],
+        source_field: page_url,
+        'stream_url': result['stream_url'],
+        'format': result['format'],
+        'status': 'active'
+    }
+    with open(link_file, 'w', encoding='utf-8') as f:
+        json.dump(link_data, f, ensure_ascii=False, indent=2)
+
+    expires_at = extract_cache.put(page_url, cookies, result)
+    return {'cached': False, 'expires_at': expires_at, **result}
+
+extract_jobs.register('extract', extract_job)
+
+def extract_response(page_url, cookies, platform, refresh=False):
+    """نتيجة من الذاكرة المؤقتة فوراً، أو مهمة استخراج في الخلفية (تُشارك إن كانت جارية)"""
+    # نفس الرابط بنفس الكوكيز استُخرج مؤخراً وتوكنه ما زال صالحاً
+    cached = None if refresh else extract_cache.get(page_url, cookies)
+    if cached:
+        return jsonify({'success': True, 'cached': True, **cached})
+
+    job = extract_jobs.submit(
+        'extract', extraction_key(page_url, cookies),
+        secret={'cookies': cookies}, single_flight=True,
+        page_url=page_url, platform=platform
+    )
+    return jsonify({
+        'success': True,
+        'cached': False,
+        'job_id': job['id'],
+        'status': job['status'],
+        'message': 'جاري الاستخراج في الخلفية'
+    }), 202
+
+@app.route('/api/extract/jobs/<job_id>')
+def api_extract_job(job_id):
+    """حالة مهمة استخراج؛ ?wait=<ثوانٍ> لانتظار انتهائها"""
+    wait = min(request.args.get('wait', 0, type=float), 60)
+    job = extract_jobs.wait(job_id, wait) if wait > 0 else extract_jobs.get(job_id)
+    if not job or job['action'] != 'extract':
+        return jsonify({'error': 'المهمة غير موجودة'}), 404
+    return jsonify({'job': job})
+
 @app.route('/api/telegram/extract', methods=['POST'])
 def api_telegram_extract():
-    """استخراج رابط M3U8 من تليجرام باستخدام requests + parsing"""
+    """استخراج رابط M3U8 من تليجرام"""
     try:
         data = request.get_json() or {}
         tg_url = data.get('tg_url', '').strip()
@@ -425,118 +781,8 @@ def api_telegram_extract():
         if not cookies_text:
             return jsonify({'success': False, 'error': 'يرجى إدخال كوكيز تليجرام'}), 400
         
-        # حفظ ملف الكوكيز
-        cookies_file = BASE_DIR / 'temp_tg_cookies.txt'
-        try:
-            with open(cookies_file, 'w', encoding='utf-8') as f:
-                f.write(cookies)
-        except Exception as e:
-            return jsonify({'success': False, 'error': f'خطأ في حفظ الكوكيز: {str(e)}'}), 500
-        
-        try:
-            # التحقق من وجود yt-dlp
-            check_ytdlp = subprocess.run(['which', 'yt-dlp'], capture_output=True)
-            if check_ytdlp.returncode != 0:
-                if cookies_file.exists():
-                    cookies_file.unlink()
-                return jsonify({
-                    'success': False,
-                    'error': 'yt-dlp غير مثبت. قم بتثبيته أولاً: pip install yt-dlp'
-                }), 500
-            
-            # استخراج الرابط
-            result = subprocess.run(
-                ['yt-dlp', '--cookies', str(cookies_file), '--get-url', '-f', 'best', tg_url],
-                capture_output=True,
-                text=True,
-                timeout=45,
-                cwd=str(BASE_DIR)
-            )
-            
-            # حذف ملف الكوكيز
-            if cookies_file.exists():
-                cookies_file.unlink()
-            
-            # معالجة النتيجة
-            if result.returncode != 0:
-                error_msg = result.stderr or 'فشل الاستخراج'
-                return jsonify({
-                    'success': False, 
-                    'error': f'خطأ في yt-dlp: {error_msg[:200]}'
-                }), 500
-            
-            # البحث عن الرابط
-            stream_url = None
-            output_lines = result.stdout.strip().split('\n')
-            
-            # البحث عن M3U8 أولاً
-            for line in output_lines:
-                if line.startswith('http') and '.m3u8' in line:
-                    stream_url = line.strip()
-                    break
-            
-            # إذا لم نجد M3U8، نأخذ أي رابط HTTP
-            if not stream_url:
-                for line in output_lines:
-                    if line.startswith('http'):
-                        stream_url = line.strip()
-                        break
-            
-            if not stream_url:
-                return jsonify({
-                    'success': False,
-                    'error': 'لم يتم العثور على رابط البث. تأكد أن البث مباشر الآن وملف الكوكيز صحيح'
-                }), 500
-            
-            # تحديد نوع الرابط
-            if '.m3u8' in stream_url:
-                format_type = 'M3U8 (HLS)'
-            elif '.mpd' in stream_url:
-                format_type = 'DASH (MPD)'
-            else:
-                format_type = 'Direct Stream'
-            
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # حفظ البيانات
-            link_data = {
-                'extracted_at': timestamp,
-                'telegram_url': tg_url,
-                'stream_url': stream_url,
-                'format': format_type,
-                'status': 'active'
-            }
-            
-            link_file = BASE_DIR / 'telegram_link.json'
-            with open(link_file, 'w', encoding='utf-8') as f:
-                json.dump(link_data, f, ensure_ascii=False, indent=2)
-            
-            return jsonify({
-                'success': True,
-                'stream_url': stream_url,
-                'format': format_type,
-                'extracted_at': timestamp
-            })
-            
-        except subprocess.TimeoutExpired:
-            if 'cookies_file' in locals() and cookies_file.exists():
-                cookies_file.unlink()
-            return jsonify({
-                'success': False,
-                'error': 'انتهت مهلة الاستخراج (45 ثانية)'
-            }), 500
-        except FileNotFoundError:
-            if 'cookies_file' in locals() and cookies_file.exists():
-                cookies_file.unlink()
-            return jsonify({
-                'success': False,
-                'error': 'yt-dlp غير موجود. ثبته بـ: pip install yt-dlp'
-            }), 500
-            
+        return extract_response(tg_url, cookies_text, 'telegram', refresh=bool(data.get('refresh')))
     except Exception as e:
-        cookies_file = BASE_DIR / 'temp_tg_cookies.txt'
-        if cookies_file.exists():
-            cookies_file.unlink()
         return jsonify({'success': False, 'error': f'خطأ غير متوقع: {str(e)}'}), 500
 
 @app.route('/api/extract', methods=['POST'])
@@ -552,72 +798,339 @@ def api_extract():
         if not cookies:
             return jsonify({'success': False, 'error': 'يرجى إدخال محتوى ملف الكوكيز'}), 400
         
-        cookies_file = BASE_DIR / 'temp_cookies.txt'
-        with open(cookies_file, 'w') as f:
-            f.write(cookies)
-        
+        return extract_response(fb_url, cookies, 'facebook', refresh=bool(data.get('refresh')))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ========== Bulk Operations ==========
+# بثوث عملية إيقاف جماعية جارية: حالاتها تُحفظ معاً في نهايتها لا بثاً بثاً
+bulk_held = set()
+
+def select_streams(data):
+    """البثوث المستهدفة: ids صريحة، أو selector يطابق النوع والمصدر والحالة
+
+    يعيد (المعرفات الموجودة، المعرفات غير الموجودة).
+    """
+    if 'ids' in data:
+        ids = data['ids'] or []
+        if not isinstance(ids, list) or not all(isinstance(stream_id, str) for stream_id in ids):
+            raise ValueError('ids يجب أن تكون قائمة معرفات نصية')
+        ids = list(dict.fromkeys(ids))
+        found = [stream_id for stream_id in ids if store.kind_of(stream_id)]
+        return found, [stream_id for stream_id in ids if stream_id not in found]
+
+    selector = data.get('selector') or {}
+    if not isinstance(selector, dict):
+        raise ValueError('selector يجب أن يكون كائناً {kind, source_url, status}')
+    unknown = set(selector) - {'kind', 'source_url', 'status'}
+    if unknown:
+        raise ValueError(f"حقول غير معروفة في selector: {', '.join(sorted(unknown))}")
+    if selector.get('kind') not in (None, '', 'facebook', 'telegram'):
+        raise ValueError('kind يجب أن يكون facebook أو telegram')
+    for field in ('source_url', 'status'):
+        if not isinstance(selector.get(field) or '', str):
+            raise ValueError(f'{field} يجب أن يكون نصاً')
+    kinds = [selector['kind']] if selector.get('kind') else ['facebook', 'telegram']
+    source_url = (selector.get('source_url') or '').strip()
+    selected = []
+    for kind in kinds:
+        for stream in store.list(kind):
+            if source_url and source_url not in (stream_source(stream), stream.get('page_url')):
+                continue
+            if selector.get('status') and stream.get('status') != selector['status']:
+                continue
+            selected.append(stream['id'])
+    return selected, []
+
+def start_saved_stream(stream_id):
+    """تشغيل بث محفوظ متوقف (بث يعمل بالفعل يُترك كما هو، والفشل لا يحذفه)"""
+    if supervisor.status(stream_id) in ('starting', 'running'):
+        return
+    start_stream_job(stream_id, restart=True)
+
+def bulk_stream_job(_stream_id, operation, ids):
+    """مهمة خلفية: عملية واحدة على عدة بثوث بالتوازي (BULK_WORKERS)؛ يعيد نتيجة كل بث
+
+    الإيقاف يؤجل حفظ حالة كل بث ثم يحفظها جميعاً بكتابة واحدة للمخزن.
+    """
+    handler = {
+        'start': start_saved_stream,
+        'stop': stop_stream,
+        'restart': restart_stream,
+        'delete': forget_stream,
+    }[operation]
+    held = ids if operation == 'stop' else []
+    bulk_held.update(held)
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk') as executor:
+            futures = {stream_id: executor.submit(handler, stream_id) for stream_id in ids}
+            for stream_id, future in futures.items():
+                try:
+                    future.result()
+                    results[stream_id] = {'success': True}
+                except Exception as e:
+                    results[stream_id] = {'success': False, 'error': str(e)}
+    finally:
+        bulk_held.difference_update(held)
+    if held:
+        store.update_many(
+            [stream_id for stream_id, result in results.items() if result['success']], status='stopped', pid=None
+        )
+        # بث فشل إيقافه: حالته الفعلية لدى المشرف
+        for stream_id, result in results.items():
+            state = supervisor.state(stream_id)
+            if not result['success'] and state:
+                store.update(stream_id, status=state['status'], pid=state['pid'])
+    return {'operation': operation, 'results': results}
+
+jobs.register('bulk', bulk_stream_job)
+
+@app.route('/api/streams/bulk', methods=['POST'])
+def api_bulk_streams():
+    """عملية واحدة (start/stop/restart/delete) على قائمة ids أو selector
+
+    {"action": "stop", "ids": [...]} أو {"action": "stop", "selector": {"kind": "telegram",
+    "source_url": "...", "status": "running"}}؛ ?wait=<ثوانٍ> يعيد نتيجة كل بث مباشرة.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'يجب أن يكون الطلب كائن JSON'}), 400
+        action = data.get('action')
+        if action not in BULK_ACTIONS:
+            error = f"العملية يجب أن تكون إحدى: {', '.join(BULK_ACTIONS)}"
+            return jsonify({'success': False, 'error': error}), 400
+        if 'ids' not in data and not data.get('selector'):
+            return jsonify({'success': False, 'error': 'يرجى تحديد ids أو selector'}), 400
+
         try:
-            result = subprocess.run(
-                ['yt-dlp', '--cookies', str(cookies_file), '--get-url', fb_url],
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if cookies_file.exists():
-                cookies_file.unlink()
-            
-            if result.returncode != 0:
-                return jsonify({
-                    'success': False, 
-                    'error': 'فشل الاستخراج - تأكد من أن البث مباشر الآن وملف الكوكيز صحيح'
-                }), 500
-            
-            stream_url = None
-            for line in result.stdout.split('\n'):
-                if line.startswith('http'):
-                    stream_url = line.strip()
-                    break
-            
-            if not stream_url:
-                return jsonify({
-                    'success': False,
-                    'error': 'لم يتم العثور على رابط البث'
-                }), 500
-            
-            format_type = 'M3U8 (HLS)' if '.m3u8' in stream_url else 'DASH (MPD)'
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            link_data = {
-                'extracted_at': timestamp,
-                'facebook_url': fb_url,
-                'stream_url': stream_url,
-                'format': format_type,
-                'status': 'active'
-            }
-            
-            link_file = BASE_DIR / 'link.json'
-            with open(link_file, 'w', encoding='utf-8') as f:
-                json.dump(link_data, f, ensure_ascii=False, indent=2)
-            
-            return jsonify({
-                'success': True,
-                'stream_url': stream_url,
-                'format': format_type,
-                'extracted_at': timestamp
-            })
-            
-        except subprocess.TimeoutExpired:
-            if cookies_file.exists():
-                cookies_file.unlink()
-            return jsonify({
-                'success': False,
-                'error': 'انتهت مهلة الاستخراج'
-            }), 500
-            
+            ids, missing = select_streams(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        results = {stream_id: {'success': False, 'error': 'البث غير موجود'} for stream_id in missing}
+        if not ids:
+            return jsonify({'success': True, 'ids': [], 'results': results})
+        if action == 'delete':
+            # حذف من القوائم بكتابة واحدة ثم إيقاف العمليات في الخلفية
+            store.delete_many(ids)
+
+        job = jobs.submit('bulk', None, operation=action, ids=ids)
+        wait = min(request.args.get('wait', 0, type=float), 60)
+        if wait > 0:
+            job = jobs.wait(job['id'], wait) or job
+        if job.get('result'):
+            results.update(job['result']['results'])
+            return jsonify({'success': True, 'job_id': job['id'], 'ids': ids, 'results': results})
+        return jsonify({'success': True, 'job_id': job['id'], 'ids': ids, 'results': results}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ========== Status Snapshots & Events ==========
+def on_snapshot_change(name, version):
+    # حدث محلي: كل عملية تلاحظ تغيّر إصدار المخزن بنفسها
+    events.publish('snapshot', {'name': name, 'version': version})
+
+facebook_snapshot = StatusSnapshot('fb', store, 'facebook', on_change=on_snapshot_change)
+telegram_snapshot = StatusSnapshot('tg', store, 'telegram', on_change=on_snapshot_change)
+snapshots = {'facebook': facebook_snapshot, 'telegram': telegram_snapshot}
+
+def on_stream_state_change(stream_id, state):
+    """حفظ الحالة في المخزن (لجميع العمليات) ودفع الانتقال فوراً"""
+    if stream_id not in bulk_held:
+        store.update(stream_id, status=state['status'], pid=state['pid'])
+    if state['status'] in ('stopped', 'failed'):
+        fanout.detach(stream_id)
+        capacity.release(stream_id)
+        log_files.close(stream_id)
+    relay.emit('state', {
+        'id': stream_id,
+        'status': state['status'],
+        'exit_code': state['exit_code']
+    })
+
+def on_stream_log(stream_id, line, replace):
+    relay.emit('log', {'id': stream_id, 'line': line, 'replace': replace})
+    log_files.write(stream_id, line, replace)
+
+def on_fanout_exit(key, exit_code, stream_ids, logs):
+    """توقف المُرمِّز المشترك: تحرير كلفته، وإظهار سبب التوقف في سجلات وجهاته"""
+    capacity.release(f'fanout:{key}')
+    lines = [f'توقف المُرمِّز المشترك ({exit_code}) للمصدر {key}'] + logs[-5:]
+    for stream_id in stream_ids:
+        for line in lines:
+            relay.emit('log', {'id': stream_id, 'line': line, 'replace': False})
+            log_files.write(stream_id, line)
+        if exit_code:
+            # الوجهة ستخرج بلا خطأ عند إغلاق أنبوبها، لكن البث انقطع فعلاً
+            watchdog.report(stream_id, f'توقف المُرمِّز المشترك ({exit_code})')
+
+def on_fanout_switch(key, index, reason, stream_ids):
+    """انتقال المُرمِّز المشترك إلى مصدر آخر (الوجهات واتصالات RTMP باقية)"""
+    if reason == 'refresh':
+        return
+    if index:
+        line = f'انتقال إلى المصدر الاحتياطي {index} ({reason}) دون قطع البث'
+    else:
+        line = f'العودة إلى المصدر الأساسي ({reason})'
+    for stream_id in stream_ids:
+        store.update(stream_id, active_source=index)
+        on_stream_log(stream_id, line, False)
+
+def restart_stream(stream_id):
+    """إعادة تشغيل بث غير سليم (من المراقب) دون المرور بطابور المهام"""
+    if not store.kind_of(stream_id):
+        watchdog.forget(stream_id)
+        return
+    supervisor.stop(stream_id)
+    start_stream_job(stream_id, restart=True)
+
+def on_watchdog_restart(stream_id, reason, delay, count):
+    store.update(stream_id, restarts=count)
+    on_stream_log(stream_id, f'⚠️ البث غير سليم: {reason}. إعادة التشغيل رقم {count} بعد {delay} ثانية', False)
+
+def on_watchdog_failed(stream_id, reason, count):
+    """تكرر الانهيار: إيقاف المحاولات وإظهار البث فاشلاً"""
+    on_stream_log(stream_id, f'❌ توقفت إعادة التشغيل بعد {count} محاولات ({reason})', False)
+    if not supervisor.stop(stream_id, failed=True):
+        store.update(stream_id, status='failed', pid=None)
+        relay.emit('state', {'id': stream_id, 'status': 'failed', 'exit_code': None})
+
+supervisor.add_listener(on_stream_state_change)
+supervisor.add_log_listener(on_stream_log)
+supervisor.add_listener(watchdog.on_state)
+supervisor.add_log_listener(watchdog.on_log)
+
+def reconcile_streams():
+    """بعد تولي الملكية: مطابقة الحالة المحفوظة مع العمليات الحية
+
+    بث يجب أن يعمل وعمليته ما زالت حية يُتبنّى كما هو، وبقية هذه البثوث تُستأنف
+    بمهام resume (عمّال JobManager يحدّون عدد التشغيلات المتزامنة). أي عملية أخرى
+    تركها المالك السابق تُنهى.
+    """
+    adopted = resumed = 0
+    for kind in ('facebook', 'telegram'):
+        for stream in store.list(kind):
+            pid = stream.get('pid')
+            desired = stream.get('status') in ('starting', 'running', 'queued')
+            # مدخل الوجهة كان أنبوباً أو مُرحِّلاً لدى المالك السابق فلا تعيش بعده
+            adoptable = not uses_fanout(stream) and not (HLS_RELAY and is_hls(stream_source(stream)))
+            if pid and desired and adoptable and supervisor.adopt(stream['id'], pid):
+                video = (stream.get('codecs') or {}).get('video')
+                capacity.reserve(stream['id'], capacity.cost(stream_preset(kind, stream), copy=video == 'copy'))
+                adopted += 1
+                continue
+            if pid and owns_process(stream['id'], pid):
+                try:
+                    os.killpg(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            if desired:
+                store.update(stream['id'], status='starting', pid=None)
+                jobs.submit('resume', stream['id'], single_flight=True)
+                resumed += 1
+            elif pid:
+                store.update(stream['id'], pid=None)
+    if adopted or resumed:
+        print(f"استئناف البثوث: {adopted} متبناة و {resumed} يُعاد تشغيلها")
+
+def publish_metrics():
+    """المالك ينشر مقاييس جميع البثوث في المخزن حتى تقرأها أي عملية"""
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        try:
+            store.set_meta('metrics', {'published_at': time.time(), 'streams': supervisor.all_metrics()})
+        except Exception as e:
+            print(f"خطأ في نشر المقاييس: {e}")
+
+def ensure_fresh_source(kind, stream):
+    """قبل تشغيل بث من رابط مستخرج: تجديد الرابط إذا انتهى توكنه أو قارب"""
+    expires_at = stream.get('source_expires_at')
+    if not expires_at or expires_at - time.time() > SOURCE_REFRESH_LEAD:
+        return stream
+    cookies = store.get_secret(stream['id']).get('cookies', '')
+    result = extractor.extract(stream['page_url'], cookies, **EXTRACT_OPTIONS[kind])
+    extract_cache.put(stream['page_url'], cookies, result)
+    return store.update(
+        stream['id'], source_url=result['stream_url'], source_expires_at=url_expiry(result['stream_url'])
+    ) or stream
+
+def refresh_source(kind, page_url, streams):
+    """إعادة استخراج رابط صفحة واحدة وتبديل مُرمِّزها المشترك تحت الوجهات الحية"""
+    cookies = store.get_secret(streams[0]['id']).get('cookies', '')
+    result = extractor.extract(page_url, cookies, **EXTRACT_OPTIONS[kind])
+    extract_cache.put(page_url, cookies, result)
+    source_url = result['stream_url']
+    preset = capacity.presets.get(stream_preset(kind, streams[0]))
+    variant_url, variant = select_variant(hls_relay.local_url(source_url), preset)
+    codecs = streams[0].get('codecs') or {'video': 'encode', 'audio': 'aac'}
+    key = fanout_key(kind, streams[0])
+    args = fanout_encoders(streams[0], stream_profile(kind, streams[0], codecs, source_url=variant_url))[0]
+    if not fanout.swap(key, 0, args, STREAM_READY_TIMEOUT, reason='refresh'):
+        raise RuntimeError('الرابط الجديد لم يُخرج أي بيانات')
+    fields = {'source_url': source_url, 'source_expires_at': url_expiry(source_url), 'variant': variant}
+    if streams[0].get('backup_sources'):
+        fields['active_source'] = 0
+    for stream in streams:
+        store.update(stream['id'], **fields)
+        on_stream_log(stream['id'], 'تم تجديد رابط المصدر قبل انتهاء صلاحيته دون قطع البث', False)
+
+def refresh_sources():
+    """حلقة المالك: تجديد روابط المصادر المستخرجة التي يقترب انتهاء توكنها"""
+    retry_at = {}
+    while True:
+        time.sleep(SOURCE_REFRESH_CHECK)
+        now = time.time()
+        due = {}
+        try:
+            for kind in ('facebook', 'telegram'):
+                for stream in store.list(kind):
+                    expires_at = stream.get('source_expires_at')
+                    if (stream.get('status') == 'running' and stream.get('page_url') and expires_at
+                            and expires_at - now <= SOURCE_REFRESH_LEAD
+                            and fanout.active(fanout_key(kind, stream))):
+                        due.setdefault((kind, fanout_key(kind, stream)), []).append(stream)
+        except Exception as e:
+            print(f"خطأ في فحص صلاحية المصادر: {e}")
+        for (kind, key), streams in due.items():
+            if retry_at.get(key, 0) > now:
+                continue
+            try:
+                refresh_source(kind, streams[0]['page_url'], streams)
+                retry_at.pop(key, None)
+            except Exception as e:
+                # محاولة أخرى بعد دقيقة ما دام التوكن القديم صالحاً
+                retry_at[key] = now + 60
+                for stream in streams:
+                    on_stream_log(stream['id'], f'تعذّر تجديد رابط المصدر: {e}', False)
+
+def on_elected():
+    """هذه العملية أصبحت المالكة: مطابقة ما تركه السابق ثم تنفيذ المهام"""
+    if HLS_RELAY:
+        hls_relay.start()
+    # آخر كلفة مقاسة تُستخدم فوراً، والمعايرة الجديدة تعمل في الخلفية
+    capacity.load_costs(store.get_meta('capacity', {}).get('preset_costs', {}))
+    reconcile_streams()
+    if CAPACITY_CALIBRATE:
+        threading.Thread(target=capacity.calibrate, name='capacity-calibration', daemon=True).start()
+    threading.Thread(target=publish_metrics, name='metrics-publisher', daemon=True).start()
+    threading.Thread(target=refresh_sources, name='source-refresh', daemon=True).start()
+    log_files.start()
+    watchdog.start()
+    jobs.start()
+    threading.Thread(target=extractor.warm, name='extract-warmup', daemon=True).start()
+    extract_jobs.start()
+
+election = OwnerElection(OWNER_LOCK_FILE, on_elected)
+
+# ترحيل ملفات JSON القديمة إلى المخزن عند أول تشغيل
+store.import_json('facebook', STREAMS_FILE)
+store.import_json('telegram', TELEGRAM_STREAMS_FILE)
+relay.start()
+facebook_snapshot.start()
+telegram_snapshot.start()
+election.start()
+
 if __name__ == '__main__':
     LOGS_DIR.mkdir(exist_ok=True)
     app.run(host='0.0.0.0', port=5000, debug=False)